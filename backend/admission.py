@@ -0,0 +1,165 @@
+# backend/admission.py
+"""
+Disk-space admission control.
+
+Before a job starts writing, it reserves its expected size (yt_dlp's
+filesize / filesize_approx, the direct server's Content-Length, the torrent's
+total size) against the free space of the target filesystem. Space already
+reserved by other running jobs counts as used, so two big jobs cannot both be
+admitted into room for one. A job that only fits once other reservations go
+away (cancelled jobs, estimates that turn out too high, files deleted) waits and
+reports why; a job bigger than the filesystem's free space fails at once instead
+of at 95%.
+
+Reservations shrink as the job writes (update()), since written bytes already
+show up in the filesystem's free space. A job of unknown size reserves nothing
+and only waits while the filesystem is below the safety margin itself.
+
+    ADMISSION_MIN_FREE=100M        always keep this much free
+    ADMISSION_RECHECK_SECONDS=5
+"""
+
+import os
+import shutil
+import threading
+from typing import Callable, Dict, Optional
+
+from bandwidth import parse_rate
+
+MIN_FREE = parse_rate(os.environ.get("ADMISSION_MIN_FREE", "100M"))
+RECHECK_SECONDS = float(os.environ.get("ADMISSION_RECHECK_SECONDS", "5"))
+# audio jobs also write the converted file next to the download for a moment
+AUDIO_OVERHEAD = 1.3
+
+
+class DiskFull(Exception):
+    error_class = "permanent"  # see retry.classify
+
+
+def expected_size(info: Optional[dict], mode: str = "video") -> int:
+    """Bytes a yt_dlp job will write, from its extracted info dict (0 = unknown)."""
+    if not info:
+        return 0
+    total = 0
+    for f in info.get("requested_formats") or [info]:
+        size = f.get("filesize") or f.get("filesize_approx")
+        if not size and f.get("tbr") and info.get("duration"):
+            size = f["tbr"] * 1000 / 8 * info["duration"]
+        if not size:
+            return 0
+        total += size
+    return int(total * (AUDIO_OVERHEAD if mode == "audio" else 1))
+
+
+def _device(path: str) -> int:
+    return os.stat(path).st_dev
+
+
+def format_bytes(n: int) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(n) < 1024:
+            return f"{n:.0f} {unit}"
+        n /= 1024
+    return f"{n:.1f} TB"
+
+
+class _Reservation:
+    def __init__(self, path: str, size: int):
+        self.path = path
+        self.device = _device(path)
+        self.size = size
+        self.written: Dict[str, int] = {}
+
+    @property
+    def remaining(self) -> int:
+        return max(0, self.size - sum(self.written.values()))
+
+
+class AdmissionController:
+    def __init__(self, min_free: int = MIN_FREE):
+        self.min_free = min_free
+        self._reservations: Dict[str, _Reservation] = {}
+        self._lock = threading.Lock()
+        self._released = threading.Condition(self._lock)
+
+    def _reserved_on(self, device: int, exclude: Optional[str] = None) -> int:
+        return sum(r.remaining for job_id, r in self._reservations.items()
+                   if r.device == device and job_id != exclude)
+
+    def available(self, path: str) -> int:
+        """Free bytes at `path` not promised to running jobs (minus the safety margin)."""
+        with self._lock:
+            return self._available(path)
+
+    def _available(self, path: str) -> int:
+        return shutil.disk_usage(path).free - self._reserved_on(_device(path)) - self.min_free
+
+    def acquire(self, job_id: str, path: str, size: int, cancel_event: Optional[threading.Event] = None,
+                on_wait: Optional[Callable[[dict], None]] = None):
+        """
+        Reserve `size` bytes at `path` for `job_id`, waiting while they do not fit.
+        Raises DiskFull when the job can never fit, or Exception("Download cancelled")
+        when `cancel_event` is set while waiting.
+        """
+        unwatch = cancel_event.on_cancel(self._wake) if hasattr(cancel_event, "on_cancel") else (lambda: None)
+        try:
+            self._acquire(job_id, path, size, cancel_event, on_wait)
+        finally:
+            unwatch()
+
+    def _acquire(self, job_id, path, size, cancel_event, on_wait):
+        notified = False
+        while True:
+            with self._lock:
+                waiting = self._try_reserve(job_id, path, size)
+                if waiting is None:
+                    return
+                if cancel_event is not None and cancel_event.is_set():
+                    raise Exception("Download cancelled")
+                if notified or not on_wait:
+                    self._released.wait(timeout=RECHECK_SECONDS)
+                    continue
+            # outside the lock: the callback publishes progress and must not stall release()
+            notified = True
+            on_wait(waiting)
+
+    def _try_reserve(self, job_id, path, size) -> Optional[dict]:
+        """Reserve and return None, or return why the job has to wait. Called with the lock held."""
+        usage = shutil.disk_usage(path)
+        if not size:
+            # unknown size: nothing to reserve, only the safety margin itself is enforced
+            if usage.free >= self.min_free:
+                self._reservations[job_id] = _Reservation(path, 0)
+                return None
+            return {"needed": self.min_free, "available": usage.free, "path": path}
+        if size > usage.free - self.min_free:
+            raise DiskFull(f"not enough disk space: need {format_bytes(size)}, "
+                           f"{format_bytes(usage.free)} free in {path}")
+        if size <= self._available(path):
+            self._reservations[job_id] = _Reservation(path, size)
+            return None
+        return {"needed": size, "available": max(0, self._available(path)), "path": path}
+
+    def _wake(self):
+        with self._lock:
+            self._released.notify_all()
+
+    def update(self, job_id: str, written: Optional[int], part: str = ""):
+        """Record bytes `job_id` has written to file `part` (its reservation shrinks by as much)."""
+        reservation = self._reservations.get(job_id)
+        if reservation is not None and written:
+            reservation.written[part] = written
+
+    def release(self, job_id: str):
+        with self._lock:
+            if self._reservations.pop(job_id, None) is not None:
+                self._released.notify_all()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            jobs = [{"id": job_id, "path": r.path, "size": r.size, "remaining": r.remaining}
+                    for job_id, r in self._reservations.items()]
+        return {"min_free": self.min_free, "reservations": jobs}
+
+
+admission = AdmissionController()
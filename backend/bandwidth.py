@@ -0,0 +1,262 @@
+# backend/bandwidth.py
+"""
+Global bandwidth scheduler shared by yt_dlp downloads and libtorrent.
+
+Jobs register with a weight and an `apply` callback that pushes a rate limit
+(bytes/s, 0 = unlimited) into the engine: libtorrent takes per-handle limits,
+while yt_dlp jobs (downloader.HookThrottle) and the ranged downloader draw their
+bytes from the job's token bucket (see throttle below). A rebalance
+thread splits the current global cap between jobs by weighted max-min fairness
+using the rates they actually achieve, so bandwidth one subsystem leaves idle is
+handed to the other instead of being reserved.
+
+The cap can follow a time-of-day schedule (e.g. full speed off-peak):
+    BANDWIDTH_LIMIT=8M
+    BANDWIDTH_SCHEDULE="00:00-07:00=0;18:00-23:00=2M"    (0 = unlimited)
+
+Engines that move bytes themselves can call throttle(job_id, n), which draws
+from a per-job token bucket refilled at the job's allocation.
+"""
+
+import datetime
+import os
+import re
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+REBALANCE_INTERVAL = float(os.environ.get("BANDWIDTH_REBALANCE_SECONDS", "1.0"))
+# a job is assumed to want this much more than it currently gets, so it can grow
+DEMAND_HEADROOM = 1.25
+MIN_ALLOCATION = 16 * 1024
+
+
+def parse_rate(value) -> int:
+    """'8M' / '512K' / '1.5G' / 1048576 -> bytes per second (0 = unlimited)."""
+    if value in (None, ""):
+        return 0
+    if isinstance(value, (int, float)):
+        return int(value)
+    m = re.fullmatch(r"\s*([\d.]+)\s*([kmg]?)i?b?\s*", str(value).lower())
+    if not m:
+        raise ValueError(f"invalid rate: {value!r}")
+    mult = {"": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3}[m.group(2)]
+    return int(float(m.group(1)) * mult)
+
+
+def parse_schedule(spec: str) -> List[Tuple[int, int, int]]:
+    """'00:00-07:00=0;18:00-23:00=2M' -> [(start_min, end_min, rate), ...]"""
+    windows = []
+    for part in filter(None, (p.strip() for p in (spec or "").split(";"))):
+        span, rate = part.split("=", 1)
+        start, end = span.split("-", 1)
+        windows.append((_minutes(start), _minutes(end), parse_rate(rate)))
+    return windows
+
+
+def _minutes(hhmm: str) -> int:
+    h, m = hhmm.strip().split(":")
+    return int(h) * 60 + int(m)
+
+
+class TokenBucket:
+    """Classic token bucket; rate 0 means unlimited."""
+
+    def __init__(self, rate: int, burst: Optional[int] = None):
+        self.rate = rate
+        self.burst = burst or max(rate, MIN_ALLOCATION)
+        self.tokens = float(self.burst)
+        self.stamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def set_rate(self, rate: int):
+        with self._lock:
+            self.rate = rate
+            self.burst = max(rate, MIN_ALLOCATION)
+            self.tokens = min(self.tokens, self.burst)
+
+    def consume(self, n: int):
+        """Block until `n` bytes may be transferred."""
+        while True:
+            with self._lock:
+                if self.rate <= 0:
+                    return
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+                self.stamp = now
+                if self.tokens >= n or self.tokens >= self.burst:
+                    self.tokens -= n
+                    return
+                wait = (n - self.tokens) / self.rate
+            time.sleep(min(wait, 0.5))
+
+
+class _Job:
+    def __init__(self, job_id: str, kind: str, weight: float, apply: Callable[[int], None]):
+        self.job_id = job_id
+        self.kind = kind
+        self.weight = max(weight, 0.01)
+        self.apply = apply
+        self.observed = 0.0
+        self.allocation = 0
+        self.bucket = TokenBucket(0)
+
+
+class BandwidthManager:
+    def __init__(self, limit: int = 0, schedule: Optional[List[Tuple[int, int, int]]] = None,
+                 upload_limit: int = 1024 * 1024):
+        self.limit = limit
+        self.schedule = schedule or []
+        self.upload_limit = upload_limit
+        self._jobs: Dict[str, _Job] = {}
+        self._upload_listeners: List[Callable[[int], None]] = []
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    # --- configuration ---
+    def configure(self, limit=None, schedule=None, upload_limit=None):
+        with self._lock:
+            if limit is not None:
+                self.limit = parse_rate(limit)
+            if schedule is not None:
+                self.schedule = parse_schedule(schedule) if isinstance(schedule, str) else schedule
+            if upload_limit is not None:
+                self.upload_limit = parse_rate(upload_limit)
+            listeners = list(self._upload_listeners) if upload_limit is not None else []
+        for listener in listeners:
+            try:
+                listener(self.upload_limit)
+            except Exception as e:
+                print(f"[bandwidth] upload limit listener failed: {e}")
+        self.rebalance()
+
+    def on_upload_limit(self, listener: Callable[[int], None]):
+        """Call `listener(bytes_per_s)` whenever the upload limit is reconfigured."""
+        with self._lock:
+            self._upload_listeners.append(listener)
+
+    def current_cap(self, now: Optional[datetime.datetime] = None) -> int:
+        """Global cap in force right now: the first matching schedule window, else the base limit."""
+        now = now or datetime.datetime.now()
+        minute = now.hour * 60 + now.minute
+        for start, end, rate in self.schedule:
+            inside = start <= minute < end if start <= end else (minute >= start or minute < end)
+            if inside:
+                return rate
+        return self.limit
+
+    # --- jobs ---
+    def register(self, job_id: str, kind: str, apply: Callable[[int], None], weight: float = 1.0) -> int:
+        """Add a job; returns its initial allocation (0 = unlimited)."""
+        with self._lock:
+            self._jobs[job_id] = _Job(job_id, kind, weight, apply)
+        self._ensure_thread()
+        self.rebalance()
+        job = self._jobs.get(job_id)
+        return job.allocation if job else 0
+
+    def unregister(self, job_id: str):
+        with self._lock:
+            self._jobs.pop(job_id, None)
+        self.rebalance()
+
+    def set_weight(self, job_id: str, weight: float) -> bool:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if not job:
+                return False
+            job.weight = max(float(weight), 0.01)
+        self.rebalance()
+        return True
+
+    def report(self, job_id: str, rate) -> None:
+        """Record the rate a job achieved (bytes/s), from progress hooks / torrent status."""
+        job = self._jobs.get(job_id)
+        if job is not None and rate is not None:
+            # smooth a little; progress ticks are noisy
+            job.observed = 0.7 * job.observed + 0.3 * float(rate)
+
+    def throttle(self, job_id: str, nbytes: int):
+        job = self._jobs.get(job_id)
+        if job is not None:
+            job.bucket.consume(nbytes)
+
+    # --- allocation ---
+    def rebalance(self):
+        cap = self.current_cap()
+        with self._lock:
+            jobs = list(self._jobs.values())
+        if not jobs:
+            return
+        allocations = allocate(cap, [(j.job_id, j.weight, self._demand(j)) for j in jobs])
+        for job in jobs:
+            limit = allocations.get(job.job_id, 0)
+            if limit != job.allocation:
+                job.allocation = limit
+                job.bucket.set_rate(limit)
+                try:
+                    job.apply(limit)
+                except Exception as e:
+                    print(f"[bandwidth] apply failed for {job.job_id}: {e}")
+
+    def _demand(self, job: _Job) -> float:
+        # no measurement yet (or just started): wants as much as it can get
+        if job.observed <= 0 or job.allocation <= 0:
+            return float("inf")
+        # using its allocation fully -> could use more; otherwise it is satisfied at its rate
+        if job.observed >= 0.9 * job.allocation:
+            return float("inf")
+        return max(job.observed * DEMAND_HEADROOM, MIN_ALLOCATION)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            jobs = [{"id": j.job_id, "kind": j.kind, "weight": j.weight,
+                     "allocation": j.allocation, "observed": int(j.observed)} for j in self._jobs.values()]
+        return {"limit": self.limit, "cap": self.current_cap(), "upload_limit": self.upload_limit,
+                "schedule": self.schedule, "jobs": jobs}
+
+    def _ensure_thread(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._loop, daemon=True, name="bandwidth")
+        self._thread.start()
+
+    def _loop(self):
+        while True:
+            time.sleep(REBALANCE_INTERVAL)
+            try:
+                self.rebalance()
+            except Exception as e:
+                print(f"[bandwidth] rebalance error: {e}")
+
+
+def allocate(cap: int, jobs: List[Tuple[str, float, float]]) -> Dict[str, int]:
+    """
+    Weighted max-min fair split of `cap` bytes/s between (job_id, weight, demand) items.
+    Jobs whose demand is below their fair share get their demand; the rest is
+    redistributed among the others by weight. cap 0 = unlimited for everyone.
+    """
+    if cap <= 0:
+        return {job_id: 0 for job_id, _, _ in jobs}
+    remaining = float(cap)
+    pending = list(jobs)
+    result: Dict[str, int] = {}
+    while pending:
+        total_weight = sum(w for _, w, _ in pending)
+        satisfied = [(j, w, d) for j, w, d in pending if d <= remaining * w / total_weight]
+        if not satisfied:
+            for job_id, weight, _ in pending:
+                result[job_id] = max(int(remaining * weight / total_weight), MIN_ALLOCATION)
+            break
+        for job_id, weight, demand in satisfied:
+            result[job_id] = max(int(demand), MIN_ALLOCATION)
+            remaining -= demand
+        pending = [item for item in pending if item not in satisfied]
+    return result
+
+
+bandwidth_manager = BandwidthManager(
+    limit=parse_rate(os.environ.get("BANDWIDTH_LIMIT", "0")),
+    schedule=parse_schedule(os.environ.get("BANDWIDTH_SCHEDULE", "")),
+    upload_limit=parse_rate(os.environ.get("BANDWIDTH_UPLOAD_LIMIT", "1M")),
+)
@@ -0,0 +1,98 @@
+# backend/bench/bench_transcode.py
+"""
+Compare single-process vs segment-parallel ffmpeg transcoding on a local file.
+
+Usage (from backend/):
+    python bench/bench_transcode.py path/to/sample.webm --codec mp3
+    python bench/bench_transcode.py --generate 3600     # synthesize a 1h sample first
+
+Each mode converts a fresh copy of the sample, so neither run sees cached output.
+Prints wall-clock seconds and the speedup; --json writes the numbers to a file.
+"""
+
+import argparse
+import json
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from postprocess import (  # noqa: E402
+    POSTPROCESS_WORKERS, _audio_codec_args, convert_audio, parallel_transcode,
+    probe_audio_codec, probe_duration, shutdown_postprocess_pool,
+)
+
+
+def generate_sample(path: Path, seconds: int):
+    """Synthesize an opus/webm test tone of `seconds` length."""
+    cmd = ["ffmpeg", "-y", "-loglevel", "error", "-f", "lavfi", "-i", f"sine=frequency=440:duration={seconds}",
+           "-c:a", "libopus", "-b:a", "128k", str(path)]
+    subprocess.run(cmd, check=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("sample", nargs="?", help="local media file to transcode")
+    parser.add_argument("--generate", type=int, metavar="SECONDS", help="generate a synthetic sample of this length")
+    parser.add_argument("--codec", default="mp3", help="target audio codec (default mp3)")
+    parser.add_argument("--quality", default="192", help="target bitrate in kbit/s (default 192)")
+    parser.add_argument("--segments", type=int, default=None, help="segment count (default 2x workers)")
+    parser.add_argument("--json", metavar="FILE", help="write results as JSON")
+    args = parser.parse_args()
+
+    workdir = Path(tempfile.mkdtemp(prefix="bench_transcode_"))
+    try:
+        if args.generate:
+            sample = workdir / "sample.webm"
+            generate_sample(sample, args.generate)
+        elif args.sample:
+            sample = Path(args.sample)
+        else:
+            parser.error("pass a sample file or --generate SECONDS")
+
+        duration = probe_duration(str(sample))
+        ext, codec_args, method = _audio_codec_args(probe_audio_codec(str(sample)), args.codec, args.quality)
+        if method == "copy":
+            print(f"source already matches {args.codec}: stream copy, nothing to benchmark")
+            return
+
+        single_src = workdir / f"single{sample.suffix}"
+        shutil.copy(sample, single_src)
+        start = time.perf_counter()
+        convert_audio(str(single_src), args.codec, args.quality)
+        single_s = time.perf_counter() - start
+
+        parallel_src = workdir / f"parallel{sample.suffix}"
+        shutil.copy(sample, parallel_src)
+        segments_done = []
+        start = time.perf_counter()
+        parallel_transcode(str(parallel_src), str(workdir / f"parallel_out.{ext}"),
+                           ["-vn", "-map", "0:a:0"] + codec_args,
+                           progress_callback=segments_done.append, segments=args.segments, duration=duration)
+        parallel_s = time.perf_counter() - start
+
+        results = {
+            "sample": str(sample),
+            "duration_s": duration,
+            "codec": args.codec,
+            "workers": POSTPROCESS_WORKERS,
+            "segments": len(segments_done),
+            "single_s": round(single_s, 3),
+            "parallel_s": round(parallel_s, 3),
+            "speedup": round(single_s / parallel_s, 2) if parallel_s else None,
+        }
+        for key, value in results.items():
+            print(f"{key:>12}: {value}")
+        if args.json:
+            Path(args.json).write_text(json.dumps(results, indent=2))
+    finally:
+        shutdown_postprocess_pool()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+# backend/bench/media_server.py
+"""
+Local stand-in for a video site, used by run_bench.py.
+
+Serves synthetic content generated on the fly (nothing is kept in memory or on disk):
+
+    /media/<name>-<size>.<ext>            progressive file of <size> bytes (5M, 200K, ...),
+                                          with HEAD, Range and ETag like a CDN
+    /hls/<id>/<segments>/index.m3u8       HLS media playlist of <segments> segments
+    /hls/<id>/<segments>/seg<i>.ts        one segment (SEGMENT_SIZE bytes)
+    /api/video/<id>?size=5M&hls=0         yt_dlp info dict for /watch/<id> (read by the stub extractor)
+    /api/playlist/<id>?n=10&size=5M       playlist info dict for /playlist/<id>
+    /watch/<id>, /playlist/<id>           placeholder pages (the URLs jobs are started with)
+
+--latency adds a fixed delay to every request and --rate caps each response's
+throughput, to imitate a distant or throttling server.
+
+Standalone:
+    python bench/media_server.py --port 8901
+"""
+
+import argparse
+import hashlib
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+SEGMENT_SIZE = 256 * 1024
+SEGMENT_SECONDS = 4.0
+BLOCK = 64 * 1024
+UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+
+
+def parse_size(value: str) -> int:
+    m = re.fullmatch(r"(\d+(?:\.\d+)?)([KMG]?)", value.upper())
+    if not m:
+        raise ValueError(f"bad size: {value}")
+    return int(float(m.group(1)) * UNITS[m.group(2)])
+
+
+def _block(seed: str) -> bytes:
+    # deterministic per-file content so ranged and resumed reads line up
+    digest = hashlib.sha256(seed.encode()).digest()
+    return (digest * (BLOCK // len(digest) + 1))[:BLOCK]
+
+
+class MediaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "BenchMedia/1.0"
+    latency = 0.0
+    rate = 0  # bytes/s per response, 0 = unlimited
+
+    def log_message(self, format, *args):
+        pass
+
+    # --- routing ---
+    def do_HEAD(self):
+        self._dispatch(head=True)
+
+    def do_GET(self):
+        self._dispatch(head=False)
+
+    def _dispatch(self, head: bool):
+        if self.latency:
+            time.sleep(self.latency)
+        parsed = urlparse(self.path)
+        query = {k: v[-1] for k, v in parse_qs(parsed.query).items()}
+        path = parsed.path
+        try:
+            m = re.fullmatch(r"/media/([\w.-]+)-(\d+[KMG]?)\.(\w+)", path)
+            if m:
+                return self._file(f"{m.group(1)}-{m.group(2)}", parse_size(m.group(2)), m.group(3), head)
+            m = re.fullmatch(r"/hls/([\w-]+)/(\d+)/index\.m3u8", path)
+            if m:
+                return self._text(self._playlist(int(m.group(2))), "application/vnd.apple.mpegurl", head)
+            m = re.fullmatch(r"/hls/([\w-]+)/(\d+)/seg(\d+)\.ts", path)
+            if m and int(m.group(3)) < int(m.group(2)):
+                return self._file(f"{m.group(1)}-seg{m.group(3)}", SEGMENT_SIZE, "ts", head)
+            m = re.fullmatch(r"/api/video/([\w-]+)", path)
+            if m:
+                return self._json(self.video_info(m.group(1), query), head)
+            m = re.fullmatch(r"/api/playlist/([\w-]+)", path)
+            if m:
+                return self._json(self.playlist_info(m.group(1), query), head)
+            if re.fullmatch(r"/(watch|playlist)/[\w-]+", path):
+                return self._text(f"<html><title>{path}</title></html>", "text/html", head)
+        except ValueError as e:
+            return self._error(400, str(e))
+        self._error(404, "not found")
+
+    # --- content ---
+    @property
+    def base(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def video_info(self, video_id: str, query: dict) -> dict:
+        size = parse_size(query.get("size", "5M"))
+        hls = query.get("hls") in ("1", "true")
+        duration = 60.0
+        if hls:
+            segments = max(1, -(-size // SEGMENT_SIZE))
+            duration = segments * SEGMENT_SECONDS
+            formats = [{"format_id": "hls-720", "url": f"{self.base}/hls/{video_id}/{segments}/index.m3u8",
+                        "ext": "mp4", "protocol": "m3u8_native", "vcodec": "avc1.64001f", "acodec": "mp4a.40.2",
+                        "height": 720, "width": 1280, "tbr": size * 8 / 1000 / duration}]
+        else:
+            formats = [
+                {"format_id": "audio", "url": f"{self.base}/media/{video_id}a-{max(1, size // 8)}.m4a",
+                 "ext": "m4a", "vcodec": "none", "acodec": "mp4a.40.2", "abr": 128, "filesize": max(1, size // 8)},
+                {"format_id": "720p", "url": f"{self.base}/media/{video_id}-{size}.mp4", "ext": "mp4",
+                 "vcodec": "avc1.64001f", "acodec": "mp4a.40.2", "height": 720, "width": 1280, "filesize": size},
+            ]
+        return {"id": video_id, "title": f"Bench {video_id}", "duration": duration,
+                "thumbnail": f"{self.base}/media/{video_id}t-20K.jpg",
+                "webpage_url": f"{self.base}/watch/{video_id}", "formats": formats}
+
+    def playlist_info(self, playlist_id: str, query: dict) -> dict:
+        count = int(query.get("n", "10"))
+        size = query.get("size", "5M")
+        hls = query.get("hls", "0")
+        entries = [{"_type": "url", "ie_key": "BenchStub", "id": f"{playlist_id}-{i}", "title": f"Bench {i}",
+                    "url": f"{self.base}/watch/{playlist_id}-{i}?size={size}&hls={hls}", "duration": 60}
+                   for i in range(count)]
+        return {"_type": "playlist", "id": playlist_id, "title": f"Bench playlist {playlist_id}", "entries": entries}
+
+    def _playlist(self, segments: int) -> str:
+        lines = ["#EXTM3U", "#EXT-X-VERSION:3", f"#EXT-X-TARGETDURATION:{int(SEGMENT_SECONDS)}",
+                 "#EXT-X-MEDIA-SEQUENCE:0"]
+        for i in range(segments):
+            lines += [f"#EXTINF:{SEGMENT_SECONDS:.1f},", f"seg{i}.ts"]
+        lines.append("#EXT-X-ENDLIST")
+        return "\n".join(lines) + "\n"
+
+    # --- responses ---
+    def _file(self, seed: str, size: int, ext: str, head: bool):
+        start, end = 0, size - 1
+        status = 200
+        range_header = self.headers.get("Range")
+        if range_header:
+            m = re.fullmatch(r"bytes=(\d*)-(\d*)", range_header.strip())
+            if m and (m.group(1) or m.group(2)):
+                if m.group(1):
+                    start = int(m.group(1))
+                    end = min(int(m.group(2)), size - 1) if m.group(2) else size - 1
+                else:
+                    start = max(0, size - int(m.group(2)))
+                if start > end:
+                    self.send_response(416)
+                    self.send_header("Content-Range", f"bytes */{size}")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                status = 206
+        self.send_response(status)
+        self.send_header("Content-Type", {"mp4": "video/mp4", "m4a": "audio/mp4", "ts": "video/mp2t",
+                                          "jpg": "image/jpeg"}.get(ext, "application/octet-stream"))
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", f'"{hashlib.md5(seed.encode()).hexdigest()}"')
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.end_headers()
+        if not head:
+            self._stream(_block(seed), start, end + 1)
+
+    def _stream(self, block: bytes, start: int, stop: int):
+        pos = start
+        began = time.monotonic()
+        sent = 0
+        try:
+            while pos < stop:
+                offset = pos % BLOCK
+                chunk = block[offset:offset + min(BLOCK - offset, stop - pos)]
+                self.wfile.write(chunk)
+                pos += len(chunk)
+                sent += len(chunk)
+                if self.rate:
+                    ahead = sent / self.rate - (time.monotonic() - began)
+                    if ahead > 0:
+                        time.sleep(ahead)
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+    def _text(self, text: str, content_type: str, head: bool):
+        body = text.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def _json(self, data: dict, head: bool):
+        self._text(json.dumps(data), "application/json", head)
+
+    def _error(self, code: int, message: str):
+        body = message.encode()
+        self.send_response(code)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class MediaServer:
+    """The media server on a background thread: `with MediaServer() as server: server.url(...)`."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0, rate: int = 0):
+        handler = type("Handler", (MediaHandler,), {"latency": latency, "rate": rate})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True, name="bench-media")
+
+    @property
+    def base(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def watch_url(self, video_id: str, size: str = "5M", hls: bool = False) -> str:
+        return f"{self.base}/watch/{video_id}?size={size}&hls={int(hls)}"
+
+    def media_url(self, name: str, size: str = "5M") -> str:
+        return f"{self.base}/media/{name}-{size}.mp4"
+
+    def start(self) -> "MediaServer":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8901)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument("--rate", default="0", help="per-response throughput cap, e.g. 2M (bytes/s)")
+    args = parser.parse_args()
+    server = MediaServer(args.host, args.port, args.latency, parse_size(args.rate))
+    print(f"serving synthetic media on {server.base} (e.g. {server.watch_url('demo')})")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,423 @@
+# backend/bench/run_bench.py
+"""
+Offline end-to-end benchmark of the backend API against local stand-ins.
+
+Starts the synthetic media server (media_server.py), optionally a libtorrent
+seeder (seeder.py), and the backend itself under uvicorn with:
+  * backend/bench on PYTHONPATH, so yt_dlp picks up the stub extractor plugin
+    (yt_dlp_plugins/extractor/bench_stub.py) for the media server's URLs;
+  * HOME, DB_PATH and THUMB_CACHE_DIR pointed at a temp dir, so downloads,
+    history and caches of the real install are untouched.
+Then it drives the scenarios at the requested concurrency:
+
+    formats    GET /formats for distinct videos               (latency = response)
+    download   POST /download, poll /jobs until terminal       (latency = submit -> finished)
+    direct     POST /download of a plain file URL (ranged downloader)
+    hls        POST /download of an HLS video (fragment path)
+    playlist   one POST /playlist/download of --jobs items
+    torrent    POST /torrent/add of locally seeded torrents    (needs libtorrent)
+
+and reports per scenario: jobs/s, p50/p99/mean latency, backend CPU seconds and
+utilisation, peak and final RSS (psutil when installed, /proc otherwise).
+
+Usage (from backend/):
+    python bench/run_bench.py --scenarios formats,download --jobs 50 --concurrency 8 --json out.json
+    python bench/run_bench.py --baseline out.json --tolerance 0.15   # exit 1 on regression
+    python bench/run_bench.py --backend-url http://127.0.0.1:8000 --backend-pid 1234   # existing server
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import requests
+
+BENCH_DIR = Path(__file__).resolve().parent
+BACKEND_DIR = BENCH_DIR.parent
+sys.path.insert(0, str(BENCH_DIR))
+
+from media_server import MediaServer, parse_size  # noqa: E402
+
+try:
+    import psutil
+except ImportError:  # optional: /proc sampling on Linux
+    psutil = None
+
+TERMINAL = {"finished", "error", "cancelled"}
+SCENARIOS = ("formats", "download", "direct", "hls", "playlist", "torrent")
+# metric -> True when higher is better (for --baseline comparison)
+COMPARED = {"jobs_per_s": True, "p50_ms": False, "p99_ms": False, "cpu_s": False, "rss_peak_mb": False}
+
+
+# --- backend process ---
+class Backend:
+    def __init__(self, url: Optional[str] = None, pid: Optional[int] = None, port: int = 8799,
+                 app: str = "main:app"):
+        self.url = url or f"http://127.0.0.1:{port}"
+        self.pid = pid
+        self.port = port
+        self.app = app
+        self.proc: Optional[subprocess.Popen] = None
+        self.workdir: Optional[Path] = None
+
+    def start(self, log_path: Path):
+        self.workdir = Path(tempfile.mkdtemp(prefix="vd_bench_"))
+        env = dict(os.environ)
+        env.update({
+            "HOME": str(self.workdir),
+            "USERPROFILE": str(self.workdir),
+            "DB_PATH": str(self.workdir / "bench.sqlite3"),
+            "THUMB_CACHE_DIR": str(self.workdir / "thumb_cache"),
+            "ADMISSION_MIN_FREE": env.get("ADMISSION_MIN_FREE", "100M"),
+            "PYTHONPATH": os.pathsep.join(filter(None, [str(BENCH_DIR), env.get("PYTHONPATH")])),
+        })
+        log = open(log_path, "wb")
+        self.proc = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", self.app, "--host", "127.0.0.1", "--port", str(self.port),
+             "--log-level", "warning"],
+            cwd=BACKEND_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+        self.pid = self.proc.pid
+        deadline = time.monotonic() + 60
+        while time.monotonic() < deadline:
+            if self.proc.poll() is not None:
+                raise RuntimeError(f"backend exited with {self.proc.returncode}; see {log_path}")
+            try:
+                if requests.get(f"{self.url}/ping", timeout=1).ok:
+                    return
+            except requests.RequestException:
+                pass
+            time.sleep(0.2)
+        raise RuntimeError(f"backend did not come up; see {log_path}")
+
+    def stop(self):
+        if self.proc is not None:
+            self.proc.terminate()
+            try:
+                self.proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+        if self.workdir is not None:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+# --- resource sampling ---
+def _proc_usage(pid: int):
+    """(cpu seconds incl. reaped children, rss bytes) of `pid` and its live children."""
+    if psutil is not None:
+        try:
+            parent = psutil.Process(pid)
+            procs = [parent] + parent.children(recursive=True)
+        except psutil.Error:
+            return None
+        cpu = rss = 0.0
+        for p in procs:
+            try:
+                t = p.cpu_times()
+                cpu += t.user + t.system + (getattr(t, "children_user", 0) + getattr(t, "children_system", 0)
+                                            if p is parent else 0)
+                rss += p.memory_info().rss
+            except psutil.Error:
+                pass
+        return cpu, rss
+    try:
+        fields = Path(f"/proc/{pid}/stat").read_text().rsplit(")", 1)[1].split()
+        ticks = os.sysconf("SC_CLK_TCK")
+        cpu = sum(int(v) for v in fields[11:15]) / ticks  # utime stime cutime cstime
+        rss = int(fields[21]) * os.sysconf("SC_PAGE_SIZE")
+        return cpu, rss
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class ResourceSampler:
+    def __init__(self, pid: Optional[int], interval: float = 0.2):
+        self.pid = pid
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        self.start_cpu = self.end_cpu = None
+        self.peak_rss = self.end_rss = 0
+
+    def __enter__(self):
+        usage = _proc_usage(self.pid) if self.pid else None
+        if usage:
+            self.start_cpu = usage[0]
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            usage = _proc_usage(self.pid)
+            if usage:
+                self.peak_rss = max(self.peak_rss, usage[1])
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            usage = _proc_usage(self.pid)
+            if usage:
+                self.end_cpu, self.end_rss = usage
+                self.peak_rss = max(self.peak_rss, usage[1])
+
+    def report(self, wall: float) -> dict:
+        if self.start_cpu is None or self.end_cpu is None:
+            return {"cpu_s": None, "cpu_pct": None, "rss_peak_mb": None, "rss_end_mb": None}
+        cpu = self.end_cpu - self.start_cpu
+        return {"cpu_s": round(cpu, 3), "cpu_pct": round(100 * cpu / wall, 1) if wall else None,
+                "rss_peak_mb": round(self.peak_rss / 2 ** 20, 1), "rss_end_mb": round(self.end_rss / 2 ** 20, 1)}
+
+
+# --- scenarios ---
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+class Runner:
+    def __init__(self, backend: Backend, media: MediaServer, args):
+        self.backend = backend
+        self.media = media
+        self.args = args
+        self.http = requests.Session()
+        self.http.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=max(10, args.concurrency * 2)))
+        self.run_id = str(int(time.time()))
+
+    def wait_jobs(self, ids: List[str], started: float, timeout: float) -> Dict[str, tuple]:
+        """Poll /jobs until every id is terminal; {id: (status, seconds since `started`, error)}."""
+        done: Dict[str, tuple] = {}
+        deadline = time.monotonic() + timeout
+        while len(done) < len(ids) and time.monotonic() < deadline:
+            pending = [i for i in ids if i not in done]
+            resp = self.http.get(f"{self.backend.url}/jobs", params={"ids": ",".join(pending)}, timeout=10)
+            now = time.perf_counter()
+            for job in resp.json().get("jobs", []):
+                if job.get("status") in TERMINAL:
+                    done[job["id"]] = (job["status"], now - started, job.get("error"))
+            time.sleep(self.args.poll)
+        for i in ids:
+            done.setdefault(i, ("timeout", None, None))
+        return done
+
+    def one_download(self, i: int, url: str, prefix: str) -> float:
+        job_id = f"bench-{prefix}-{self.run_id}-{i}"
+        started = time.perf_counter()
+        resp = self.http.post(f"{self.backend.url}/download",
+                              json={"url": url, "id": job_id, "format_id": self.args.format}, timeout=30)
+        resp.raise_for_status()
+        status, seconds, error = self.wait_jobs([job_id], started, self.args.timeout)[job_id]
+        if status != "finished":
+            raise RuntimeError(f"{job_id}: {status} {error or ''}".strip())
+        return seconds
+
+    def scenario_ops(self, name: str) -> Optional[Callable[[int], float]]:
+        a = self.args
+        if name == "formats":
+            def op(i):
+                started = time.perf_counter()
+                vid = "fmt-warm" if a.same_video else f"fmt-{self.run_id}-{i}"
+                resp = self.http.get(f"{self.backend.url}/formats",
+                                     params={"url": self.media.watch_url(vid, a.size)}, timeout=a.timeout)
+                resp.raise_for_status()
+                return time.perf_counter() - started
+            return op
+        if name == "download":
+            return lambda i: self.one_download(i, self.media.watch_url(f"dl-{self.run_id}-{i}", a.size), "dl")
+        if name == "direct":
+            return lambda i: self.one_download(i, self.media.media_url(f"direct-{self.run_id}-{i}", a.size), "direct")
+        if name == "hls":
+            return lambda i: self.one_download(
+                i, self.media.watch_url(f"hls-{self.run_id}-{i}", a.size, hls=True), "hls")
+        return None
+
+    def run_pool(self, op: Callable[[int], float]) -> tuple:
+        latencies, errors = [], []
+
+        def guarded(i):
+            try:
+                latencies.append(op(i))
+            except Exception as e:
+                errors.append(str(e))
+
+        with ThreadPoolExecutor(self.args.concurrency) as pool:
+            list(pool.map(guarded, range(self.args.jobs)))
+        return latencies, errors
+
+    def run_playlist(self) -> tuple:
+        a = self.args
+        urls = [self.media.watch_url(f"pl-{self.run_id}-{i}", a.size) for i in range(a.jobs)]
+        started = time.perf_counter()
+        resp = self.http.post(f"{self.backend.url}/playlist/download",
+                              json={"video_ids": urls, "quality": a.format}, timeout=30)
+        resp.raise_for_status()
+        results = self.wait_jobs([f"playlist_{i}" for i in range(a.jobs)], started, a.timeout)
+        latencies = [s for status, s, _ in results.values() if status == "finished"]
+        errors = [f"{i}: {status} {err or ''}".strip() for i, (status, _, err) in results.items()
+                  if status != "finished"]
+        return latencies, errors
+
+    def run_torrent(self, seeder) -> tuple:
+        magnets = seeder.create_many(self.args.jobs, parse_size(self.args.size), prefix=f"t{self.run_id}")
+
+        def op(i):
+            job_id = f"bench{self.run_id}{i}"
+            started = time.perf_counter()
+            resp = self.http.post(f"{self.backend.url}/torrent/add", json={"magnet": magnets[i], "id": job_id},
+                                  timeout=30)
+            resp.raise_for_status()
+            status, seconds, error = self.wait_jobs([f"torrent_{job_id}"], started,
+                                                    self.args.timeout)[f"torrent_{job_id}"]
+            if status != "finished":
+                raise RuntimeError(f"{job_id}: {status} {error or ''}".strip())
+            return seconds
+
+        return self.run_pool(op)
+
+    def run(self, name: str, seeder=None) -> dict:
+        with ResourceSampler(self.backend.pid) as sampler:
+            started = time.perf_counter()
+            if name == "playlist":
+                latencies, errors = self.run_playlist()
+            elif name == "torrent":
+                latencies, errors = self.run_torrent(seeder)
+            else:
+                latencies, errors = self.run_pool(self.scenario_ops(name))
+            wall = time.perf_counter() - started
+        ms = [v * 1000 for v in latencies]
+        return {
+            "jobs": self.args.jobs,
+            "ok": len(latencies),
+            "errors": len(errors),
+            "error_samples": errors[:5],
+            "wall_s": round(wall, 3),
+            "jobs_per_s": round(len(latencies) / wall, 3) if wall else None,
+            "p50_ms": round(percentile(ms, 50), 1) if ms else None,
+            "p99_ms": round(percentile(ms, 99), 1) if ms else None,
+            "mean_ms": round(sum(ms) / len(ms), 1) if ms else None,
+            **sampler.report(wall),
+        }
+
+
+# --- reporting ---
+def compare(results: dict, baseline: dict, tolerance: float) -> List[str]:
+    """Lines describing metrics that got worse than `baseline` by more than `tolerance` (fraction)."""
+    regressions = []
+    for name, current in results["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(name)
+        if not base:
+            continue
+        for metric, higher_better in COMPARED.items():
+            old, new = base.get(metric), current.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = -change if higher_better else change
+            flag = "REGRESSION" if worse > tolerance else ""
+            print(f"  {name:>9} {metric:>12}: {old:>10} -> {new:>10} ({change:+.1%}) {flag}")
+            if flag:
+                regressions.append(f"{name} {metric} {change:+.1%}")
+    return regressions
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default="formats,download,direct,hls,playlist",
+                        help=f"comma-separated, from {','.join(SCENARIOS)}")
+    parser.add_argument("--jobs", type=int, default=20, help="jobs per scenario (playlist: items)")
+    parser.add_argument("--concurrency", type=int, default=4, help="jobs in flight per scenario")
+    parser.add_argument("--size", default="5M", help="synthetic media size per job (default 5M)")
+    parser.add_argument("--format", default="best", help="format_id / target sent with downloads")
+    parser.add_argument("--same-video", action="store_true", help="formats: reuse one video (cache hits)")
+    parser.add_argument("--latency", type=float, default=0.0, help="media server delay per request (s)")
+    parser.add_argument("--rate", default="0", help="media server throughput cap per response (bytes/s)")
+    parser.add_argument("--timeout", type=float, default=300, help="per-job timeout (s)")
+    parser.add_argument("--poll", type=float, default=0.05, help="/jobs poll interval (s)")
+    parser.add_argument("--port", type=int, default=8799, help="port for the spawned backend")
+    parser.add_argument("--backend-url", help="use an already running backend instead of spawning one")
+    parser.add_argument("--backend-pid", type=int, help="pid of --backend-url for CPU/RSS sampling")
+    parser.add_argument("--json", metavar="FILE", help="write results as JSON")
+    parser.add_argument("--baseline", metavar="FILE", help="compare with an earlier --json result")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed regression fraction (0.10)")
+    args = parser.parse_args()
+
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    media = MediaServer(latency=args.latency, rate=parse_size(args.rate)).start()
+    backend = Backend(args.backend_url, args.backend_pid, args.port)
+    seeder = None
+    seed_dir = None
+    log_path = Path(tempfile.gettempdir()) / "vd_bench_backend.log"
+    results = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": {k: v for k, v in vars(args).items() if k not in ("json", "baseline")},
+        "scenarios": {},
+    }
+    try:
+        if not args.backend_url:
+            backend.start(log_path)
+        if "torrent" in scenarios:
+            try:
+                from seeder import LocalSeeder
+                seed_dir = Path(tempfile.mkdtemp(prefix="vd_bench_seed_"))
+                seeder = LocalSeeder(seed_dir)
+            except RuntimeError as e:
+                print(f"skipping torrent scenario: {e}")
+                scenarios.remove("torrent")
+
+        runner = Runner(backend, media, args)
+        for name in scenarios:
+            print(f"running {name} ({args.jobs} jobs, concurrency {args.concurrency}) ...")
+            report = runner.run(name, seeder)
+            results["scenarios"][name] = report
+            print("  " + "  ".join(f"{k}={v}" for k, v in report.items() if k != "error_samples"))
+            for sample in report["error_samples"]:
+                print(f"    error: {sample}")
+    finally:
+        if seeder is not None:
+            seeder.stop()
+        if seed_dir is not None:
+            shutil.rmtree(seed_dir, ignore_errors=True)
+        backend.stop()
+        media.stop()
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2))
+    if args.baseline:
+        print(f"compared with {args.baseline} (tolerance {args.tolerance:.0%}):")
+        regressions = compare(results, json.loads(Path(args.baseline).read_text()), args.tolerance)
+        if regressions:
+            print("regressions: " + "; ".join(regressions))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
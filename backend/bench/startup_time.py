@@ -0,0 +1,152 @@
+# backend/bench/startup_time.py
+"""
+Backend import-time and startup-time report.
+
+For --runs fresh interpreters it measures:
+  * import       `python -X importtime -c "import main"`: total import time, the
+                 slowest top-level packages (cumulative) and whether any module
+                 that must stay lazy (yt_dlp, libtorrent) was imported anyway
+  * startup      spawn uvicorn main:app (temp HOME / DB_PATH, like run_bench.py)
+                 and time until the first /ping answers, plus the server's own
+                 GET /admin/startup report (lifespan phases, RSS, modules loaded)
+
+and reports the median over runs. With --baseline it exits 1 when import_ms,
+ready_ms or ping_ms grew by more than --tolerance, or when a lazy module was
+imported eagerly.
+
+Usage (from backend/):
+    python bench/startup_time.py --runs 5 --json startup.json
+    python bench/startup_time.py --baseline startup.json --tolerance 0.2
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import requests
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from run_bench import BACKEND_DIR, Backend, git_revision  # noqa: E402
+
+LAZY_MODULES = ("yt_dlp", "libtorrent")
+COMPARED = ("import_ms", "ping_ms", "ready_ms")
+
+
+def import_profile(workdir: Path) -> dict:
+    """One `-X importtime` run of `import main`: total ms, per-top-level-package cumulative ms."""
+    env = dict(os.environ, HOME=str(workdir), USERPROFILE=str(workdir), DB_PATH=str(workdir / "startup.sqlite3"))
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], cwd=BACKEND_DIR, env=env,
+                          capture_output=True, text=True, timeout=120)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "import main failed")
+    packages: Dict[str, float] = {}
+    imported = set()
+    for line in proc.stderr.splitlines():
+        # "import time:  self [us] | cumulative | imported package"
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        module = name.strip()
+        imported.add(module.split(".")[0])
+        if name.startswith(" ") and not name.startswith("  "):  # top level: one space of indent
+            top = module.split(".")[0]
+            packages[top] = packages.get(top, 0.0) + int(cumulative) / 1000
+    return {
+        "import_ms": round(packages.get("main", 0.0), 1),
+        "packages": packages,
+        "eager": sorted(m for m in LAZY_MODULES if m in imported),
+    }
+
+
+def startup_profile(port: int) -> dict:
+    backend = Backend(port=port)
+    started = time.perf_counter()
+    try:
+        backend.start(Path(tempfile.gettempdir()) / "vd_startup_backend.log")
+        ping_ms = (time.perf_counter() - started) * 1000
+        report = requests.get(f"{backend.url}/admin/startup", timeout=10).json()
+    finally:
+        backend.stop()
+    return {"ping_ms": round(ping_ms, 1), "report": report}
+
+
+def median(values: List[float]):
+    values = [v for v in values if v is not None]
+    return round(statistics.median(values), 1) if values else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3, help="fresh interpreters per measurement")
+    parser.add_argument("--top", type=int, default=15, help="slowest top-level imports to list")
+    parser.add_argument("--port", type=int, default=8797)
+    parser.add_argument("--json", metavar="FILE", help="write results as JSON")
+    parser.add_argument("--baseline", metavar="FILE", help="compare with an earlier --json result")
+    parser.add_argument("--tolerance", type=float, default=0.20, help="allowed regression fraction (0.20)")
+    args = parser.parse_args()
+
+    imports, startups = [], []
+    with tempfile.TemporaryDirectory(prefix="vd_startup_") as workdir:
+        for _ in range(args.runs):
+            imports.append(import_profile(Path(workdir)))
+    for _ in range(args.runs):
+        startups.append(startup_profile(args.port))
+
+    packages = {name: median([run["packages"].get(name) for run in imports])
+                for name in imports[0]["packages"]}
+    last = startups[-1]["report"]
+    results = {
+        "import_ms": median([run["import_ms"] for run in imports]),
+        "ping_ms": median([run["ping_ms"] for run in startups]),
+        "ready_ms": median([run["report"].get("ready_ms") for run in startups]),
+        "eager_lazy_modules": sorted({m for run in imports for m in run["eager"]}),
+        "phases": last.get("phases", []),
+        "modules_loaded": last.get("modules_loaded"),
+        "rss_mb": last.get("rss_mb"),
+        "slowest_imports_ms": dict(sorted(packages.items(), key=lambda kv: kv[1], reverse=True)[:args.top]),
+    }
+
+    print(f"import main    {results['import_ms']} ms (median of {args.runs})")
+    print(f"first /ping    {results['ping_ms']} ms after spawn, lifespan ready at {results['ready_ms']} ms")
+    print(f"loaded         {results['modules_loaded']} modules, {results['rss_mb']} MB RSS")
+    for entry in results["phases"]:
+        print(f"  phase {entry['phase']:>16}: {entry['ms']} ms")
+    for name, ms in results["slowest_imports_ms"].items():
+        print(f"  import {name:>15}: {ms} ms")
+    if results["eager_lazy_modules"]:
+        print("imported eagerly: " + ", ".join(results["eager_lazy_modules"]))
+
+    if args.json:
+        Path(args.json).write_text(json.dumps({
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "git": git_revision(),
+            "params": {k: v for k, v in vars(args).items() if k not in ("json", "baseline")}, "results": results,
+        }, indent=2))
+
+    failures = [f"{m} imported at startup" for m in results["eager_lazy_modules"]]
+    if args.baseline:
+        base = json.loads(Path(args.baseline).read_text())["results"]
+        print(f"compared with {args.baseline} (tolerance {args.tolerance:.0%}):")
+        for metric in COMPARED:
+            old, new = base.get(metric), results.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            flag = "REGRESSION" if change > args.tolerance else ""
+            print(f"  {metric:>10}: {old:>8} -> {new:>8} ({change:+.1%}) {flag}")
+            if flag:
+                failures.append(f"{metric} {change:+.1%}")
+    if failures:
+        print("regressions: " + "; ".join(failures))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
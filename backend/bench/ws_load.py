@@ -0,0 +1,268 @@
+# backend/bench/ws_load.py
+"""
+Websocket fan-out load harness.
+
+Starts the backend with synthetic-job routes (ws_server.py) in a subprocess, opens
+--clients websocket clients spread over --jobs job ids, half (--torrent-share) of
+them on /ws/torrent_<id> and the rest on /ws/<id>, then has the server emit
+progress for every job at --rate messages/s for --duration seconds followed by a
+"finished" event, from worker threads like real downloads.
+
+Reported:
+  * message latency   emit (server wall clock) -> receive, p50/p99/max over all
+                      progress messages and separately for terminal events
+  * terminal events   dropped (never arrived before --grace) and late (> --late-ms)
+  * coalescing        progress messages received / emitted per client (the server
+                      merges unsent progress of a job, so < 1 is expected under load)
+  * memory            server RSS growth per open connection
+  * event-loop lag    server loop lag (50 ms ticker) p50/p99/max during the run,
+                      and the harness's own lag, which must stay low for the
+                      latency numbers to mean anything
+  * disconnects       clients closed by the server (slow consumer / stalled send)
+
+Usage (from backend/):
+    python bench/ws_load.py --clients 2000 --jobs 200 --rate 4 --duration 20 --json ws.json
+    python bench/ws_load.py --clients 5000 --slow 0.05    # 5% of clients read slowly
+
+Needs the `websockets` package (installed with uvicorn[standard]).
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import List, Optional
+
+import requests
+
+try:
+    import websockets
+except ImportError:
+    websockets = None
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from run_bench import Backend, git_revision, percentile  # noqa: E402
+
+
+def _raise_fd_limit(needed: int):
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft < needed:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (min(hard, needed), hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+
+class Client:
+    def __init__(self, url: str, job: str, slow: bool):
+        self.url = url
+        self.job = job
+        self.slow = slow
+        self.latencies: List[float] = []
+        self.received = 0
+        self.terminal_latency: Optional[float] = None
+        self.closed_by_server = False
+        self.error: Optional[str] = None
+        self.ws = None
+
+    async def connect(self):
+        self.ws = await websockets.connect(self.url, max_size=None, ping_interval=None, close_timeout=1)
+
+    async def run(self, done: asyncio.Event):
+        try:
+            async for raw in self.ws:
+                now = time.time()
+                message = json.loads(raw)
+                sent = message.get("bench_ts")
+                if sent is None:
+                    continue
+                self.received += 1
+                if message.get("status") == "finished":
+                    self.terminal_latency = now - sent
+                    return
+                self.latencies.append(now - sent)
+                if self.slow:
+                    await asyncio.sleep(0.5)
+            self.closed_by_server = not done.is_set()
+        except websockets.ConnectionClosed:
+            self.closed_by_server = not done.is_set()
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            self.error = str(e)
+
+    async def close(self):
+        if self.ws is not None:
+            try:
+                await self.ws.close()
+            except Exception:
+                pass
+
+
+async def _loop_lag(samples: List[float], stop: asyncio.Event):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        expected = loop.time() + 0.05
+        await asyncio.sleep(0.05)
+        samples.append(max(0.0, loop.time() - expected))
+
+
+def _ms(values: List[float]) -> dict:
+    ms = [v * 1000 for v in values]
+    return {"count": len(ms),
+            "p50": round(percentile(ms, 50), 2) if ms else None,
+            "p99": round(percentile(ms, 99), 2) if ms else None,
+            "max": round(max(ms), 2) if ms else None}
+
+
+async def run(args, base: str) -> dict:
+    ws_base = base.replace("http://", "ws://", 1)
+    stats = lambda: requests.get(f"{base}/bench/stats", timeout=30).json()  # noqa: E731
+    run_id = str(int(time.time()))
+    jobs = [f"wsload{run_id}_{j}" for j in range(args.jobs)]
+    torrent_jobs = set(jobs[:int(round(len(jobs) * args.torrent_share))])
+    rng = random.Random(args.seed)
+
+    clients = []
+    for n in range(args.clients):
+        job = jobs[n % len(jobs)]
+        path = f"/ws/torrent_{job}" if job in torrent_jobs else f"/ws/{job}"
+        clients.append(Client(ws_base + path, f"torrent_{job}" if job in torrent_jobs else job,
+                              slow=rng.random() < args.slow))
+
+    idle = await asyncio.get_running_loop().run_in_executor(None, stats)
+
+    # connect in bounded batches, like many browser tabs coming up
+    sem = asyncio.Semaphore(args.connect_concurrency)
+    connect_failures = []
+
+    async def connect(client):
+        async with sem:
+            try:
+                await client.connect()
+            except Exception as e:
+                connect_failures.append(str(e))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(connect(c) for c in clients))
+    connect_s = time.perf_counter() - started
+    connected = [c for c in clients if c.ws is not None]
+    await asyncio.sleep(1.0)
+    loaded = await asyncio.get_running_loop().run_in_executor(None, stats)
+    rss_per_conn = (loaded["rss"] - idle["rss"]) / len(connected) if connected else None
+
+    done = asyncio.Event()
+    harness_lag: List[float] = []
+    lag_stop = asyncio.Event()
+    lag_task = asyncio.ensure_future(_loop_lag(harness_lag, lag_stop))
+    readers = [asyncio.ensure_future(c.run(done)) for c in connected]
+
+    emit = {"ids": [f"torrent_{j}" if j in torrent_jobs else j for j in jobs], "rate": args.rate,
+            "duration": args.duration, "threads": args.emit_threads, "payload": args.payload}
+    await asyncio.get_running_loop().run_in_executor(
+        None, lambda: requests.post(f"{base}/bench/emit", json=emit, timeout=30).raise_for_status())
+
+    server_lag = []
+    peak_rss = loaded["rss"]
+    peak_backlog = 0
+    deadline = time.monotonic() + args.duration + args.grace
+    while time.monotonic() < deadline and not all(r.done() for r in readers):
+        await asyncio.sleep(1.0)
+        snapshot = await asyncio.get_running_loop().run_in_executor(None, stats)
+        server_lag.append(snapshot["loop_lag_ms"])
+        peak_rss = max(peak_rss, snapshot["rss"])
+        peak_backlog = max(peak_backlog, snapshot["backlog_max"])
+    done.set()
+    for reader in readers:
+        reader.cancel()
+    await asyncio.gather(*readers, return_exceptions=True)
+    lag_stop.set()
+    await lag_task
+    final = await asyncio.get_running_loop().run_in_executor(None, stats)
+    await asyncio.gather(*(c.close() for c in connected))
+
+    steps = max(1, int(args.duration * args.rate))
+    progress = [lat for c in connected for lat in c.latencies]
+    terminal = [c.terminal_latency for c in connected if c.terminal_latency is not None]
+    late = [t for t in terminal if t * 1000 > args.late_ms]
+    dropped = [c for c in connected if c.terminal_latency is None]
+    delivery = [c.received / (steps + 1) for c in connected]
+    lag_p99 = [s["p99"] for s in server_lag if s.get("p99") is not None]
+    lag_max = [s["max"] for s in server_lag if s.get("max") is not None]
+
+    return {
+        "clients": args.clients,
+        "connected": len(connected),
+        "connect_failures": len(connect_failures),
+        "connect_s": round(connect_s, 2),
+        "slow_clients": sum(1 for c in connected if c.slow),
+        "jobs": args.jobs,
+        "messages_emitted": final["emitted"],
+        "progress_latency_ms": _ms(progress),
+        "terminal_latency_ms": _ms(terminal),
+        "terminal_dropped": len(dropped),
+        "terminal_dropped_fast_clients": sum(1 for c in dropped if not c.slow),
+        "terminal_late": len(late),
+        "delivery_ratio_mean": round(sum(delivery) / len(delivery), 3) if delivery else None,
+        "disconnected_by_server": sum(1 for c in connected if c.closed_by_server),
+        "client_errors": sum(1 for c in connected if c.error),
+        "rss_idle_mb": round(idle["rss"] / 2 ** 20, 1),
+        "rss_connected_mb": round(loaded["rss"] / 2 ** 20, 1),
+        "rss_peak_mb": round(peak_rss / 2 ** 20, 1),
+        "rss_per_connection_kb": round(rss_per_conn / 1024, 1) if rss_per_conn is not None else None,
+        "server_backlog_peak": peak_backlog,
+        "server_loop_lag_ms": {"p99_worst": max(lag_p99, default=None), "max": max(lag_max, default=None)},
+        "harness_loop_lag_ms": _ms(harness_lag),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=1000, help="websocket clients to open")
+    parser.add_argument("--jobs", type=int, default=100, help="synthetic jobs (clients are spread over them)")
+    parser.add_argument("--torrent-share", type=float, default=0.5, help="fraction of jobs on /ws/torrent_<id>")
+    parser.add_argument("--rate", type=float, default=4, help="progress messages per job per second")
+    parser.add_argument("--duration", type=float, default=15, help="seconds of progress before finished")
+    parser.add_argument("--payload", type=int, default=0, help="extra bytes per progress message")
+    parser.add_argument("--emit-threads", type=int, default=8, help="server threads emitting progress")
+    parser.add_argument("--slow", type=float, default=0.0, help="fraction of clients reading 2 msg/s")
+    parser.add_argument("--late-ms", type=float, default=1000, help="terminal events slower than this are late")
+    parser.add_argument("--grace", type=float, default=15, help="seconds to wait for terminal events")
+    parser.add_argument("--connect-concurrency", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--port", type=int, default=8798)
+    parser.add_argument("--json", metavar="FILE", help="write results as JSON")
+    args = parser.parse_args()
+
+    if websockets is None:
+        parser.error("the websockets package is required (pip install websockets)")
+    _raise_fd_limit(args.clients * 2 + 256)
+
+    backend = Backend(port=args.port, app="ws_server:app")
+    log_path = Path(tempfile.gettempdir()) / "vd_ws_load_backend.log"
+    try:
+        backend.start(log_path)
+        print(f"{args.clients} clients, {args.jobs} jobs x {args.rate} msg/s for {args.duration}s ...")
+        results = asyncio.run(run(args, backend.url))
+    finally:
+        backend.stop()
+
+    for key, value in results.items():
+        print(f"{key:>30}: {value}")
+    if args.json:
+        Path(args.json).write_text(json.dumps({
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "git": git_revision(),
+            "params": {k: v for k, v in vars(args).items() if k != "json"}, "results": results,
+        }, indent=2))
+    if results["terminal_dropped_fast_clients"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
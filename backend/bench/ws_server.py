@@ -0,0 +1,136 @@
+# backend/bench/ws_server.py
+"""
+The backend app plus synthetic-job routes for the websocket load harness (ws_load.py).
+
+Run by ws_load.py as `uvicorn ws_server:app` with backend/ and backend/bench on the
+path. Everything of main.app is served unchanged; the extra /bench routes:
+
+    POST /bench/emit   {ids, rate, duration, threads, payload}
+        start synthetic jobs: every id gets `rate` progress messages per second for
+        `duration` seconds, then a "finished" message. Messages go through main.emit
+        from worker threads, exactly like real download threads, and carry
+        bench_ts (wall clock at emit) and seq for latency / loss accounting.
+    GET  /bench/stats
+        RSS, websocket channel / connection counts, emitted message counts and the
+        event-loop lag seen by a 50 ms ticker since the previous call.
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from main import app, emit  # noqa: E402
+from ws_manager import ws_manager  # noqa: E402
+
+LAG_INTERVAL = 0.05
+
+
+class _Stats:
+    def __init__(self):
+        self.emitted = 0
+        self.finished = 0
+        self.lags: List[float] = []
+        self.lock = threading.Lock()
+
+
+stats = _Stats()
+
+
+def rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as fh:
+            return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+async def _lag_ticker():
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + LAG_INTERVAL
+        await asyncio.sleep(LAG_INTERVAL)
+        stats.lags.append(max(0.0, loop.time() - expected))
+
+
+_ticker = None
+
+
+def _ensure_lag_ticker():
+    # started by the first /bench request: main.app's lifespan owns startup
+    global _ticker
+    if _ticker is None:
+        _ticker = asyncio.ensure_future(_lag_ticker())
+
+
+def _emit_jobs(ids: List[str], rate: float, duration: float, payload: int, loop):
+    """One worker thread driving `ids` like that many concurrent downloads."""
+    interval = 1.0 / rate if rate > 0 else duration
+    steps = max(1, int(duration * rate))
+    filler = "x" * payload
+    start = time.monotonic()
+    for step in range(steps):
+        for id in ids:
+            emit(id, {"status": "downloading", "downloaded_bytes": step * 65536, "total_bytes": steps * 65536,
+                      "speed": 65536 * rate, "eta": steps - step, "seq": step, "bench_ts": time.time(),
+                      "filler": filler}, loop)
+        with stats.lock:
+            stats.emitted += len(ids)
+        delay = start + (step + 1) * interval - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+    for id in ids:
+        emit(id, {"status": "finished", "seq": steps, "bench_ts": time.time(),
+                  "result": {"final_path": f"{id}.mp4"}}, loop)
+    with stats.lock:
+        stats.emitted += len(ids)
+        stats.finished += len(ids)
+
+
+@app.post("/bench/emit")
+async def bench_emit(payload: dict):
+    _ensure_lag_ticker()
+    ids = [str(i) for i in payload.get("ids", [])]
+    rate = float(payload.get("rate", 2))
+    duration = float(payload.get("duration", 10))
+    threads = max(1, min(int(payload.get("threads", 8)), len(ids) or 1))
+    loop = asyncio.get_event_loop()
+    for id in ids:
+        ws_manager.reset_channel(id)
+    for n in range(threads):
+        part = ids[n::threads]
+        threading.Thread(target=_emit_jobs, args=(part, rate, duration, int(payload.get("payload", 0)), loop),
+                         daemon=True).start()
+    return {"jobs": len(ids), "threads": threads, "messages": len(ids) * (max(1, int(duration * rate)) + 1)}
+
+
+@app.get("/bench/stats")
+async def bench_stats():
+    _ensure_lag_ticker()
+    lags, stats.lags = stats.lags, []
+    lags.sort()
+    connections = set()
+    for subs in list(ws_manager.channels.values()):
+        connections.update(subs)
+    backlog = [c.backlog for c in connections]
+    return {
+        "rss": rss_bytes(),
+        "channels": len(ws_manager.channels),
+        "connections": len(connections),
+        "backlog_max": max(backlog, default=0),
+        "backlog_total": sum(backlog),
+        "emitted": stats.emitted,
+        "finished": stats.finished,
+        "loop_lag_ms": {
+            "samples": len(lags),
+            "p50": round(lags[len(lags) // 2] * 1000, 2) if lags else None,
+            "p99": round(lags[min(len(lags) - 1, int(len(lags) * 0.99))] * 1000, 2) if lags else None,
+            "max": round(lags[-1] * 1000, 2) if lags else None,
+        },
+    }
@@ -0,0 +1,38 @@
+# backend/bench/yt_dlp_plugins/extractor/bench_stub.py
+"""
+yt_dlp extractors for the bench media server (bench/media_server.py).
+
+yt_dlp loads extractor plugins from any `yt_dlp_plugins` namespace package on
+sys.path, so a backend started with backend/bench on PYTHONPATH (run_bench.py
+does this) resolves /watch/<id> and /playlist/<id> URLs of a local media server
+through these classes, with one metadata request each like a real site.
+"""
+
+from urllib.parse import urlparse
+
+from yt_dlp.extractor.common import InfoExtractor
+
+_LOCAL = r"https?://(?:127\.0\.0\.1|localhost)(?::\d+)?"
+
+
+def _api_url(url: str, kind: str, item_id: str) -> str:
+    parsed = urlparse(url)
+    return f"{parsed.scheme}://{parsed.netloc}/api/{kind}/{item_id}?{parsed.query}"
+
+
+class BenchStubIE(InfoExtractor):
+    IE_NAME = "benchstub"
+    _VALID_URL = _LOCAL + r"/watch/(?P<id>[\w-]+)"
+
+    def _real_extract(self, url):
+        video_id = self._match_id(url)
+        return self._download_json(_api_url(url, "video", video_id), video_id)
+
+
+class BenchStubPlaylistIE(InfoExtractor):
+    IE_NAME = "benchstub:playlist"
+    _VALID_URL = _LOCAL + r"/playlist/(?P<id>[\w-]+)"
+
+    def _real_extract(self, url):
+        playlist_id = self._match_id(url)
+        return self._download_json(_api_url(url, "playlist", playlist_id), playlist_id)
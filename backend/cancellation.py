@@ -0,0 +1,171 @@
+# backend/cancellation.py
+"""
+Cancel / pause control for one download job.
+
+JobControl is the job's cancel event (a threading.Event, so every place that
+already polls `cancel_event.is_set()` keeps working) plus:
+  * callbacks run the moment the job is cancelled, used to abort blocking work
+    right away: killing ffmpeg subprocesses, closing open connections;
+  * the temporary files the job has written, removed on cancel when cleanup is
+    requested (pause always keeps them so the job can resume), and the final
+    files it created itself; a file that already existed under the output name
+    is never removed.
+
+ffmpeg runs started by the post-processing pool record their pid in a pidfile
+under PIDFILE_DIR named after the job's token, so the server process can kill
+them although they are grandchildren (pool worker -> ffmpeg). ffmpeg started by
+yt_dlp itself (format merging) is found by walking /proc where available.
+"""
+
+import glob
+import os
+import shutil
+import signal
+import tempfile
+import threading
+import uuid
+from pathlib import Path
+from typing import Callable, List, Optional, Set
+
+PIDFILE_DIR = Path(tempfile.gettempdir()) / "vd-ffmpeg-pids"
+
+# appended to a tracked .part file: the ranged downloader's checkpoint and its temp copy
+PARTIAL_SUFFIXES = (".json", ".tmp")
+
+
+class JobControl(threading.Event):
+    def __init__(self):
+        super().__init__()
+        self.token = uuid.uuid4().hex[:12]
+        self.reason: Optional[str] = None  # "cancel" | "pause"
+        self.cleanup = False
+        self.partials: Set[str] = set()  # temporary files (.part ...)
+        self.outputs: Set[str] = set()  # final files this job created
+        self._callbacks: List[Callable[[], None]] = []
+        self._cb_lock = threading.Lock()
+
+    @property
+    def paused(self) -> bool:
+        return self.reason == "pause"
+
+    def cancel(self, reason: str = "cancel", cleanup: bool = False):
+        self.reason = reason
+        self.cleanup = cleanup and reason != "pause"
+        self.set()
+
+    def set(self):
+        if self.reason is None:
+            self.reason = "cancel"
+        super().set()
+        with self._cb_lock:
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"[cancel] callback failed: {e}")
+        kill_ffmpeg(self.token)
+
+    def on_cancel(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """Run `callback` when the job is cancelled (now, if it already is). Returns an unregister function."""
+        with self._cb_lock:
+            if not self.is_set():
+                self._callbacks.append(callback)
+
+                def remove():
+                    with self._cb_lock:
+                        if callback in self._callbacks:
+                            self._callbacks.remove(callback)
+                return remove
+        callback()
+        return lambda: None
+
+    def track(self, path: Optional[str]):
+        """Remember a temporary file the job writes (yt-dlp's tmpfilename, the ranged .part)."""
+        if path:
+            self.partials.add(str(path))
+
+    def track_output(self, path: Optional[str]):
+        """Remember a final file the job is about to write, unless it already exists (not ours)."""
+        if path and str(path) not in self.outputs and not os.path.exists(path):
+            self.outputs.add(str(path))
+
+    def remove_partials(self) -> List[str]:
+        removed = []
+        candidates: List[Path] = []
+        bases = {Path(path) for path in self.outputs}
+        for path in list(self.partials):
+            p = Path(path)
+            candidates += [p] + [Path(path + suffix) for suffix in PARTIAL_SUFFIXES]
+            candidates += [Path(c) for c in glob.glob(glob.escape(path) + "-Frag*")]
+            if path.endswith(".part"):
+                base = Path(path[:-len(".part")])
+                candidates.append(Path(str(base) + ".ytdl"))
+                bases.add(base)
+        for base in bases:
+            # post-processing temp files are named after the output's stem
+            candidates += [Path(c) for c in glob.glob(glob.escape(str(base.with_suffix(""))) + ".pp-tmp.*")]
+            shutil.rmtree(base.parent / f".{base.stem}.segments", ignore_errors=True)
+        candidates += [Path(path) for path in self.outputs]
+        for candidate in candidates:
+            try:
+                candidate.unlink()
+                removed.append(str(candidate))
+            except OSError:
+                pass
+        return removed
+
+
+def pidfile_for(token: Optional[str]) -> Optional[str]:
+    """Pidfile path for one ffmpeg run of job `token` (None when the job has no token)."""
+    if not token:
+        return None
+    PIDFILE_DIR.mkdir(parents=True, exist_ok=True)
+    return str(PIDFILE_DIR / f"{token}-{uuid.uuid4().hex[:8]}.pid")
+
+
+def kill_ffmpeg(token: str):
+    """Kill every ffmpeg run recorded under job `token` (see pidfile_for)."""
+    for pidfile in glob.glob(str(PIDFILE_DIR / f"{token}-*.pid")):
+        try:
+            pid = int(Path(pidfile).read_text().strip() or 0)
+            if pid:
+                os.kill(pid, getattr(signal, "SIGKILL", signal.SIGTERM))
+        except (OSError, ValueError):
+            pass
+        try:
+            os.unlink(pidfile)
+        except OSError:
+            pass
+
+
+def kill_child_ffmpeg(paths) -> int:
+    """
+    Kill ffmpeg children of this process whose command line mentions one of `paths`
+    (yt_dlp's merger / fixup runs). Only possible where /proc exists; returns the count.
+    """
+    if not os.path.isdir("/proc"):
+        return 0
+    needles = [Path(p).stem for p in paths if p]
+    if not needles:
+        return 0
+    me, killed = str(os.getpid()), 0
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as fh:
+                ppid = fh.read().rsplit(")", 1)[1].split()[1]
+            if ppid != me:
+                continue
+            with open(f"/proc/{entry}/cmdline", "rb") as fh:
+                argv = fh.read().decode(errors="ignore").split("\0")
+        except (OSError, IndexError):
+            continue
+        if "ffmpeg" in os.path.basename(argv[0]) and any(n in arg for n in needles for arg in argv[1:]):
+            try:
+                os.kill(int(entry), getattr(signal, "SIGKILL", signal.SIGTERM))
+                killed += 1
+            except OSError:
+                pass
+    return killed
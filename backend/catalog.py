@@ -0,0 +1,322 @@
+# backend/catalog.py
+"""
+Incremental catalog of the files under the download roots.
+
+The `catalog` table (models.CatalogEntry) holds one row per file: path, size,
+mtime, media duration and the history entry it came from. It is built by one
+full scan and then kept current:
+  * with `watchdog` installed (inotify on Linux, FSEvents / ReadDirectoryChangesW
+    elsewhere), file events are batched and applied every CATALOG_FLUSH_SECONDS;
+  * without it, a rescan runs every CATALOG_RESCAN_SECONDS.
+Each row caches its ffprobe result for the (path, size, mtime) it was probed
+at, so scans are incremental: only files whose size or mtime changed are
+re-probed and written, and rows of vanished files are removed. Moves seen by the
+watcher keep the row (and its history link); a file moved or renamed while no
+watcher ran is matched to its vanished row by (name, size, mtime) on the next
+scan instead of being probed again.
+
+History, dedup and analytics queries can join `catalog.history_id` / `catalog.name`
+against `history` instead of touching the filesystem.
+"""
+
+import datetime
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import or_
+
+from db import SessionLocal
+from models import CatalogEntry, History
+from postprocess import probe_duration
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:  # optional: fall back to periodic rescans
+    Observer = None
+    FileSystemEventHandler = object
+
+CATALOG_RESCAN_SECONDS = float(os.environ.get("CATALOG_RESCAN_SECONDS", "300"))
+CATALOG_FLUSH_SECONDS = float(os.environ.get("CATALOG_FLUSH_SECONDS", "2"))
+
+MEDIA_EXTENSIONS = {".mp4", ".mkv", ".webm", ".m4a", ".mp3", ".opus", ".ogg", ".flac", ".mov", ".avi", ".wav"}
+# work files that never belong in the catalog
+SKIP_SUFFIXES = (".part", ".ytdl", ".tmp", ".part.json", ".pid")
+
+
+def _unchanged(entry: CatalogEntry, st: os.stat_result) -> bool:
+    """The row's cached probe still describes the file."""
+    return entry.size == st.st_size and abs(entry.mtime - st.st_mtime) <= 1e-3
+
+
+def _move_key(name: str, size: int, mtime: float) -> Tuple[str, int, float]:
+    return name, size, round(mtime, 3)
+
+
+def _skip(path: Path) -> bool:
+    name = path.name
+    return (name.startswith(".") or name.endswith(SKIP_SUFFIXES) or ".part-Frag" in name
+            or ".pp-tmp." in name or any(part.startswith(".") for part in path.parent.parts[-2:]))
+
+
+class _Root:
+    def __init__(self, name: str, path: Path, recursive: bool):
+        self.name = name
+        self.path = Path(path)
+        self.recursive = recursive
+
+    def contains(self, path: Path) -> bool:
+        try:
+            rel = path.relative_to(self.path)
+        except ValueError:
+            return False
+        return self.recursive or len(rel.parts) == 1
+
+    def walk(self) -> Iterable[Tuple[Path, os.stat_result]]:
+        stack = [self.path]
+        while stack:
+            current = stack.pop()
+            try:
+                entries = list(os.scandir(current))
+            except OSError:
+                continue
+            for entry in entries:
+                path = Path(entry.path)
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if self.recursive and not entry.name.startswith("."):
+                            stack.append(path)
+                    elif entry.is_file() and not _skip(path):
+                        yield path, entry.stat()
+                except OSError:
+                    continue
+
+
+class Catalog:
+    def __init__(self):
+        self.roots: List[_Root] = []
+        self._pending: Dict[str, Optional[str]] = {}  # path -> moved-from path (or None)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._observer = None
+        self._thread: Optional[threading.Thread] = None
+        self.last_scan: Optional[dict] = None
+
+    def add_root(self, name: str, path, recursive: bool = True):
+        self.roots.append(_Root(name, path, recursive))
+        # most specific root first (Torrents lives inside Downloads)
+        self.roots.sort(key=lambda r: len(r.path.parts), reverse=True)
+
+    def root_of(self, path: Path) -> Optional[str]:
+        for root in self.roots:
+            if root.contains(path):
+                return root.name
+        return None
+
+    # --- lifecycle ---
+    def start(self):
+        """Initial scan and change tracking, on a background thread."""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="catalog")
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._observer is not None:
+            try:
+                self._observer.stop()
+            except Exception:
+                pass
+
+    def _run(self):
+        self._safe_scan()
+        if Observer is not None:
+            observer = Observer()
+            handler = _EventHandler(self)
+            for root in self.roots:
+                if root.path.exists():
+                    observer.schedule(handler, str(root.path), recursive=root.recursive)
+            observer.start()
+            self._observer = observer
+            while not self._stop.wait(CATALOG_FLUSH_SECONDS):
+                self.flush()
+        else:
+            while not self._stop.wait(CATALOG_RESCAN_SECONDS):
+                self._safe_scan()
+
+    def _safe_scan(self):
+        try:
+            self.scan()
+        except Exception as e:
+            print(f"[catalog] scan failed: {e}")
+
+    # --- full (incremental) scan ---
+    def scan(self) -> dict:
+        seen: Dict[str, Tuple[str, os.stat_result]] = {}
+        for root in self.roots:
+            for path, st in root.walk():
+                key = str(path)
+                if key not in seen and self.root_of(path) == root.name:
+                    seen[key] = (root.name, st)
+
+        added = updated = moved = removed = 0
+        db = SessionLocal()
+        try:
+            known = {e.path: e for e in db.query(CatalogEntry).all()}
+            new_paths = []
+            for path, (root, st) in seen.items():
+                entry = known.pop(path, None)
+                if entry is None:
+                    new_paths.append(path)
+                elif not _unchanged(entry, st):
+                    self._refresh(entry, Path(path), st)
+                    updated += 1
+            # what is left in `known` vanished; a new path with the same name, size and mtime is that file moved
+            vanished = {_move_key(e.name, e.size, e.mtime): e for e in known.values()}
+            for path in new_paths:
+                root, st = seen[path]
+                entry = vanished.pop(_move_key(Path(path).name, st.st_size, st.st_mtime), None)
+                if entry is not None:
+                    known.pop(entry.path, None)
+                    entry.path, entry.root = path, root
+                    moved += 1
+                else:
+                    db.add(self._new_entry(db, Path(path), root, st))
+                    added += 1
+            for entry in known.values():
+                db.delete(entry)
+                removed += 1
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        self.last_scan = {"at": datetime.datetime.utcnow().isoformat(), "files": len(seen),
+                          "added": added, "updated": updated, "moved": moved, "removed": removed}
+        return self.last_scan
+
+    def _new_entry(self, db, path: Path, root: str, st: os.stat_result,
+                   history_id: Optional[str] = None) -> CatalogEntry:
+        entry = CatalogEntry(path=str(path), name=path.name, root=root)
+        self._refresh(entry, path, st)
+        entry.history_id = history_id or self._history_for(db, path.name)
+        return entry
+
+    def _refresh(self, entry: CatalogEntry, path: Path, st: os.stat_result):
+        entry.size = st.st_size
+        entry.mtime = st.st_mtime
+        entry.duration = (probe_duration(str(path)) or None) if path.suffix.lower() in MEDIA_EXTENSIONS else None
+        entry.scanned_at = datetime.datetime.utcnow()
+
+    def _history_for(self, db, name: str) -> Optional[str]:
+        row = (db.query(History.id).filter(History.filename == name)
+               .order_by(History.created_at.desc()).first())
+        return row[0] if row else None
+
+    # --- single-file updates (watcher events, finished jobs) ---
+    def record(self, path, history_id: Optional[str] = None):
+        """Catalog `path` now (a download just finished) and link it to `history_id`; a directory records every file in it."""
+        path = Path(path)
+        if path.is_dir():
+            for child, _ in _Root("", path, True).walk():
+                self._apply(child, history_id=history_id)
+        else:
+            self._apply(path, history_id=history_id)
+
+    def notify(self, path: str, moved_from: Optional[str] = None):
+        """Queue a changed path; applied in batches by flush()."""
+        with self._lock:
+            self._pending[path] = moved_from
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for path, moved_from in pending.items():
+            try:
+                self._apply(Path(path), moved_from=moved_from)
+            except Exception as e:
+                print(f"[catalog] update failed for {path}: {e}")
+
+    def _apply(self, path: Path, moved_from: Optional[str] = None, history_id: Optional[str] = None):
+        root = self.root_of(path)
+        db = SessionLocal()
+        try:
+            entry = db.query(CatalogEntry).filter(CatalogEntry.path == str(path)).first()
+            if moved_from:
+                old = db.query(CatalogEntry).filter(CatalogEntry.path == moved_from).first()
+                if old is not None and entry is None:
+                    old.path, old.name, old.root = str(path), path.name, root
+                    entry = old
+                elif old is not None:
+                    db.delete(old)
+            try:
+                st = path.stat()
+            except OSError:
+                st = None
+            if st is None or root is None or not path.is_file() or _skip(path):
+                if entry is not None:
+                    db.delete(entry)
+            elif entry is None:
+                db.add(self._new_entry(db, path, root, st, history_id))
+            else:
+                if not _unchanged(entry, st):
+                    self._refresh(entry, path, st)
+                if history_id:
+                    entry.history_id = history_id
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    # --- queries ---
+    def query(self, root: Optional[str] = None, q: Optional[str] = None,
+              limit: int = 200, offset: int = 0) -> List[dict]:
+        db = SessionLocal()
+        try:
+            rows = db.query(CatalogEntry, History).outerjoin(History, History.id == CatalogEntry.history_id)
+            if root:
+                rows = rows.filter(CatalogEntry.root == root)
+            if q:
+                rows = rows.filter(or_(CatalogEntry.name.ilike(f"%{q}%"), History.url.ilike(f"%{q}%")))
+            rows = rows.order_by(CatalogEntry.mtime.desc()).offset(offset).limit(limit).all()
+            out = []
+            for entry, history in rows:
+                item = entry.to_dict()
+                item["history"] = {"url": history.url, "mode": history.mode, "status": history.status} \
+                    if history else None
+                out.append(item)
+            return out
+        finally:
+            db.close()
+
+    def find(self, name: str) -> Optional[str]:
+        """Path of the newest cataloged file called `name`, if any."""
+        db = SessionLocal()
+        try:
+            entry = (db.query(CatalogEntry).filter(CatalogEntry.name == name)
+                     .order_by(CatalogEntry.mtime.desc()).first())
+            return entry.path if entry else None
+        finally:
+            db.close()
+
+
+class _EventHandler(FileSystemEventHandler):
+    def __init__(self, catalog: Catalog):
+        super().__init__()
+        self.catalog = catalog
+
+    def on_any_event(self, event):
+        if event.is_directory:
+            return
+        if event.event_type == "moved":
+            self.catalog.notify(event.dest_path, moved_from=event.src_path)
+        else:
+            self.catalog.notify(event.src_path)
+
+
+catalog = Catalog()
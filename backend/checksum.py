@@ -0,0 +1,235 @@
+# backend/checksum.py
+"""
+Content hashes computed while a download is written, so integrity checks and
+duplicate detection never need a second pass over a finished file.
+
+TailHasher follows a file as the downloader writes it: a background thread reads
+the newly written bytes (up to `available()`, e.g. the ranged downloader's
+contiguous prefix, or the file size for yt-dlp's sequential .part writes) and
+feeds them to the hash while they are still in the page cache. The handle stays
+open across the downloader's .part -> final rename (on Windows it is opened with
+FILE_SHARE_DELETE so the rename still succeeds), and finish() drains the rest.
+
+DownloadHashes wires TailHashers into yt-dlp's progress hooks, one per file it
+downloads. Only a file that is kept as downloaded is hashed while it streams: a
+file ffmpeg rewrites afterwards (format merge, fixups, audio conversion) would
+not match, so for those nothing is hashed during the download and result_for()
+hashes the final output once. Every job reads its output at most once.
+
+BLAKE3 is used when the `blake3` package is installed, SHA-256 otherwise.
+
+    DOWNLOAD_CHECKSUM=""   default for jobs that do not ask: "" (off) | auto | blake3 | sha256
+"""
+
+import hashlib
+import os
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+try:
+    from blake3 import blake3
+except ImportError:  # optional: SHA-256 only
+    blake3 = None
+
+CHECKSUM_DEFAULT = os.environ.get("DOWNLOAD_CHECKSUM", "")
+READ_SIZE = 1024 * 1024
+POLL_SECONDS = 0.2
+
+
+def resolve_algorithm(option) -> Optional[str]:
+    """Algorithm for a job's `checksum` option (True / "auto" / "blake3" / "sha256"; None = default)."""
+    if option is None or option == "":
+        option = CHECKSUM_DEFAULT
+    if option is False or str(option).lower() in ("", "0", "false", "off", "none"):
+        return None
+    option = str(option).lower()
+    if option == "blake3" and blake3 is not None:
+        return "blake3"
+    if option == "sha256" or blake3 is None:
+        return "sha256"
+    return "blake3"
+
+
+def new_hash(algorithm: str):
+    return blake3() if algorithm == "blake3" else hashlib.sha256()
+
+
+def _open_shared(path: str):
+    """Open for reading without blocking the writer's rename (FILE_SHARE_DELETE on Windows)."""
+    if os.name != "nt":
+        return open(path, "rb")
+    import ctypes
+    import msvcrt
+    from ctypes import wintypes
+    create = ctypes.WinDLL("kernel32", use_last_error=True).CreateFileW
+    create.restype = wintypes.HANDLE
+    handle = create(str(path), 0x80000000, 0x7, None, 3, 0x80, None)  # GENERIC_READ, share r/w/delete, OPEN_EXISTING
+    if handle == wintypes.HANDLE(-1).value:
+        raise OSError(ctypes.get_last_error(), f"cannot open {path}")
+    return os.fdopen(msvcrt.open_osfhandle(handle, os.O_RDONLY | os.O_BINARY), "rb")
+
+
+def checksum_result(algorithm: str, digest: str, size: int) -> Dict:
+    return {"algorithm": algorithm, "digest": digest, "size": size}
+
+
+def hash_file(path: str, algorithm: str) -> Dict:
+    h = new_hash(algorithm)
+    size = 0
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(READ_SIZE), b""):
+            h.update(chunk)
+            size += len(chunk)
+    return checksum_result(algorithm, h.hexdigest(), size)
+
+
+class TailHasher:
+    def __init__(self, path: str, algorithm: str, available: Optional[Callable[[], int]] = None):
+        self.path = str(path)
+        self.algorithm = algorithm
+        self.available = available
+        self.offset = 0
+        self._hash = new_hash(algorithm)
+        self._fh = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def start(self) -> "TailHasher":
+        self._thread = threading.Thread(target=self._follow, daemon=True, name="tail-hasher")
+        self._thread.start()
+        return self
+
+    def _follow(self):
+        while not self._stop.is_set():
+            try:
+                moved = self._read(self.available() if self.available else None)
+            except OSError:
+                moved = 0
+            if not moved:
+                self._stop.wait(POLL_SECONDS)
+
+    def _read(self, limit: Optional[int]) -> int:
+        """Hash newly written bytes up to `limit` (None = current end of file); returns bytes read."""
+        with self._lock:
+            if self._fh is None:
+                if not os.path.exists(self.path):
+                    return 0
+                self._fh = _open_shared(self.path)
+            size = os.fstat(self._fh.fileno()).st_size
+            if size < self.offset:
+                # the writer started the file over (no resume support): so do we
+                self._hash = new_hash(self.algorithm)
+                self.offset = 0
+            end = size if limit is None else min(limit, size)
+            moved = 0
+            self._fh.seek(self.offset)
+            while self.offset < end and not self._stop.is_set():
+                chunk = self._fh.read(min(READ_SIZE, end - self.offset))
+                if not chunk:
+                    break
+                self._hash.update(chunk)
+                self.offset += len(chunk)
+                moved += len(chunk)
+            return moved
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def finish(self, final_path: Optional[str] = None) -> Optional[Dict]:
+        """
+        Stop following, hash the rest of the (complete) file and return the checksum.
+        `final_path` is where the file is now, in case it was renamed before it was ever opened.
+        """
+        self.stop()
+        self._stop.clear()
+        if self._fh is None and final_path:
+            self.path = str(final_path)
+        try:
+            self._read(None)
+            return checksum_result(self.algorithm, self._hash.hexdigest(), self.offset)
+        except OSError:
+            return None
+        finally:
+            self.close()
+
+    def close(self):
+        self._stop.set()
+        with self._lock:
+            if self._fh is not None:
+                self._fh.close()
+                self._fh = None
+
+
+def rewritten_after_download(info: dict, filename: str = "") -> bool:
+    """
+    Whether yt-dlp replaces the file it downloads for `info` (as `filename`) with an ffmpeg
+    output: one stream of a merge, or a file one of its fixups applies to (mirrors
+    YoutubeDL.process_info).
+    """
+    protocol = str(info.get("protocol") or "")
+    # merge inputs are written as "<name>.f<format_id>.<ext>" and the per-stream info has no requested_formats
+    merge_part = info.get("format_id") and f".f{info['format_id']}." in Path(filename).name
+    return bool(
+        merge_part or info.get("requested_formats")
+        or info.get("stretched_ratio") not in (1, None)
+        or (info.get("ext") == "m4a" and info.get("container") == "m4a_dash")
+        or protocol == "m3u8_native" or info.get("is_live")
+        or (protocol == "http_dash_segments" and info.get("is_dash_periods"))
+        or protocol == "websocket_frag"
+    )
+
+
+class DownloadHashes:
+    """
+    yt-dlp progress hook: one TailHasher per downloaded file, keyed by its final name.
+    With stream=False (the job converts its output anyway) nothing is hashed until result_for().
+    """
+
+    def __init__(self, algorithm: str, stream: bool = True):
+        self.algorithm = algorithm
+        self.stream = stream
+        self._hashers: Dict[str, TailHasher] = {}
+        self._results: Dict[str, tuple] = {}  # filename -> (checksum, (size, mtime_ns))
+
+    def hook(self, d: dict):
+        filename = d.get("filename")
+        if not filename or not self.stream:
+            return
+        if d["status"] == "downloading" and filename not in self._hashers and d.get("tmpfilename"):
+            if rewritten_after_download(d.get("info_dict") or {}, filename):
+                return  # merged / fixed up by ffmpeg: result_for() hashes the output instead
+            self._hashers[filename] = TailHasher(d["tmpfilename"], self.algorithm).start()
+        elif d["status"] == "finished":
+            hasher = self._hashers.pop(filename, None)
+            if hasher:
+                self.record(filename, hasher.finish(filename))
+
+    def record(self, path: str, result: Optional[Dict]):
+        """Remember the streamed checksum of `path` as it is on disk right now."""
+        if not result:
+            return
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+        self._results[str(Path(path))] = (result, (st.st_size, st.st_mtime_ns))
+
+    def result_for(self, path: str) -> Optional[Dict]:
+        """Checksum of the job's final file: the streamed one if it is still that file, else one pass over it."""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        stored = self._results.get(str(Path(path)))
+        if stored and stored[1] == (st.st_size, st.st_mtime_ns) and stored[0]["size"] == st.st_size:
+            return stored[0]
+        return hash_file(path, self.algorithm)
+
+    def close(self):
+        for hasher in self._hashers.values():
+            hasher.close()
+        self._hashers.clear()
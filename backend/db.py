@@ -1,18 +1,53 @@
 # backend/db.py
+"""
+SQLite access. Writes go through the SQLAlchemy session; the hot history read
+(/history/list, polled by the dashboard) has an async path that skips the ORM:
+plain row tuples over one shared aiosqlite connection, serialized once and kept
+in a response cache keyed by the history version. Every write bumps the version,
+so a cached response is never served after the table changed.
+"""
+import asyncio
+import hashlib
 import json
 import datetime
+import os
+import sqlite3
+import threading
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from models import Base, History
 
-DB_PATH = Path(__file__).parent / "db.sqlite3"
+DB_PATH = Path(os.environ.get("DB_PATH", Path(__file__).parent / "db.sqlite3"))
 DATABASE_URL = f"sqlite:///{DB_PATH}"
 
 engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+try:
+    import aiosqlite
+except ImportError:  # fall back to sqlite3 on the default executor
+    aiosqlite = None
+
+HISTORY_COLUMNS = ("id", "url", "filename", "mode", "status", "created_at", "finished_at", "meta")
+HISTORY_LIST_SQL = f"SELECT {', '.join(HISTORY_COLUMNS)} FROM history ORDER BY created_at DESC LIMIT ?"
+
+
+class HistoryVersion:
+    """Counter bumped by every history write; cached reads are only valid for the version they saw."""
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def bump(self):
+        with self._lock:
+            self.value += 1
+
+
+history_version = HistoryVersion()
+
 def create_tables():
     """Create all tables in the database"""
     Base.metadata.create_all(bind=engine)
@@ -50,6 +85,7 @@ def add_history_entry(data: Dict[str, Any]):
             db.add(hist)
         
         db.commit()
+        history_version.bump()
     except Exception as e:
         db.rollback()
         raise e
@@ -73,6 +109,7 @@ def delete_history(entry_id: str) -> bool:
         if entry:
             db.delete(entry)
             db.commit()
+            history_version.bump()
             return True
         return False
     finally:
@@ -84,5 +121,93 @@ def clear_history():
     try:
         db.query(History).delete()
         db.commit()
+        history_version.bump()
     finally:
         db.close()
+
+
+# --- async read path ---
+def _iso(value: Optional[str]) -> Optional[str]:
+    # SQLAlchemy stores "YYYY-MM-DD HH:MM:SS.ffffff"; History.to_dict returns isoformat
+    return value.replace(" ", "T", 1) if value else value
+
+
+def _history_row(row: Tuple) -> Dict:
+    item = dict(zip(HISTORY_COLUMNS, row))
+    item["created_at"] = _iso(item["created_at"])
+    item["finished_at"] = _iso(item["finished_at"])
+    return item
+
+
+class AsyncReader:
+    """One long-lived read connection shared by the event loop's requests."""
+
+    def __init__(self, path: Path = DB_PATH):
+        self.path = path
+        self._conn = None
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def fetchall(self, sql: str, params: tuple = ()) -> List[Tuple]:
+        if aiosqlite is None:
+            return await asyncio.get_running_loop().run_in_executor(None, self._fetchall_sync, sql, params)
+        conn = await self._connection()
+        async with conn.execute(sql, params) as cursor:
+            return await cursor.fetchall()
+
+    def _fetchall_sync(self, sql: str, params: tuple) -> List[Tuple]:
+        conn = sqlite3.connect(self.path)
+        try:
+            return conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+
+    async def _connection(self):
+        if self._conn is None:
+            if self._lock is None:
+                self._lock = asyncio.Lock()
+            async with self._lock:
+                if self._conn is None:
+                    self._conn = await aiosqlite.connect(self.path)
+        return self._conn
+
+    async def close(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            await conn.close()
+
+
+class HistoryCache:
+    """
+    Serialized /history/list responses per limit, valid while history_version is unchanged.
+    The ETag is a digest of the body, so it stays valid across restarts and between workers
+    (the version counter starts over in every process).
+    """
+
+    def __init__(self, reader: AsyncReader):
+        self.reader = reader
+        self._entries: Dict[int, Tuple[int, bytes, str]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def list(self, limit: int = 200) -> Tuple[bytes, str]:
+        """Return (JSON body of {"history": [...]}, its ETag)."""
+        version = history_version.value
+        cached = self._entries.get(limit)
+        if cached and cached[0] == version:
+            self.hits += 1
+            return cached[1], cached[2]
+        self.misses += 1
+        rows = await self.reader.fetchall(HISTORY_LIST_SQL, (limit,))
+        body = json.dumps({"history": [_history_row(r) for r in rows]}).encode()
+        etag = f'"h{hashlib.blake2b(body, digest_size=12).hexdigest()}"'
+        # a write that landed during the query leaves the entry stale: keep the older version
+        self._entries[limit] = (version, body, etag)
+        return body, etag
+
+    def stats(self) -> dict:
+        return {"version": history_version.value, "entries": len(self._entries),
+                "hits": self.hits, "misses": self.misses}
+
+
+async_reader = AsyncReader()
+history_cache = HistoryCache(async_reader)
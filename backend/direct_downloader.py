@@ -0,0 +1,424 @@
+# backend/direct_downloader.py
+"""
+Multi-connection ranged downloader for direct file URLs (mp4/zip/iso ...).
+
+The file is split into byte ranges fetched in parallel over a pooled set of
+keep-alive connections. The number of connections adapts to measured
+throughput: a connection is added (by splitting the largest remaining range)
+while each addition still raises the aggregate rate, and idle workers steal
+half of the largest range left. The output is preallocated and written in
+place; range progress is checkpointed next to the .part file so every segment
+resumes independently after a cancel, pause or crash.
+
+Progress is reported with the same dicts progress_hook() emits for yt_dlp:
+    {'status': 'downloading', 'downloaded_bytes', 'total_bytes', 'speed', 'eta'}
+"""
+
+import json
+import os
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Any, List, Optional
+from urllib.parse import unquote, urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from bandwidth import bandwidth_manager
+
+DIRECT_EXTENSIONS = {
+    ".mp4", ".mkv", ".webm", ".mov", ".avi", ".m4v", ".mp3", ".m4a", ".flac", ".wav", ".ogg",
+    ".zip", ".7z", ".rar", ".tar", ".gz", ".xz", ".bz2", ".iso", ".img", ".dmg", ".exe", ".msi",
+    ".apk", ".deb", ".rpm", ".pdf", ".bin",
+}
+MAX_CONNECTIONS = int(os.environ.get("DIRECT_MAX_CONNECTIONS", "16"))
+INITIAL_CONNECTIONS = int(os.environ.get("DIRECT_INITIAL_CONNECTIONS", "4"))
+MIN_SEGMENT = 1024 * 1024
+CHUNK_SIZE = 256 * 1024
+CHECKPOINT_INTERVAL = 2.0
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64)"
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """Shared session: keep-alive connections are pooled across segments and jobs."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=32, pool_maxsize=MAX_CONNECTIONS * 4)
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+            _session.headers["User-Agent"] = USER_AGENT
+        return _session
+
+
+def looks_direct(url: str) -> bool:
+    """Cheap check on the URL path; probe_direct() confirms with the server."""
+    parsed = urlparse(url)
+    return parsed.scheme in ("http", "https") and Path(unquote(parsed.path)).suffix.lower() in DIRECT_EXTENSIONS
+
+
+def probe_direct(url: str, timeout: float = 15) -> Optional[Dict[str, Any]]:
+    """
+    Ask the server about `url`. Returns {url, size, ranges, etag, filename} for a
+    downloadable file, or None when it serves HTML (a page for yt_dlp to extract).
+    """
+    session = get_session()
+    try:
+        resp = session.get(url, headers={"Range": "bytes=0-0"}, stream=True, timeout=timeout, allow_redirects=True)
+        resp.close()
+    except requests.RequestException:
+        return None
+    if resp.status_code >= 400 or "text/html" in resp.headers.get("Content-Type", ""):
+        return None
+
+    size = None
+    ranges = resp.status_code == 206
+    content_range = resp.headers.get("Content-Range", "")
+    m = re.search(r"/(\d+)$", content_range)
+    if m:
+        size = int(m.group(1))
+    elif resp.status_code == 200 and resp.headers.get("Content-Length"):
+        size = int(resp.headers["Content-Length"])
+
+    filename = None
+    disposition = resp.headers.get("Content-Disposition", "")
+    m = re.search(r"filename\*=(?:UTF-8'')?([^;]+)|filename=\"?([^\";]+)\"?", disposition, re.I)
+    if m:
+        filename = unquote((m.group(1) or m.group(2)).strip())
+    if not filename:
+        filename = Path(unquote(urlparse(resp.url).path)).name or "download"
+
+    return {
+        "url": resp.url,
+        "size": size,
+        "ranges": ranges and bool(size),
+        "etag": resp.headers.get("ETag") or resp.headers.get("Last-Modified"),
+        "filename": filename,
+    }
+
+
+class DownloadCancelled(Exception):
+    pass
+
+
+class RangeNotHonoured(IOError):
+    """A ranged request came back as something other than the bytes asked for."""
+
+
+# remaining bytes of a segment whose end is only known at EOF
+_UNKNOWN_REMAINING = 1 << 62
+
+
+class _Segment:
+    __slots__ = ("start", "end", "pos", "active")
+
+    def __init__(self, start: int, end: Optional[int], pos: Optional[int] = None):
+        self.start = start
+        self.end = end  # inclusive; None = read to EOF (size unknown)
+        self.pos = start if pos is None else pos
+        self.active = False
+
+    @property
+    def remaining(self) -> int:
+        if self.end is None:
+            return _UNKNOWN_REMAINING
+        return max(0, self.end - self.pos + 1)
+
+
+class RangedDownloader:
+    def __init__(self, probe: Dict[str, Any], dest: str, progress_callback: Callable[[dict], None],
+                 cancel_event: threading.Event, job_id: Optional[str] = None, weight: float = 1.0,
+                 max_connections: int = MAX_CONNECTIONS):
+        self.url = probe["url"]
+        self.size = probe["size"]
+        self.etag = probe.get("etag")
+        self.ranges = probe.get("ranges", False)
+        self.dest = Path(dest)
+        self.part = self.dest.with_name(self.dest.name + ".part")
+        self.state_path = self.dest.with_name(self.dest.name + ".part.json")
+        self.progress_callback = progress_callback
+        self.cancel_event = cancel_event
+        self.job_id = job_id
+        self.weight = weight
+        self.max_connections = max_connections if self.ranges else 1
+        self.segments: List[_Segment] = []
+        self._lock = threading.Lock()
+        self._workers: List[threading.Thread] = []
+        self._errors: List[BaseException] = []
+        # set when a server stops honouring ranges: every worker stops and run() starts over on one stream
+        self._range_failed = threading.Event()
+
+    # --- state ---
+    def _load_segments(self):
+        if self.ranges and self.state_path.exists() and self.part.exists():
+            try:
+                state = json.loads(self.state_path.read_text())
+                if state.get("size") == self.size and state.get("etag") == self.etag:
+                    self.segments = [_Segment(*s) for s in state["segments"]]
+                    return
+            except Exception:
+                pass
+        if self.ranges:
+            count = max(1, min(INITIAL_CONNECTIONS, self.size // MIN_SEGMENT or 1))
+            step = self.size // count
+            self.segments = [_Segment(i * step, (i + 1) * step - 1 if i < count - 1 else self.size - 1)
+                             for i in range(count)]
+        elif self.size is None:
+            # no Content-Length: one sequential stream, read to EOF
+            self.segments = [_Segment(0, None)]
+        else:
+            self.segments = [_Segment(0, self.size - 1)]
+
+    def _save_state(self):
+        if not self.ranges:
+            return
+        with self._lock:
+            segments = [[s.start, s.end, s.pos] for s in self.segments if s.remaining]
+        tmp = self.state_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"url": self.url, "size": self.size, "etag": self.etag, "segments": segments}))
+        os.replace(tmp, self.state_path)
+
+    def _preallocate(self):
+        fresh = not self.part.exists() or not self.ranges
+        with open(self.part, "wb" if fresh else "r+b") as fh:
+            if self.size and fresh:
+                try:
+                    os.posix_fallocate(fh.fileno(), 0, self.size)
+                except (AttributeError, OSError):
+                    fh.truncate(self.size)
+
+    @property
+    def downloaded(self) -> int:
+        with self._lock:
+            if not self.size:
+                return self.segments[0].pos
+            return self.size - sum(s.remaining for s in self.segments)
+
+    @property
+    def contiguous(self) -> int:
+        """Bytes from the start of the file that are fully written (what a tail hasher may read)."""
+        with self._lock:
+            if not self.segments:
+                return 0
+            if not self.size:
+                return self.segments[0].pos
+            return min((s.pos for s in self.segments if s.remaining), default=self.size)
+
+    # --- workers ---
+    def _next_segment(self) -> Optional[_Segment]:
+        """Take an idle segment, or split the largest active one (work stealing)."""
+        with self._lock:
+            for seg in self.segments:
+                if not seg.active and seg.remaining:
+                    seg.active = True
+                    return seg
+            if not self.ranges:
+                return None
+            largest = max(self.segments, key=lambda s: s.remaining, default=None)
+            if not largest or largest.remaining < 2 * MIN_SEGMENT:
+                return None
+            mid = largest.pos + largest.remaining // 2
+            new = _Segment(mid, largest.end)
+            largest.end = mid - 1
+            new.active = True
+            self.segments.append(new)
+            return new
+
+    def _spawn_worker(self) -> bool:
+        if len([w for w in self._workers if w.is_alive()]) >= self.max_connections:
+            return False
+        seg = self._next_segment()
+        if seg is None:
+            return False
+        t = threading.Thread(target=self._worker, args=(seg,), daemon=True)
+        self._workers.append(t)
+        t.start()
+        return True
+
+    def _worker(self, seg: _Segment):
+        session = get_session()
+        try:
+            with open(self.part, "r+b") as fh:
+                while seg is not None:
+                    self._fetch(session, fh, seg)
+                    seg = self._next_segment()
+        except DownloadCancelled:
+            pass
+        except BaseException as e:
+            with self._lock:
+                seg.active = False
+                self._errors.append(e)
+
+    def _range_headers(self, seg: _Segment) -> Dict[str, str]:
+        if not self.ranges:
+            return {}
+        headers = {"Range": f"bytes={seg.pos}-{seg.end}"}
+        # the server sends the whole (new) body instead of the range if the file changed since the probe
+        if self.etag and not self.etag.startswith("W/"):
+            headers["If-Range"] = self.etag
+        return headers
+
+    def _check_range(self, resp: requests.Response, seg: _Segment):
+        """Only a 206 for exactly the requested start (of the probed file) may be written at seg.pos."""
+        if resp.status_code != 206:
+            raise RangeNotHonoured(f"server answered {resp.status_code} to a range request")
+        m = re.match(r"bytes\s+(\d+)-(\d+)/(\d+|\*)", resp.headers.get("Content-Range", ""))
+        if not m or int(m.group(1)) != seg.pos:
+            raise RangeNotHonoured(f"unexpected Content-Range {resp.headers.get('Content-Range')!r} "
+                                   f"for bytes={seg.pos}-{seg.end}")
+        if m.group(3) != "*" and int(m.group(3)) != self.size:
+            raise RangeNotHonoured(f"file size changed from {self.size} to {m.group(3)} bytes")
+
+    def _stopping(self) -> bool:
+        return self.cancel_event.is_set() or self._range_failed.is_set()
+
+    def _fetch(self, session: requests.Session, fh, seg: _Segment):
+        headers = self._range_headers(seg)
+        for attempt in range(5):
+            try:
+                with session.get(self.url, headers=headers, stream=True, timeout=30) as resp:
+                    # a cancel closes the socket so a stalled read returns at once
+                    unwatch = self.cancel_event.on_cancel(resp.close) \
+                        if hasattr(self.cancel_event, "on_cancel") else (lambda: None)
+                    try:
+                        resp.raise_for_status()
+                        if self.ranges:
+                            self._check_range(resp, seg)
+                        fh.seek(seg.pos)
+                        for chunk in resp.iter_content(CHUNK_SIZE):
+                            if self._stopping():
+                                raise DownloadCancelled()
+                            if self.job_id:
+                                bandwidth_manager.throttle(self.job_id, len(chunk))
+                            with self._lock:
+                                # the segment may have been shortened by a stealing worker
+                                take = min(len(chunk), seg.remaining) if self.ranges else len(chunk)
+                                fh.write(chunk[:take])
+                                seg.pos += take
+                                done = self.ranges and seg.remaining == 0
+                            if done:
+                                break
+                    finally:
+                        unwatch()
+                with self._lock:
+                    if seg.end is None:
+                        seg.end = seg.pos - 1  # EOF: the size is known now
+                    short = not self.ranges and seg.remaining
+                    seg.active = False
+                if short:
+                    # without ranges a retry would start over at byte 0
+                    raise IOError(f"connection closed after {seg.pos}/{seg.end + 1} bytes")
+                return
+            except DownloadCancelled:
+                raise
+            except RangeNotHonoured:
+                self._range_failed.set()
+                raise
+            except requests.RequestException:
+                if self.cancel_event.is_set():
+                    raise DownloadCancelled()
+                if attempt == 4 or not self.ranges:
+                    raise
+                time.sleep(min(2 ** attempt, 10))
+                headers = self._range_headers(seg)
+
+    # --- driver ---
+    def run(self) -> str:
+        self._load_segments()
+        self._preallocate()
+        self._transfer()
+        if self._range_failed.is_set() and not self.cancel_event.is_set():
+            # nothing from the rejected responses was written; start over on one connection
+            reason = next((e for e in self._errors if isinstance(e, RangeNotHonoured)), "range request refused")
+            print(f"[direct] {reason}; restarting {self.url} on a single connection")
+            self._single_stream()
+            self._preallocate()
+            self._transfer()
+
+        if self.cancel_event.is_set():
+            self._save_state()
+            raise DownloadCancelled("Download cancelled")
+        if self._errors:
+            self._save_state()
+            raise self._errors[0]
+
+        if self.size is not None:
+            # a non-ranged stream is written as it arrives, so it may also overrun the length
+            written = self.downloaded if self.ranges else self.segments[0].pos
+            if written != self.size:
+                self._save_state()
+                raise IOError(f"incomplete download: {written}/{self.size} bytes")
+        elif not self.segments[0].pos:
+            raise IOError("server sent no data")
+        os.replace(self.part, self.dest)
+        try:
+            self.state_path.unlink()
+        except OSError:
+            pass
+        return str(self.dest)
+
+    def _single_stream(self):
+        """Drop the ranged state: one sequential request for the whole file from byte 0."""
+        self.ranges = False
+        self.max_connections = 1
+        self.segments = [_Segment(0, self.size - 1 if self.size else None)]
+        self._workers, self._errors = [], []
+        self._range_failed.clear()
+        try:
+            self.state_path.unlink()
+        except OSError:
+            pass
+
+    def _transfer(self):
+        if self.job_id:
+            # bytes go through throttle(); the allocation only needs to reach the token bucket
+            bandwidth_manager.register(self.job_id, "direct", lambda limit: None, self.weight)
+        try:
+            for _ in range(min(INITIAL_CONNECTIONS, self.max_connections)):
+                if not self._spawn_worker():
+                    break
+            self._control_loop()
+        finally:
+            if self.job_id:
+                bandwidth_manager.unregister(self.job_id)
+
+    def _control_loop(self):
+        """Report progress, checkpoint ranges and adapt the number of connections."""
+        last_bytes, last_time = self.downloaded, time.monotonic()
+        last_checkpoint = last_time
+        best_rate, grow_at = 0.0, last_time + 2.0
+        speed = 0.0
+        while any(w.is_alive() for w in self._workers):
+            time.sleep(0.5)
+            now = time.monotonic()
+            done = self.downloaded
+            rate = (done - last_bytes) / max(now - last_time, 1e-6)
+            speed = rate if not speed else 0.6 * speed + 0.4 * rate
+            last_bytes, last_time = done, now
+            if self.job_id:
+                bandwidth_manager.report(self.job_id, speed)
+
+            self.progress_callback({
+                "status": "downloading",
+                "downloaded_bytes": done,
+                "total_bytes": self.size or 0,
+                "speed": speed,
+                "eta": int((self.size - done) / speed) if self.size and speed > 0 else 0,
+                "connections": len([w for w in self._workers if w.is_alive()]),
+            })
+            if now - last_checkpoint >= CHECKPOINT_INTERVAL:
+                self._save_state()
+                last_checkpoint = now
+
+            # grow while every added connection still raises throughput by >10%
+            if now >= grow_at and not self._stopping():
+                if speed > best_rate * 1.1:
+                    best_rate = speed
+                    self._spawn_worker()
+                grow_at = now + 2.0
@@ -1,85 +1,292 @@
 import threading
 import time
 from pathlib import Path
-from yt_dlp import YoutubeDL
+
+from postprocess import transcode_audio
+from bandwidth import bandwidth_manager
+from fragments import fragment_tuner, FragmentMonitor
+from retry import call_with_retry, classify
+from cancellation import kill_child_ffmpeg
+from admission import admission, expected_size, format_bytes
+from direct_downloader import RangedDownloader, looks_direct, probe_direct
+from checksum import DownloadHashes, TailHasher
+from startup import lazy_module
+
+yt_dlp = lazy_module("yt_dlp")
 
 def sanitize_filename(title):
     """Remove characters not allowed in Windows/Linux filenames"""
     # Remove: \ / : * ? " < > |
     return ''.join(c for c in title if c not in r'\/:*?"<>|').strip()
 
-def run_download_in_thread(url, download_dir, mode, format_id, progress_callback, cancel_event):
+def run_download_in_thread(url, download_dir, mode, format_id, progress_callback, cancel_event, info=None,
+                           format_opts=None, audio_format='mp3', audio_quality='192', parallel_transcode=False,
+                           job_id=None, weight=1.0, fragment_concurrency=None, checksum=None):
+    """
+    Download `url` on a daemon thread. `info` may be an info dict already extracted
+    for this url (e.g. warmed by /formats/batch); extraction is then skipped.
+    `format_opts` ({"format", "format_sort"} from formats.resolve_format_opts) overrides
+    the plain format_id selection in video mode; audio mode always takes 'bestaudio/best'.
+    In audio mode the conversion to `audio_format` ("mp3", "m4a", "opus", ..., or "best"
+    to keep the source codec) runs in the post-processing pool, as a stream copy when
+    the source codec already matches. With `parallel_transcode` long inputs are split at
+    keyframes and encoded segment-parallel, with per-segment progress on the callback.
+    With `job_id` the download is registered with the bandwidth manager and held to its
+    share of the global cap (by `weight`) by HookThrottle, across all fragment threads.
+    HLS/DASH fragments are fetched `fragment_concurrency` at a time (int, or "auto"/None
+    for the global setting / per-host tuner); fragment timings ride along on progress
+    messages as `fragments`.
+    Extraction and download failures are retried by error class (retry.call_with_retry);
+    while the site's circuit breaker is open the job waits and reports why.
+    Direct file URLs (the server answers with a file, not a page) skip yt-dlp and use
+    the multi-connection ranged downloader.
+    Before writing, the job reserves its expected size against free disk space and
+    waits ('waiting', `disk_wait`) while it does not fit (admission.py). The bandwidth
+    share and the reservation are released as soon as the transfer ends, before ffmpeg work.
+    With a cancellation.JobControl as `cancel_event`, cancelling kills running ffmpeg
+    work at once, pausing ends the job as 'paused' with its partial files kept, and a
+    cancel with cleanup removes them.
+    With `checksum` ("blake3" / "sha256", see checksum.resolve_algorithm) the finished
+    result carries `checksum`: hashed while the file is written when it is kept as
+    downloaded, or in one pass over the output when ffmpeg merges, fixes up or converts it.
+    """
+    def release_slot():
+        # the job's bandwidth share and disk reservation (both idempotent)
+        if job_id:
+            bandwidth_manager.unregister(job_id)
+            admission.release(job_id)
+
     def download_task():
+        unwatch = lambda: None
+        # a cancel or pause frees the job's share at once, even while it is still inside extraction
+        unwatch_release = cancel_event.on_cancel(release_slot) if hasattr(cancel_event, 'on_cancel') \
+            else (lambda: None)
+        # audio mode always converts the download, so only the converted file is hashed
+        hashes = DownloadHashes(checksum, stream=(mode != 'audio')) if checksum else None
         try:
-            output_template = str(Path(download_dir) / "%(title)s.%(ext)s")
-            
-            ydl_opts = {
-                'format': format_id if mode == 'video' else 'bestaudio/best',
-                'outtmpl': output_template,
-                'noplaylist': True,
-                'progress_hooks': [lambda d: progress_hook(d, progress_callback, cancel_event)],
-                'quiet': True,
-                'no_warnings': True,
-                'nocheckcertificate': True,
-                'windowsfilenames': True,  # Let yt-dlp handle sanitization
-                'retries': 3,
-            }
-            
-            if mode == 'audio':
-                ydl_opts['postprocessors'] = [{
-                    'key': 'FFmpegExtractAudio',
-                    'preferredcodec': 'mp3',
-                    'preferredquality': '192',
-                }]
+            direct = None
+            if info is None and looks_direct(url):
+                direct = download_direct(url, download_dir, progress_callback, cancel_event, job_id, weight,
+                                         hashes=hashes)
             
-            with YoutubeDL(ydl_opts) as ydl:
-                # Extract info first
-                info = ydl.extract_info(url, download=False)
+            if direct:
+                final_path, final_filename = direct
+            else:
+                output_template = str(Path(download_dir) / "%(title)s.%(ext)s")
+                frag_opts = fragment_tuner.ydl_opts(url, fragment_concurrency)
+                fragments = FragmentMonitor(url, frag_opts['concurrent_fragment_downloads'])
+                
+                ydl_opts = {
+                    'format': format_id if mode == 'video' else 'bestaudio/best',
+                    'outtmpl': output_template,
+                    'noplaylist': True,
+                    'progress_hooks': [fragments.hook, lambda d: track_partials(d, cancel_event)]
+                                      + ([hashes.hook] if hashes else [])
+                                      + [lambda d: progress_hook(d, progress_callback, cancel_event, fragments)],
+                    'postprocessor_hooks': [lambda d: postprocessor_hook(d, cancel_event)],
+                    'logger': fragments,  # spots 429/throttling in fragment retry warnings
+                    'quiet': True,
+                    'no_warnings': True,
+                    'nocheckcertificate': True,
+                    'windowsfilenames': True,  # Let yt-dlp handle sanitization
+                    'retries': 3,
+                    **frag_opts,
+                }
                 
-                if cancel_event.is_set():
-                    progress_callback({'status': 'cancelled'})
-                    return
+                if format_opts and mode == 'video':
+                    # a video target's format / format_sort must not replace 'bestaudio/best'
+                    ydl_opts.update(format_opts)
                 
-                # Get the sanitized title (what yt-dlp will actually use)
-                original_title = info.get('title', 'Unknown')
-                sanitized_title = ydl.prepare_filename(info)  # This gives us the actual filename yt-dlp will use
-                sanitized_title = Path(sanitized_title).stem  # Remove extension
+                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                    if hasattr(cancel_event, 'on_cancel'):
+                        # yt-dlp's own ffmpeg runs (merge / fixup) are not ours to pidfile
+                        unwatch = cancel_event.on_cancel(
+                            lambda: kill_child_ffmpeg(cancel_event.partials | cancel_event.outputs))
                 
-                # Download
-                ydl.download([url])
+                    # Extract info first (unless it was warmed by a formats call)
+                    extracted = info or call_with_retry(lambda: ydl.extract_info(url, download=False), url,
+                                                        cancel_event, progress_callback)
                 
-                # Build the actual final path
-                if mode == 'audio':
-                    ext = 'mp3'
-                else:
-                    ext = info.get('ext', 'mp4')
+                    if cancel_event.is_set():
+                        progress_callback({'status': 'cancelled'})
+                        return
+                    
+                    if job_id:
+                        # registered only now, so a job still extracting holds no bandwidth share.
+                        # Bytes are drawn from the job's bucket in a progress hook rather than via yt-dlp's
+                        # `ratelimit`, which each concurrent fragment thread would apply on its own.
+                        bandwidth_manager.register(job_id, 'ytdlp', lambda limit: None, weight)
+                        ydl.add_progress_hook(HookThrottle(job_id))
+                        ydl.add_progress_hook(lambda d: bandwidth_manager.report(job_id, d.get('speed')))
+                        ydl.add_progress_hook(
+                            lambda d: admission.update(job_id, d.get('downloaded_bytes'), d.get('filename', '')))
+                        admit(job_id, download_dir, expected_size(extracted, mode), cancel_event, progress_callback)
                 
-                # Use the sanitized title
-                final_filename = f"{sanitized_title}.{ext}"
-                final_path = str(Path(download_dir) / final_filename)
+                    # Get the sanitized title (what yt-dlp will actually use)
+                    original_title = extracted.get('title', 'Unknown')
+                    sanitized_title = ydl.prepare_filename(extracted)  # This gives us the actual filename yt-dlp will use
+                    sanitized_title = Path(sanitized_title).stem  # Remove extension
                 
-                print(f"✅ Download complete: {final_path}")
+                    # Download from the extracted info (no second extraction)
+                    result = call_with_retry(lambda: ydl.process_ie_result(extracted, download=True), url,
+                                             cancel_event, progress_callback,
+                                             site=extracted.get('extractor_key'))
+                    downloads = (result or {}).get('requested_downloads') or []
+                    downloaded_path = downloads[0].get('filepath') if downloads else None
                 
-                progress_callback({
-                    'status': 'finished',
-                    'result': {
-                        'final_path': final_path,
-                        'filename': final_filename
-                    }
-                })
+                    # Build the actual final path
+                    ext = extracted.get('ext', 'mp4')
+                    final_filename = f"{sanitized_title}.{ext}"
+                    final_path = str(Path(download_dir) / final_filename)
+                    if downloaded_path:
+                        final_path = downloaded_path
+                        final_filename = Path(downloaded_path).name
+            
+            # the transfer is over: let other jobs have the bandwidth and disk reservation during ffmpeg
+            release_slot()
+            
+            if mode == 'audio':
+                # Hand the file to the post-processing pool; this thread only waits on the result
+                progress_callback({'status': 'processing', 'message': f'Converting audio ({audio_format})...'})
+                converted = transcode_audio(final_path, audio_format, audio_quality,
+                                            progress_callback=progress_callback, parallel=parallel_transcode,
+                                            cancel_event=cancel_event)
+                final_path = converted['path']
+                final_filename = Path(final_path).name
+                progress_callback({'status': 'processing', 'message': f"Audio {converted['method']} done"})
                 
+            print(f"✅ Download complete: {final_path}")
+            
+            result_info = {
+                'final_path': final_path,
+                'filename': final_filename
+            }
+            if hashes:
+                # streamed while downloading, or one pass over the merged / converted output
+                result_info['checksum'] = hashes.result_for(final_path)
+            progress_callback({
+                'status': 'finished',
+                'result': result_info
+            })
+            
         except Exception as e:
+            if cancel_event.is_set():
+                status = 'paused' if getattr(cancel_event, 'paused', False) else 'cancelled'
+                print(f"⏹ Download {status}: {url}")
+                progress_callback({'status': status})
+                return
             print(f"❌ Download error: {e}")
             progress_callback({
                 'status': 'error',
-                'error': str(e)
+                'error': str(e),
+                'error_class': getattr(e, 'error_class', None) or classify(e)
             })
+        finally:
+            unwatch()
+            unwatch_release()
+            if hashes:
+                hashes.close()
+            release_slot()
+            if cancel_event.is_set() and getattr(cancel_event, 'cleanup', False):
+                removed = cancel_event.remove_partials()
+                if removed:
+                    print(f"🧹 Removed {len(removed)} partial file(s)")
     
     thread = threading.Thread(target=download_task, daemon=True)
     thread.start()
     return thread
 
-def progress_hook(d, callback, cancel_event):
+def download_direct(url, download_dir, progress_callback, cancel_event, job_id=None, weight=1.0, hashes=None):
+    """
+    Fetch a direct file URL with RangedDownloader. Returns (final_path, filename), or
+    None when the server serves a page instead of a file (left to yt-dlp).
+    With `hashes` (checksum.DownloadHashes) the file's contiguous written prefix is
+    hashed as the ranges fill in.
+    """
+    probe = probe_direct(url)
+    if probe is None:
+        return None
+    final_filename = sanitize_filename(probe['filename']) or 'download'
+    final_path = str(Path(download_dir) / final_filename)
+    
+    def on_progress(d):
+        if job_id:
+            admission.update(job_id, d.get('downloaded_bytes'))
+        progress_callback(d)
+    
+    downloader = RangedDownloader(probe, final_path, on_progress, cancel_event, job_id=job_id, weight=weight)
+    if hasattr(cancel_event, 'track'):
+        # the .part and its checkpoint are ours; an existing file of the same name is not
+        cancel_event.track(str(downloader.part))
+        cancel_event.track_output(final_path)
+    if job_id:
+        admit(job_id, download_dir, probe['size'] or 0, cancel_event, progress_callback)
+    
+    on_progress({'status': 'downloading', 'downloaded_bytes': 0, 'total_bytes': probe['size'] or 0,
+                 'speed': 0, 'eta': 0})
+    hasher = TailHasher(downloader.part, hashes.algorithm, available=lambda: downloader.contiguous).start() \
+        if hashes and hashes.stream else None
+    try:
+        downloader.run()
+    except BaseException:
+        if hasher:
+            hasher.close()
+        raise
+    if hasher:
+        hashes.record(final_path, hasher.finish(final_path))
+    return final_path, final_filename
+
+def admit(job_id, download_dir, size, cancel_event, progress_callback):
+    """Reserve `size` bytes of disk for the job, reporting while it waits for room."""
+    def on_wait(state):
+        progress_callback({
+            'status': 'waiting',
+            'message': f"Waiting for disk space: {format_bytes(state['needed'])} needed, "
+                       f"{format_bytes(state['available'])} available",
+            'disk_wait': state,
+        })
+    admission.acquire(job_id, download_dir, size, cancel_event, on_wait)
+
+class HookThrottle:
+    """
+    yt-dlp progress hook that draws every downloaded byte from the job's token bucket
+    (bandwidth_manager.throttle). Hooks run on the thread that fetched the bytes, so with
+    concurrent fragments each thread is held back and the job as a whole stays at its
+    allocation; yt-dlp's own `ratelimit` would be applied per fragment instead.
+    """
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self._seen = {}  # file -> downloaded_bytes already drawn
+        self._lock = threading.Lock()
+
+    def __call__(self, d):
+        if d.get('status') != 'downloading':
+            return
+        key = d.get('tmpfilename') or d.get('filename')
+        done = d.get('downloaded_bytes') or 0
+        with self._lock:
+            delta = done - self._seen.get(key, 0)
+            if delta > 0:
+                self._seen[key] = done
+        if delta > 0:
+            bandwidth_manager.throttle(self.job_id, delta)
+
+def track_partials(d, cancel_event):
+    """Remember the files yt-dlp writes so a cancel with cleanup can remove them."""
+    if hasattr(cancel_event, 'track'):
+        if d.get('tmpfilename') != d.get('filename'):
+            cancel_event.track(d.get('tmpfilename'))
+        if d.get('status') == 'downloading':
+            # only reported while yt-dlp writes it; an already downloaded file goes straight to 'finished'
+            cancel_event.track_output(d.get('filename'))
+
+def postprocessor_hook(d, cancel_event):
+    # stop before the next post-processor (merge, fixup, ...) starts
+    if cancel_event.is_set():
+        raise Exception("Download cancelled")
+
+def progress_hook(d, callback, cancel_event, fragments=None):
     if cancel_event.is_set():
         raise Exception("Download cancelled")
     
@@ -88,13 +295,17 @@ def progress_hook(d, callback, cancel_event):
         downloaded = d.get('downloaded_bytes', 0)
         speed = d.get('speed', 0)
         eta = d.get('eta', 0)
-        callback({
+        message = {
             'status': 'downloading',
             'downloaded_bytes': downloaded,
             'total_bytes': total,
             'speed': speed,
             'eta': eta,
-        })
+        }
+        metrics = fragments.metrics() if fragments else None
+        if metrics:
+            message['fragments'] = metrics
+        callback(message)
     elif d['status'] == 'finished':
         callback({
             'status': 'processing',
@@ -103,7 +314,7 @@ def progress_hook(d, callback, cancel_event):
 
 def get_thumbnail_for_url(url):
     try:
-        with YoutubeDL({'quiet': True}) as ydl:
+        with yt_dlp.YoutubeDL({'quiet': True}) as ydl:
             info = ydl.extract_info(url, download=False)
             return info.get('thumbnail', '')
     except Exception:
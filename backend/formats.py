@@ -0,0 +1,442 @@
+# backend/formats.py
+"""
+Format extraction and selection shared by the /formats endpoints and the downloader.
+
+extract_info() runs yt_dlp metadata extraction, summarize_formats() turns the
+raw info dict into the {video_formats, audio_formats} shape the UI expects and
+info_cache keeps recently extracted info dicts so a download that follows a
+/formats call does not extract the same video a second time.
+
+The selection engine (parse_target / select_format / build_format_opts) turns a
+target such as "1080p, prefer AV1/VP9 for the smallest size" or "audio-only m4a"
+into either a concrete format_id (when the info dict is at hand) or a yt_dlp
+format selector + format_sort that yt_dlp resolves itself in the same pass.
+"""
+
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+from retry import call_with_retry
+from startup import lazy_module, register_warmup
+
+# imported on first extraction; warming up also builds the extractor list
+yt_dlp = lazy_module("yt_dlp")
+register_warmup("yt_dlp", lambda: yt_dlp.extractor.gen_extractor_classes())
+
+EXTRACT_OPTS = {
+    "quiet": True,
+    "no_warnings": True,
+    "nocheckcertificate": True,
+    "user_agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)",
+    "http_headers": {
+        "User-Agent": "Mozilla/5.0",
+        "Accept-Language": "en-US,en;q=0.9",
+    },
+    # retries are classified by retry.call_with_retry instead of repeated blindly
+    "extractor_retries": 0,
+    "socket_timeout": 30,
+}
+
+
+# -------------------------
+# Info cache (warm metadata for a following download)
+# -------------------------
+class InfoCache:
+    """
+    Small thread-safe LRU of extracted info dicts keyed by URL.
+    Entries expire after `ttl` seconds because stream URLs inside the info
+    dict are signed and go stale (YouTube links live a few hours).
+    """
+
+    def __init__(self, max_entries: int = 256, ttl: float = 600.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._items: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, url: str, info: Dict[str, Any]):
+        with self._lock:
+            self._items[url] = (time.monotonic(), info)
+            self._items.move_to_end(url)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+    def get(self, url: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            item = self._items.get(url)
+            if not item:
+                return None
+            stored_at, info = item
+            if time.monotonic() - stored_at > self.ttl:
+                del self._items[url]
+                return None
+            self._items.move_to_end(url)
+            return info
+
+    def pop(self, url: str) -> Optional[Dict[str, Any]]:
+        info = self.get(url)
+        with self._lock:
+            self._items.pop(url, None)
+        return info
+
+
+info_cache = InfoCache()
+
+
+# -------------------------
+# Extraction + summary
+# -------------------------
+def extract_info(url: str, warm: bool = False) -> Dict[str, Any]:
+    """
+    Run yt_dlp extraction for `url`. With warm=True the sanitized info is cached for download.
+    Raises retry.CircuitOpen instead of waiting when the site is paused for rate limiting.
+    """
+    with yt_dlp.YoutubeDL(EXTRACT_OPTS) as ydl:
+        info = call_with_retry(lambda: ydl.extract_info(url, download=False), url, block=False)
+        if warm:
+            info_cache.put(url, ydl.sanitize_info(info))
+        return info
+
+
+def get_quality_label(height):
+    if not height:
+        return "Auto"
+    if height >= 4320:
+        return "8K"
+    if height >= 2160:
+        return "4K"
+    if height >= 1440:
+        return "2K"
+    if height >= 1080:
+        return "1080p"
+    if height >= 720:
+        return "720p"
+    if height >= 480:
+        return "480p"
+    if height >= 360:
+        return "360p"
+    if height >= 240:
+        return "240p"
+    if height >= 144:
+        return "144p"
+    return f"{height}p"
+
+
+def summarize_formats(info: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Build the /formats response body from a yt_dlp info dict:
+    {
+      title, thumbnail, duration,
+      video_formats: [{format_id, quality, resolution, ext, filesize, height}, ...],
+      audio_formats: [{format_id, quality, ext, filesize, abr}, ...]
+    }
+    """
+    formats = info.get("formats", [])
+    title = info.get("title", "Unknown")
+    thumbnail = info.get("thumbnail", "")
+    duration = info.get("duration", 0)
+
+    combined_formats = {}
+    video_only_formats = {}
+
+    for f in formats:
+        format_id = f.get("format_id")
+        ext = f.get("ext", "mp4")
+        height = f.get("height")
+        vcodec = f.get("vcodec", "none")
+        acodec = f.get("acodec", "none")
+        filesize = f.get("filesize") or f.get("filesize_approx") or 0
+
+        if not height or height == 0:
+            continue
+
+        label = get_quality_label(height)
+
+        if vcodec != "none" and acodec != "none":
+            if label not in combined_formats:
+                combined_formats[label] = {
+                    "format_id": format_id,
+                    "quality": label,
+                    "resolution": f"{height}p",
+                    "ext": ext,
+                    "filesize": filesize,
+                    "height": height,
+                }
+        elif vcodec != "none" and acodec == "none":
+            if label not in video_only_formats:
+                # prefer MP4 container for muxing
+                video_only_formats[label] = {
+                    "format_id": f"{format_id}+bestaudio",
+                    "quality": label,
+                    "resolution": f"{height}p",
+                    "ext": "mp4",
+                    "filesize": filesize,
+                    "height": height,
+                }
+
+    all_video_formats = {}
+    all_video_formats.update(video_only_formats)
+    for q, fmt in combined_formats.items():
+        if q not in all_video_formats:
+            all_video_formats[q] = fmt
+
+    video_formats = sorted(all_video_formats.values(), key=lambda x: x.get("height", 0), reverse=True)
+
+    # audio formats (pick best)
+    audio_formats = []
+    best_audio = None
+    for f in formats:
+        format_id = f.get("format_id")
+        ext = (f.get("ext") or "").lower()
+        vcodec = f.get("vcodec", "none")
+        acodec = f.get("acodec", "none")
+        abr = f.get("abr") or 0
+        filesize = f.get("filesize") or f.get("filesize_approx") or 0
+        if acodec != "none" and vcodec == "none":
+            if not best_audio or abr > best_audio.get("abr", 0):
+                best_audio = {
+                    "format_id": format_id,
+                    "quality": "Best Quality",
+                    "ext": ext if ext in ["webm", "opus", "m4a"] else "webm",
+                    "filesize": filesize,
+                    "abr": abr,
+                }
+    if best_audio:
+        audio_formats.append(best_audio)
+    else:
+        audio_formats = [{"format_id": "bestaudio", "quality": "Best Quality", "ext": "webm", "filesize": 0}]
+
+    if not video_formats:
+        video_formats = [{"format_id": "bestvideo+bestaudio/best", "quality": "Best Available", "resolution": "Auto", "ext": "mp4", "filesize": 0}]
+
+    return {
+        "title": title,
+        "thumbnail": thumbnail,
+        "duration": duration,
+        "video_formats": video_formats,
+        "audio_formats": audio_formats,
+    }
+
+
+# -------------------------
+# Format selection engine
+# -------------------------
+QUALITY_HEIGHTS = {"8k": 4320, "4k": 2160, "2k": 1440}
+VCODEC_ALIASES = {
+    "av1": "av01", "av01": "av01",
+    "vp9": "vp9", "vp09": "vp9",
+    "h265": "hevc", "hevc": "hevc", "hvc1": "hevc",
+    "h264": "avc1", "avc": "avc1", "avc1": "avc1",
+}
+# vcodec prefixes yt-dlp reports for each canonical codec (HEVC shows up as hvc1.* / hev1.*)
+VCODEC_PREFIXES = {
+    "av01": ("av01",),
+    "vp9": ("vp9", "vp09"),
+    "hevc": ("hevc", "hvc1", "hev1", "h265"),
+    "avc1": ("avc1", "h264"),
+}
+# a target that names no codec prefers these, smallest first
+EFFICIENT_VCODECS = ["av01", "vp9"]
+AUDIO_EXTS = {"m4a", "mp3", "opus", "ogg", "aac", "flac", "wav"}
+SMALL_WORDS = {"smallest", "small", "size", "compact"}
+
+
+def parse_target(target) -> Optional[Dict[str, Any]]:
+    """
+    Parse a quality target into a dict:
+      {height, vcodecs: [...], audio_only, audio_ext, smallest}
+    Accepts a dict with those keys or a free-form string ("1080p av1 smallest",
+    "4K", "audio-only m4a"). An audio ext with no height or codec ("m4a") is
+    audio-only. Returns None when the string holds no target words, which means
+    it is a raw yt_dlp selector / format_id ("best", "137+140").
+    """
+    if isinstance(target, dict):
+        height = target.get("height")
+        if isinstance(height, str):
+            height = _parse_height(height.lower()) or (int(height) if height.isdigit() else None)
+        vcodecs = target.get("vcodecs") or target.get("vcodec") or []
+        if isinstance(vcodecs, str):
+            vcodecs = [vcodecs]
+        return _audio_by_ext({
+            "height": int(height) if height else None,
+            "vcodecs": [VCODEC_ALIASES.get(c.lower(), c.lower()) for c in vcodecs],
+            "audio_only": bool(target.get("audio_only")),
+            "audio_ext": target.get("audio_ext"),
+            "smallest": bool(target.get("smallest")),
+        })
+
+    if not target or not isinstance(target, str):
+        return None
+    text = target.lower()
+    if "[" in text or "+" in text:
+        return None
+
+    parsed = {"height": None, "vcodecs": [], "audio_only": False, "audio_ext": None, "smallest": False}
+    recognised = False
+    for token in re.split(r"[^a-z0-9]+", text):
+        if not token:
+            continue
+        height = _parse_height(token)
+        if height:
+            parsed["height"] = height
+        elif token in VCODEC_ALIASES:
+            codec = VCODEC_ALIASES[token]
+            if codec not in parsed["vcodecs"]:
+                parsed["vcodecs"].append(codec)
+        elif token in ("audio", "audioonly"):
+            parsed["audio_only"] = True
+        elif token in AUDIO_EXTS:
+            parsed["audio_ext"] = token
+        elif token in SMALL_WORDS:
+            parsed["smallest"] = True
+        else:
+            continue
+        recognised = True
+    return _audio_by_ext(parsed) if recognised else None
+
+
+def _audio_by_ext(parsed: Dict[str, Any]) -> Dict[str, Any]:
+    if parsed["audio_ext"] and not parsed["height"] and not parsed["vcodecs"]:
+        parsed["audio_only"] = True
+    return parsed
+
+
+def _video_preference(parsed: Dict[str, Any]):
+    """(codecs to prefer, rank by size): the named codecs, or the efficient ones by size."""
+    if parsed["vcodecs"]:
+        return parsed["vcodecs"], parsed["smallest"]
+    return EFFICIENT_VCODECS, True
+
+
+def _parse_height(token: str) -> Optional[int]:
+    if token in QUALITY_HEIGHTS:
+        return QUALITY_HEIGHTS[token]
+    # bare numbers are yt_dlp format ids ("137"), heights need the "p" suffix
+    m = re.fullmatch(r"(\d{3,4})p", token)
+    if m:
+        height = int(m.group(1))
+        return height if 100 <= height <= 4320 else None
+    return None
+
+
+def _estimated_size(f: Dict[str, Any], duration) -> float:
+    size = f.get("filesize") or f.get("filesize_approx")
+    if size:
+        return size
+    if f.get("tbr") and duration:
+        return f["tbr"] * 1000 / 8 * duration
+    # unknown size: rank after everything we can measure
+    return float("inf")
+
+
+def _codec_matches(vcodec: str, wanted) -> bool:
+    vcodec = (vcodec or "").lower()
+    return any(vcodec.startswith(VCODEC_PREFIXES.get(c, (c,))) for c in wanted)
+
+
+def select_format(info: Dict[str, Any], target, mode: str = "video") -> Optional[Dict[str, Any]]:
+    """
+    Pick a concrete format from an extracted info dict, the same one build_format_opts()
+    makes yt_dlp pick.
+    Video: formats not above target height in the preferred codecs (the named ones, else
+    AV1/VP9) if there are any; the highest resolution of those, then the smallest bytes
+    when ranking by size (no codec named, or `smallest`), the largest bitrate otherwise.
+    Audio: preferred ext first, then smallest or highest abr.
+    Returns an entry shaped like summarize_formats() items, or None if nothing matches.
+    """
+    parsed = parse_target(target) or {"height": None, "vcodecs": [], "audio_only": False,
+                                      "audio_ext": None, "smallest": False}
+    formats = info.get("formats") or []
+    duration = info.get("duration") or 0
+
+    if mode == "audio" or parsed["audio_only"]:
+        audios = [f for f in formats if f.get("acodec", "none") != "none" and f.get("vcodec", "none") == "none"]
+        if not audios:
+            return None
+        if parsed["audio_ext"]:
+            preferred = [f for f in audios if (f.get("ext") or "").lower() == parsed["audio_ext"]]
+            audios = preferred or audios
+        if parsed["smallest"]:
+            best = min(audios, key=lambda f: _estimated_size(f, duration))
+        else:
+            best = max(audios, key=lambda f: f.get("abr") or 0)
+        return {
+            "format_id": best.get("format_id"),
+            "quality": "Smallest" if parsed["smallest"] else "Best Quality",
+            "ext": (best.get("ext") or "").lower(),
+            "filesize": best.get("filesize") or best.get("filesize_approx") or 0,
+            "abr": best.get("abr") or 0,
+        }
+
+    videos = [f for f in formats if f.get("vcodec", "none") != "none" and f.get("height")]
+    if parsed["height"]:
+        fitting = [f for f in videos if f["height"] <= parsed["height"]]
+        videos = fitting or sorted(videos, key=lambda f: f["height"])[:1]
+    if not videos:
+        return None
+    vcodecs, by_size = _video_preference(parsed)
+    preferred = [f for f in videos if _codec_matches(f.get("vcodec"), vcodecs)]
+    videos = preferred or videos
+    top = max(f["height"] for f in videos)
+    videos = [f for f in videos if f["height"] == top]
+    if by_size:
+        best = min(videos, key=lambda f: _estimated_size(f, duration))
+    else:
+        best = max(videos, key=lambda f: f.get("tbr") or 0)
+
+    video_only = best.get("acodec", "none") == "none"
+    return {
+        "format_id": f"{best.get('format_id')}+bestaudio" if video_only else best.get("format_id"),
+        "quality": get_quality_label(top),
+        "resolution": f"{top}p",
+        "ext": "mp4" if video_only else best.get("ext", "mp4"),
+        "filesize": best.get("filesize") or best.get("filesize_approx") or 0,
+        "height": top,
+        "vcodec": best.get("vcodec"),
+    }
+
+
+def build_format_opts(target, mode: str = "video") -> Dict[str, Any]:
+    """
+    Turn a target into yt_dlp options ({"format": ..., "format_sort": [...]}) so yt_dlp
+    resolves it during the download's own extraction (no separate /formats round trip).
+    Raw selectors are passed through unchanged.
+    """
+    parsed = parse_target(target)
+    if parsed is None:
+        if mode == "audio":
+            return {"format": "bestaudio/best"}
+        return {"format": target or "best"}
+
+    sort = []
+    if mode == "audio" or parsed["audio_only"]:
+        ext = parsed["audio_ext"]
+        fmt = f"ba[ext={ext}]/ba/b" if ext else "ba/b"
+        # same ranking as select_format(): smallest, else highest abr
+        sort += ["+size", "+br"] if parsed["smallest"] else ["abr"]
+        return {"format": fmt, "format_sort": sort}
+
+    height = parsed["height"]
+    hf = f"[height<={height}]" if height else ""
+    vcodecs, by_size = _video_preference(parsed)
+    codec_re = "|".join(p for c in vcodecs for p in VCODEC_PREFIXES.get(c, (c,)))
+    alternatives = [f"bv*{hf}[vcodec~='^({codec_re})']+ba", f"bv*{hf}+ba", f"b{hf}", "bv*+ba", "b"]
+    sort.append(f"res:{height}" if height else "res")
+    # same ranking as select_format(): smallest bytes, else highest total bitrate
+    sort += ["+size", "+br"] if by_size else ["tbr"]
+    return {"format": "/".join(dict.fromkeys(alternatives)), "format_sort": sort}
+
+
+def resolve_format_opts(target, mode: str = "video", info: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Resolve a target for a download: a concrete format_id when `info` is available
+    (warm cache), otherwise a selector for yt_dlp to resolve itself.
+    """
+    if info and parse_target(target) is not None:
+        selected = select_format(info, target, mode)
+        if selected:
+            return {"format": selected["format_id"]}
+    return build_format_opts(target, mode)
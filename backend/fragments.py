@@ -0,0 +1,202 @@
+# backend/fragments.py
+"""
+Fragment concurrency for HLS/DASH downloads.
+
+yt_dlp fetches fragments one at a time unless `concurrent_fragment_downloads` is
+set. The concurrency for a job is, in order: the job's own setting, the global
+setting, or (when either is "auto") the per-host tuner's current suggestion.
+
+The tuner is AIMD per host: every fragment that completes without throttling and
+within 1.5x the host's best observed latency adds 1/concurrency (about +1 per
+round of fragments); a 429/503 or "throttled" warning halves it, and latency
+climbing past 2.5x the baseline backs off gently. yt_dlp reads the setting when
+a format starts downloading, so new jobs (and the next format of a merge job)
+pick up the tuned value.
+
+    FRAGMENT_CONCURRENCY=auto | <n>     global default (auto)
+    FRAGMENT_MAX_CONCURRENCY=16
+    FRAGMENT_HTTP_CHUNK_SIZE=10M        range size for non-fragmented https downloads
+    FRAGMENT_BUFFER_SIZE=1M
+"""
+
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional, Union
+from urllib.parse import urlparse
+
+from bandwidth import parse_rate
+
+MIN_CONCURRENCY = 1
+START_CONCURRENCY = 4
+LATENCY_GOOD = 1.5
+LATENCY_BAD = 2.5
+# keep this many recent fragment durations per job for the metrics
+FRAGMENT_SAMPLES = 256
+
+THROTTLE_PATTERN = re.compile(r"HTTP Error (429|503)|Too Many Requests|throttl", re.I)
+
+
+def _parse_concurrency(value) -> Union[int, str]:
+    if value in (None, "", "auto"):
+        return "auto"
+    n = int(value)
+    if n < 1:
+        raise ValueError(f"invalid fragment concurrency: {value!r}")
+    return n
+
+
+class _HostState:
+    def __init__(self, start: float):
+        self.concurrency = start
+        self.baseline: Optional[float] = None
+        self.latency: Optional[float] = None
+        self.fragments = 0
+        self.throttled = 0
+        self.last_throttle = 0.0
+
+
+class FragmentTuner:
+    def __init__(self, concurrency: Union[int, str] = "auto", max_concurrency: int = 16,
+                 http_chunk_size: int = 10 * 1024 * 1024, buffer_size: int = 1024 * 1024):
+        self.concurrency = concurrency
+        self.max_concurrency = max_concurrency
+        self.http_chunk_size = http_chunk_size
+        self.buffer_size = buffer_size
+        self._hosts: Dict[str, _HostState] = {}
+        self._lock = threading.Lock()
+
+    def configure(self, concurrency=None, max_concurrency=None, http_chunk_size=None, buffer_size=None):
+        with self._lock:
+            if concurrency is not None:
+                self.concurrency = _parse_concurrency(concurrency)
+            if max_concurrency is not None:
+                self.max_concurrency = max(MIN_CONCURRENCY, int(max_concurrency))
+            if http_chunk_size is not None:
+                self.http_chunk_size = parse_rate(http_chunk_size)
+            if buffer_size is not None:
+                self.buffer_size = parse_rate(buffer_size)
+
+    def _host(self, host: str) -> _HostState:
+        state = self._hosts.get(host)
+        if state is None:
+            state = self._hosts[host] = _HostState(min(START_CONCURRENCY, self.max_concurrency))
+        return state
+
+    def suggest(self, host: str) -> int:
+        with self._lock:
+            return max(MIN_CONCURRENCY, int(self._host(host).concurrency))
+
+    def ydl_opts(self, url: str, concurrency=None) -> Dict[str, Any]:
+        """yt_dlp options for a job on `url`; `concurrency` is the job's own setting (int or "auto")."""
+        setting = _parse_concurrency(concurrency) if concurrency is not None else self.concurrency
+        n = self.suggest(host_of(url)) if setting == "auto" else setting
+        opts = {"concurrent_fragment_downloads": n, "buffersize": self.buffer_size}
+        if self.http_chunk_size:
+            opts["http_chunk_size"] = self.http_chunk_size
+        return opts
+
+    def observe(self, host: str, latency: Optional[float] = None, throttled: bool = False):
+        """Feed one fragment outcome (seconds it took, or a throttling response) into the host's AIMD."""
+        with self._lock:
+            state = self._host(host)
+            if throttled:
+                state.throttled += 1
+                now = time.monotonic()
+                # one halving per burst of 429s, not one per retried fragment
+                if now - state.last_throttle > 2.0:
+                    state.concurrency = max(MIN_CONCURRENCY, state.concurrency / 2)
+                    state.last_throttle = now
+                return
+            if latency is None or latency <= 0:
+                return
+            state.fragments += 1
+            state.latency = latency if state.latency is None else 0.8 * state.latency + 0.2 * latency
+            state.baseline = latency if state.baseline is None else min(state.baseline * 1.01, latency)
+            if state.latency <= state.baseline * LATENCY_GOOD:
+                state.concurrency = min(self.max_concurrency, state.concurrency + 1 / state.concurrency)
+            elif state.latency > state.baseline * LATENCY_BAD:
+                state.concurrency = max(MIN_CONCURRENCY, state.concurrency - 0.5 / state.concurrency)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            hosts = {host: {"concurrency": round(s.concurrency, 2),
+                            "latency_ms": int(s.latency * 1000) if s.latency else None,
+                            "baseline_ms": int(s.baseline * 1000) if s.baseline else None,
+                            "fragments": s.fragments, "throttled": s.throttled}
+                     for host, s in self._hosts.items()}
+        return {"concurrency": self.concurrency, "max_concurrency": self.max_concurrency,
+                "http_chunk_size": self.http_chunk_size, "buffer_size": self.buffer_size, "hosts": hosts}
+
+
+def host_of(url: str) -> str:
+    return (urlparse(url).hostname or "").lower()
+
+
+class FragmentMonitor:
+    """
+    Per-job yt_dlp progress hook and logger. Times fragments from the progress hook
+    (the interval between fragment completions times the concurrency in flight),
+    spots throttling in yt_dlp's retry warnings and feeds both to the tuner.
+    """
+
+    def __init__(self, url: str, concurrency: int, tuner: "FragmentTuner" = None):
+        self.host = host_of(url)
+        self.concurrency = concurrency
+        self.tuner = tuner or fragment_tuner
+        self.durations: List[float] = []
+        self.throttled = 0
+        self._last_index: Optional[int] = None
+        self._last_time: Optional[float] = None
+        self.fragment_count = None
+
+    # --- progress hook ---
+    def hook(self, d: dict):
+        index = d.get("fragment_index")
+        if d.get("status") != "downloading" or index is None:
+            return
+        self.fragment_count = d.get("fragment_count")
+        now = time.monotonic()
+        if self._last_index is not None and index > self._last_index:
+            per_fragment = (now - self._last_time) / (index - self._last_index)
+            latency = per_fragment * self.concurrency
+            self.durations.append(latency)
+            del self.durations[:-FRAGMENT_SAMPLES]
+            self.tuner.observe(self.host, latency)
+        if self._last_index is None or index != self._last_index:
+            self._last_index, self._last_time = index, now
+
+    def metrics(self) -> Optional[dict]:
+        if self._last_index is None:
+            return None
+        samples = sorted(self.durations)
+        metrics = {"index": self._last_index, "count": self.fragment_count,
+                   "concurrency": self.concurrency, "throttled": self.throttled}
+        if samples:
+            metrics["avg_ms"] = int(sum(samples) / len(samples) * 1000)
+            metrics["p95_ms"] = int(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000)
+        return metrics
+
+    # --- logger (yt_dlp reports fragment retries as warnings) ---
+    def debug(self, msg):
+        pass
+
+    def info(self, msg):
+        pass
+
+    def warning(self, msg):
+        if THROTTLE_PATTERN.search(str(msg)):
+            self.throttled += 1
+            self.tuner.observe(self.host, throttled=True)
+
+    def error(self, msg):
+        self.warning(msg)
+
+
+fragment_tuner = FragmentTuner(
+    concurrency=_parse_concurrency(os.environ.get("FRAGMENT_CONCURRENCY", "auto")),
+    max_concurrency=int(os.environ.get("FRAGMENT_MAX_CONCURRENCY", "16")),
+    http_chunk_size=parse_rate(os.environ.get("FRAGMENT_HTTP_CHUNK_SIZE", "10M")),
+    buffer_size=parse_rate(os.environ.get("FRAGMENT_BUFFER_SIZE", "1M")),
+)
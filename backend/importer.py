@@ -0,0 +1,558 @@
+# backend/importer.py
+"""
+Bulk URL import: a streamed text or NDJSON upload turned into queued downloads.
+
+POST /import reads the request body line by line (never the whole file):
+
+    https://youtu.be/abc123 mode=audio audio_format=m4a      text: URL, then key=value options
+    {"url": "https://example.com/v/1", "target": "720p"}      NDJSON: one object per line
+    # comments and blank lines are skipped
+
+Every URL is normalized (scheme / host case, default ports, fragments, tracking
+parameters, YouTube short / embed / shorts forms) into a key and deduped against
+the rest of the file, completed history entries, running jobs and items still
+queued by earlier imports (`force=true` on a line skips all but the in-file
+check). Accepted lines are written as `import_items` rows (models.ImportItem),
+IMPORT_BATCH_SIZE per transaction; the upload is read no faster than the rows
+are written.
+
+The dispatcher, an asyncio task started in the app lifespan, keeps up to
+IMPORT_CONCURRENCY imported jobs running and records how each ended, so a
+20k-line import does not start 20k downloads at once. Items still running when
+the server stops are queued again on the next start.
+
+    IMPORT_BATCH_SIZE=500        rows per insert transaction
+    IMPORT_CONCURRENCY=4         imported downloads running at once
+    IMPORT_MAX_LINE=8192         longer lines are rejected (bytes)
+    IMPORT_POLL_SECONDS=1
+"""
+
+import asyncio
+import datetime
+import hashlib
+import json
+import os
+import time
+import uuid
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from sqlalchemy import func
+
+from db import SessionLocal
+from jobs import job_states
+from models import History, ImportBatch, ImportItem
+
+IMPORT_BATCH_SIZE = int(os.environ.get("IMPORT_BATCH_SIZE", "500"))
+IMPORT_CONCURRENCY = int(os.environ.get("IMPORT_CONCURRENCY", "4"))
+IMPORT_MAX_LINE = int(os.environ.get("IMPORT_MAX_LINE", "8192"))
+IMPORT_POLL_SECONDS = float(os.environ.get("IMPORT_POLL_SECONDS", "1"))
+# skipped lines kept (with line number and reason) for the summary
+REJECTED_SAMPLE = 50
+
+ACTIVE_ITEM_STATUSES = ("queued", "running")
+# how a finished job is recorded on its item (anything else counts as completed, like history)
+ITEM_STATUS = {"error": "error", "cancelled": "cancelled", "paused": "paused"}
+
+TRACKING_PARAMS = {"fbclid", "gclid", "dclid", "msclkid", "igshid", "si", "feature", "ref", "ref_src", "pp"}
+YOUTUBE_HOSTS = {"youtube.com", "m.youtube.com", "music.youtube.com", "youtube-nocookie.com"}
+
+
+# --- URL normalization ---
+def normalize_url(url: str) -> str:
+    """Canonical form of a download URL, for dedupe only (jobs still get the URL as given)."""
+    parts = urlsplit(url.strip())
+    if parts.scheme.lower() not in ("http", "https") or not parts.hostname:
+        raise ValueError("not an http(s) URL")
+    host = parts.hostname.lower().rstrip(".")
+    if host.startswith("www."):
+        host = host[4:]
+    try:
+        port = parts.port
+    except ValueError:
+        raise ValueError("invalid port")
+    netloc = host if port in (None, 80, 443) else f"{host}:{port}"
+    path = parts.path or "/"
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+             if k not in TRACKING_PARAMS and not k.startswith("utm_")]
+
+    video_id = None
+    if host == "youtu.be":
+        video_id = path.strip("/").split("/")[0]
+    elif host in YOUTUBE_HOSTS:
+        segments = path.strip("/").split("/")
+        if segments[0] == "watch":
+            video_id = dict(query).get("v")
+        elif segments[0] in ("shorts", "embed", "live", "v") and len(segments) > 1:
+            video_id = segments[1]
+    if video_id:
+        return f"https://youtube.com/watch?v={video_id}"
+
+    if len(path) > 1:
+        path = path.rstrip("/")
+    return urlunsplit(("https", netloc, path, urlencode(sorted(query)), ""))
+
+
+def url_key(url: str) -> str:
+    return hashlib.blake2b(normalize_url(url).encode(), digest_size=16).hexdigest()
+
+
+# --- line parsing ---
+def _bool(value) -> bool:
+    if isinstance(value, bool):
+        return value
+    text = str(value).lower()
+    if text in ("1", "true", "yes", "on"):
+        return True
+    if text in ("0", "false", "no", "off"):
+        return False
+    raise ValueError(f"not a boolean: {value!r}")
+
+
+def _mode(value) -> str:
+    if value not in ("video", "audio"):
+        raise ValueError(f"mode must be video or audio, got {value!r}")
+    return value
+
+
+def _weight(value) -> float:
+    weight = float(value)
+    if weight <= 0:
+        raise ValueError("weight must be > 0")
+    return weight
+
+
+def _fragments(value):
+    return "auto" if value == "auto" else int(value)
+
+
+def _checksum(value):
+    try:
+        return _bool(value)
+    except ValueError:
+        return str(value)
+
+
+# option -> converter (options of POST /download, plus `force`)
+OPTIONS: Dict[str, Callable] = {
+    "id": str, "mode": _mode, "format_id": str, "target": str, "quality": str, "audio_format": str,
+    "parallel_transcode": _bool, "weight": _weight, "fragment_concurrency": _fragments,
+    "checksum": _checksum, "force": _bool,
+}
+
+
+def parse_options(raw: Dict) -> Dict:
+    options = {}
+    for key, value in raw.items():
+        if key not in OPTIONS:
+            raise ValueError(f"unknown option {key!r}")
+        try:
+            options[key] = OPTIONS[key](value)
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"{key}: {e}")
+    if "quality" in options:
+        options.setdefault("target", options.pop("quality"))
+    return options
+
+
+def parse_line(text: str, ndjson: bool = False) -> Tuple[str, Dict]:
+    """(url, options) of one non-blank line; ValueError says why the line is rejected."""
+    if text.startswith("{"):
+        try:
+            obj = json.loads(text)
+        except ValueError:
+            raise ValueError("invalid JSON")
+        if not isinstance(obj, dict) or not isinstance(obj.get("url"), str):
+            raise ValueError("url required")
+        url = obj.pop("url")
+        raw = obj
+    elif ndjson:
+        raise ValueError("not a JSON object")
+    else:
+        url, *tokens = text.split()
+        raw = {}
+        for token in tokens:
+            key, sep, value = token.partition("=")
+            if not sep:
+                raise ValueError(f"expected key=value, got {token!r}")
+            raw[key] = value
+    return url.strip(), parse_options(raw)
+
+
+async def iter_lines(chunks: AsyncIterator[bytes], max_line: int = IMPORT_MAX_LINE):
+    """(line number, bytes) of a streamed body; None instead of the bytes for lines over `max_line`."""
+    buf = bytearray()
+    number = 0
+    skipping = False
+    async for chunk in chunks:
+        buf += chunk
+        start = 0
+        while True:
+            end = buf.find(b"\n", start)
+            if end < 0:
+                break
+            number += 1
+            line = bytes(buf[start:end])
+            yield number, None if skipping or len(line) > max_line else line
+            skipping = False
+            start = end + 1
+        del buf[:start]
+        if len(buf) > max_line:
+            # the rest of this line is dropped as it arrives
+            skipping = True
+            buf.clear()
+    if skipping or buf:
+        yield number + 1, None if skipping or len(buf) > max_line else bytes(buf)
+
+
+def _now():
+    return datetime.datetime.utcnow()
+
+
+class Importer:
+    def __init__(self):
+        self._launch: Optional[Callable[[str, str, dict], None]] = None
+        self._status_of: Optional[Callable[[str], Optional[str]]] = None
+        self._running: Dict[int, str] = {}  # item id -> job id
+        self._failed: Dict[int, str] = {}   # item id -> launch error
+        self._task: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+
+    # --- ingestion ---
+    async def ingest(self, chunks: AsyncIterator[bytes], defaults: Dict, ndjson: bool = False) -> dict:
+        """Read, dedupe and enqueue an upload; returns the summary (also stored on the imports row)."""
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        import_id = uuid.uuid4().hex[:12]
+        await loop.run_in_executor(None, self._create, import_id, defaults)
+        history = await loop.run_in_executor(None, self._history_keys)
+        active = set()
+        for job in job_states.query(active=True, limit=1_000_000):
+            try:
+                active.add(url_key(job["url"]))
+            except ValueError:
+                pass
+
+        seen = set()
+        summary = {"id": import_id, "status": "queued", "lines": 0, "accepted": 0, "duplicates": 0,
+                   "duplicate_reasons": {"file": 0, "history": 0, "active": 0}, "invalid": 0, "rejected": []}
+
+        def reject(number: int, reason: str, duplicate: Optional[str] = None):
+            if duplicate:
+                summary["duplicates"] += 1
+                summary["duplicate_reasons"][duplicate] += 1
+            else:
+                summary["invalid"] += 1
+            if len(summary["rejected"]) < REJECTED_SAMPLE:
+                summary["rejected"].append({"line": number, "reason": reason})
+
+        async def flush(rows: List[dict]):
+            skipped = await loop.run_in_executor(None, self._insert, rows)
+            for row in skipped:
+                reject(row["line"], "already queued", duplicate="active")
+            summary["accepted"] += len(rows) - len(skipped)
+
+        pending: List[dict] = []
+        try:
+            async for number, raw in iter_lines(chunks):
+                if raw is None:
+                    summary["lines"] += 1
+                    reject(number, "line too long")
+                    continue
+                text = raw.decode("utf-8", "replace").lstrip("\ufeff").strip()
+                if not text or text.startswith("#"):
+                    continue
+                summary["lines"] += 1
+                try:
+                    url, options = parse_line(text, ndjson)
+                    key = url_key(url)
+                except ValueError as e:
+                    reject(number, str(e))
+                    continue
+                if key in seen:
+                    reject(number, "duplicate in file", duplicate="file")
+                    continue
+                seen.add(key)
+                force = options.pop("force", False)
+                if not force and key in history:
+                    reject(number, "already downloaded", duplicate="history")
+                    continue
+                if not force and key in active:
+                    reject(number, "already running", duplicate="active")
+                    continue
+                pending.append({"import_id": import_id, "line": number, "url": url, "url_key": key,
+                                "options": json.dumps(options) if options else None, "force": force,
+                                "job_id": options.get("id") or f"import_{import_id}_{number}"})
+                if len(pending) >= IMPORT_BATCH_SIZE:
+                    await flush(pending)
+                    pending = []
+            if pending:
+                await flush(pending)
+        except Exception as e:
+            # rows already written stay queued; uploading the file again dedupes against them
+            print(f"[import] {import_id} interrupted: {e}")
+            summary["status"] = "interrupted"
+            summary["error"] = str(e)
+        if summary["status"] == "queued" and not summary["accepted"]:
+            summary["status"] = "done"
+        await loop.run_in_executor(None, self._finish_ingest, summary)
+        self.wake()
+        summary["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        return summary
+
+    def _create(self, import_id: str, defaults: Dict):
+        db = SessionLocal()
+        try:
+            db.add(ImportBatch(id=import_id, status="receiving", options=json.dumps(defaults) if defaults else None))
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _history_keys(self) -> set:
+        keys = set()
+        db = SessionLocal()
+        try:
+            for (url,) in db.query(History.url).filter(History.status == "completed").yield_per(2000):
+                try:
+                    keys.add(url_key(url))
+                except ValueError:
+                    pass
+            return keys
+        finally:
+            db.close()
+
+    def _insert(self, rows: List[dict]) -> List[dict]:
+        """Insert `rows` in one transaction, except URLs other imports still have queued; returns those."""
+        checked = [row["url_key"] for row in rows if not row["force"]]
+        db = SessionLocal()
+        try:
+            queued = set()
+            if checked:
+                queued = {key for (key,) in db.query(ImportItem.url_key)
+                          .filter(ImportItem.url_key.in_(checked), ImportItem.status.in_(ACTIVE_ITEM_STATUSES))}
+            skipped = [row for row in rows if not row["force"] and row["url_key"] in queued]
+            db.bulk_insert_mappings(ImportItem, [
+                {k: v for k, v in row.items() if k != "force"}
+                for row in rows if row["force"] or row["url_key"] not in queued
+            ])
+            db.commit()
+            return skipped
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _finish_ingest(self, summary: dict):
+        db = SessionLocal()
+        try:
+            batch = db.query(ImportBatch).filter(ImportBatch.id == summary["id"]).first()
+            batch.status = summary["status"]
+            batch.lines = summary["lines"]
+            batch.accepted = summary["accepted"]
+            batch.duplicates = summary["duplicates"]
+            batch.invalid = summary["invalid"]
+            batch.rejected = json.dumps(summary["rejected"]) if summary["rejected"] else None
+            if summary["status"] == "queued":
+                # the dispatcher may have run every item while the upload was still being read
+                remaining = (db.query(func.count(ImportItem.id))
+                             .filter(ImportItem.import_id == batch.id,
+                                     ImportItem.status.in_(ACTIVE_ITEM_STATUSES)).scalar())
+                if not remaining:
+                    batch.status = summary["status"] = "done"
+            if batch.status == "done":
+                batch.finished_at = _now()
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    # --- dispatcher ---
+    def start(self, launch: Callable[[str, str, dict], None], status_of: Callable[[str], Optional[str]]):
+        """
+        Run queued items on the current event loop. `launch(job_id, url, options)` starts a job
+        (raising if it cannot); `status_of(job_id)` is None while it runs, then its last status.
+        """
+        self._launch = launch
+        self._status_of = status_of
+        self._wake = asyncio.Event()
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def wake(self):
+        if self._wake is not None:
+            self._wake.set()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._requeue)
+        while True:
+            try:
+                await self._tick(loop)
+            except Exception as e:
+                print(f"[import] dispatcher: {e}")
+            try:
+                await asyncio.wait_for(self._wake.wait(), IMPORT_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    async def _tick(self, loop):
+        ended: Dict[int, Tuple[str, Optional[str]]] = {
+            item_id: ("error", error) for item_id, error in self._failed.items()}
+        self._failed.clear()
+        for item_id, job_id in list(self._running.items()):
+            status = self._status_of(job_id)
+            if status is not None:
+                ended[item_id] = (ITEM_STATUS.get(status, "completed"), None)
+                del self._running[item_id]
+        if ended:
+            await loop.run_in_executor(None, self._settle, ended)
+
+        free = IMPORT_CONCURRENCY - len(self._running)
+        if free <= 0:
+            return
+        for item_id, job_id, url, options in await loop.run_in_executor(None, self._claim, free):
+            try:
+                self._launch(job_id, url, options)
+                self._running[item_id] = job_id
+            except Exception as e:
+                self._failed[item_id] = str(e)
+                self.wake()
+
+    def _requeue(self):
+        """Items left running by a previous server process start over (yt-dlp resumes .part files)."""
+        db = SessionLocal()
+        try:
+            db.query(ImportItem).filter(ImportItem.status == "running").update(
+                {"status": "queued"}, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    def _claim(self, limit: int) -> List[Tuple[int, str, str, dict]]:
+        """Mark up to `limit` queued items running; (item id, job id, url, options with import defaults)."""
+        db = SessionLocal()
+        try:
+            ids = [item_id for (item_id,) in db.query(ImportItem.id).filter(ImportItem.status == "queued")
+                   .order_by(ImportItem.id).limit(limit)]
+            if not ids:
+                return []
+            # conditional, so an import cancelled meanwhile is not revived
+            db.query(ImportItem).filter(ImportItem.id.in_(ids), ImportItem.status == "queued").update(
+                {"status": "running"}, synchronize_session=False)
+            db.commit()
+            rows = (db.query(ImportItem, ImportBatch.options)
+                    .join(ImportBatch, ImportBatch.id == ImportItem.import_id)
+                    .filter(ImportItem.id.in_(ids), ImportItem.status == "running").all())
+            claimed = []
+            for item, defaults in rows:
+                options = json.loads(defaults) if defaults else {}
+                options.update(json.loads(item.options) if item.options else {})
+                claimed.append((item.id, item.job_id, item.url, options))
+            return claimed
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _settle(self, ended: Dict[int, Tuple[str, Optional[str]]]):
+        """Record how items ended, in one transaction, and close imports with nothing left to run."""
+        db = SessionLocal()
+        try:
+            now = _now()
+            for item in db.query(ImportItem).filter(ImportItem.id.in_(list(ended))):
+                item.status, item.error = ended[item.id]
+                item.finished_at = now
+            db.flush()
+            import_ids = {i for (i,) in db.query(ImportItem.import_id).filter(ImportItem.id.in_(list(ended)))}
+            for batch in db.query(ImportBatch).filter(ImportBatch.id.in_(import_ids), ImportBatch.status == "queued"):
+                remaining = (db.query(func.count(ImportItem.id))
+                             .filter(ImportItem.import_id == batch.id,
+                                     ImportItem.status.in_(ACTIVE_ITEM_STATUSES)).scalar())
+                if not remaining:
+                    batch.status = "done"
+                    batch.finished_at = now
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    # --- queries / control ---
+    def cancel(self, import_id: str) -> Optional[List[str]]:
+        """Cancel the import's queued items; returns the job ids still running (None = unknown import)."""
+        db = SessionLocal()
+        try:
+            batch = db.query(ImportBatch).filter(ImportBatch.id == import_id).first()
+            if batch is None:
+                return None
+            now = _now()
+            db.query(ImportItem).filter(ImportItem.import_id == import_id, ImportItem.status == "queued").update(
+                {"status": "cancelled", "finished_at": now}, synchronize_session=False)
+            running = [job_id for (job_id,) in db.query(ImportItem.job_id)
+                       .filter(ImportItem.import_id == import_id, ImportItem.status == "running")]
+            if batch.status in ("receiving", "queued", "interrupted"):
+                batch.status = "cancelled"
+                batch.finished_at = now
+            db.commit()
+            return running
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def progress(self, import_id: str) -> Optional[dict]:
+        db = SessionLocal()
+        try:
+            batch = db.query(ImportBatch).filter(ImportBatch.id == import_id).first()
+            if batch is None:
+                return None
+            counts = dict(db.query(ImportItem.status, func.count(ImportItem.id))
+                          .filter(ImportItem.import_id == import_id).group_by(ImportItem.status).all())
+            out = batch.to_dict()
+            out["options"] = json.loads(batch.options) if batch.options else {}
+            out["rejected"] = json.loads(batch.rejected) if batch.rejected else []
+            out["items"] = counts
+            settled = sum(n for status, n in counts.items() if status not in ACTIVE_ITEM_STATUSES)
+            out["progress"] = round(settled * 100 / batch.accepted, 2) if batch.accepted else 100.0
+            return out
+        finally:
+            db.close()
+
+    def recent(self, limit: int = 50) -> List[dict]:
+        db = SessionLocal()
+        try:
+            rows = db.query(ImportBatch).order_by(ImportBatch.created_at.desc()).limit(limit).all()
+            return [r.to_dict() for r in rows]
+        finally:
+            db.close()
+
+    def items(self, import_id: str, status: Optional[str] = None, limit: int = 200, offset: int = 0) -> List[dict]:
+        db = SessionLocal()
+        try:
+            rows = db.query(ImportItem).filter(ImportItem.import_id == import_id)
+            if status:
+                rows = rows.filter(ImportItem.status.in_(status.split(",")))
+            return [r.to_dict() for r in rows.order_by(ImportItem.id).offset(offset).limit(limit).all()]
+        finally:
+            db.close()
+
+
+importer = Importer()
@@ -0,0 +1,138 @@
+# backend/jobs.py
+"""
+In-memory state table of every yt_dlp and torrent job, keyed by the job's
+websocket channel id ("<client_id>", "playlist_<n>", "torrent_<id>").
+
+Each progress/state message a job emits is folded into a compact snapshot, so
+GET /jobs can answer bulk status queries without sockets. Every update bumps the
+job's version and the table version; ETags are built from those so unchanged
+polls are answered with 304 without building a response.
+"""
+
+import hashlib
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Iterable, List
+
+JOBS_KEEP_FINISHED = int(os.environ.get("JOBS_KEEP_FINISHED", "2000"))
+
+TERMINAL_STATUSES = {"finished", "error", "cancelled"}
+
+# versions start over with every process; mixed into ETags so one from before a restart never matches
+ETAG_NONCE = uuid.uuid4().hex
+
+# message fields copied into the snapshot as-is
+SNAPSHOT_FIELDS = (
+    "downloaded_bytes", "total_bytes", "speed", "eta", "error", "message",
+    "download_rate", "upload_rate", "num_peers", "num_seeds", "name", "total_size",
+    "fragments", "error_class", "attempt", "site_paused", "disk_wait",
+)
+
+
+class JobStateTable:
+    def __init__(self):
+        self._jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._versions: Dict[str, int] = {}
+        self._version = 0
+        self._lock = threading.Lock()
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def start(self, id: str, kind: str, url: str = "", mode: str = ""):
+        """Register a new job (replaces a previous job with the same id)."""
+        now = time.time()
+        with self._lock:
+            self._jobs.pop(id, None)
+            self._jobs[id] = {
+                "id": id, "kind": kind, "status": "queued", "url": url, "mode": mode,
+                "progress": 0.0, "started_at": now, "updated_at": now,
+            }
+            self._bump(id)
+
+    def update(self, id: str, message: dict):
+        """Fold a progress/state message into the job's snapshot (callable from any thread)."""
+        status = message.get("status")
+        if not status and message.get("event"):
+            # torrent toast events duplicate the finished status
+            return
+        with self._lock:
+            job = self._jobs.get(id)
+            if job is None:
+                return
+            if status:
+                job["status"] = status
+            for key in SNAPSHOT_FIELDS:
+                if key in message:
+                    job[key] = message[key]
+            if "progress" in message:
+                job["progress"] = message["progress"]
+            elif message.get("total_bytes"):
+                job["progress"] = round(message.get("downloaded_bytes", 0) * 100 / message["total_bytes"], 2)
+            if status == "finished":
+                job["progress"] = 100.0
+                result = message.get("result") or {}
+                job["final_path"] = result.get("final_path") or message.get("save_path")
+                checksum = result.get("checksum") or message.get("checksum")
+                if checksum:
+                    job["checksum"] = checksum
+            job["updated_at"] = time.time()
+            self._jobs.move_to_end(id)
+            self._bump(id)
+            if status in TERMINAL_STATUSES:
+                self._prune()
+
+    def _bump(self, id: str):
+        self._version += 1
+        self._versions[id] = self._version
+
+    def _prune(self):
+        finished = [jid for jid, job in self._jobs.items() if job["status"] in TERMINAL_STATUSES]
+        for jid in finished[:max(0, len(finished) - JOBS_KEEP_FINISHED)]:
+            del self._jobs[jid]
+            self._versions.pop(jid, None)
+
+    def get(self, id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._jobs.get(id)
+            return dict(job) if job else None
+
+    def etag(self, ids: Optional[Iterable[str]] = None, extra: str = "") -> str:
+        """Weak ETag for a query: per-job versions for id batches, the table version otherwise."""
+        with self._lock:
+            if ids is not None:
+                key = ",".join(f"{i}:{self._versions.get(i, 0)}" for i in ids)
+            else:
+                key = str(self._version)
+        digest = hashlib.blake2b(f"{ETAG_NONCE}|{key}|{extra}".encode(), digest_size=8).hexdigest()
+        return f'W/"{digest}"'
+
+    def query(self, ids: Optional[Iterable[str]] = None, kind: Optional[str] = None,
+              statuses: Optional[set] = None, active: Optional[bool] = None,
+              since: Optional[float] = None, limit: int = 1000) -> List[Dict[str, Any]]:
+        with self._lock:
+            if ids is not None:
+                candidates = [self._jobs[i] for i in ids if i in self._jobs]
+            else:
+                candidates = list(reversed(self._jobs.values()))
+            out = []
+            for job in candidates:
+                if kind and job["kind"] != kind:
+                    continue
+                if statuses and job["status"] not in statuses:
+                    continue
+                if active is not None and (job["status"] not in TERMINAL_STATUSES) != active:
+                    continue
+                if since is not None and job["updated_at"] <= since:
+                    continue
+                out.append(dict(job))
+                if len(out) >= limit:
+                    break
+            return out
+
+
+job_states = JobStateTable()
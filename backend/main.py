@@ -4,11 +4,14 @@ Main FastAPI backend for AI Video Downloader
 Updated to work with the new high-performance torrent_downloader.py API.
 
 Torrent downloader expected API (from torrent_downloader.py):
-    manager.add_torrent(torrent_id: str, magnet: str, callback: Callable)
-    manager.cancel_torrent(torrent_id: str)
+    manager.add_torrent(torrent_id: str, magnet: str, callback: Callable, weight: float = 1.0)
+    manager.cancel_torrent(torrent_id: str, delete_files: bool = False)
+    manager.pause_torrent(torrent_id: str) / manager.resume_torrent(torrent_id: str)
     manager.get_status(torrent_id: str)
 """
 
+import startup  # first: its import time is where the startup report starts counting
+
 import asyncio
 import json
 import os
@@ -16,21 +19,65 @@ import subprocess
 import platform
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from pathlib import Path
+from urllib.parse import quote
 from typing import Dict, Optional, Any, Callable
 
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from yt_dlp import YoutubeDL
+from fastapi.responses import JSONResponse, StreamingResponse, Response, FileResponse
 
 # Local modules (assumed present in your project)
 from downloader import run_download_in_thread, get_thumbnail_for_url
-from db import create_tables, add_history_entry, list_history, delete_history
+from postprocess import shutdown_postprocess_pool
+from formats import extract_info, summarize_formats, info_cache, select_format, resolve_format_opts
+from db import create_tables, add_history_entry, delete_history, history_cache, async_reader
 from torrent_downloader import get_torrent_manager
+from ws_manager import ws_manager, MuxClient
+from jobs import job_states
+from bandwidth import bandwidth_manager
+from fragments import fragment_tuner
+from retry import CircuitOpen, breakers
+from cancellation import JobControl
+from admission import admission
+from thumbnails import thumbnail_cache, youtube_thumbnail
+from catalog import catalog
+from checksum import resolve_algorithm as resolve_checksum
+from importer import importer, parse_options
+from profiling import PROFILE_MAX_SECONDS, TimingMiddleware, loop_lag, profiler, request_timings
+
+# yt_dlp and libtorrent are imported on first use (see startup.py)
+yt_dlp = startup.lazy_module("yt_dlp")
 
 # --- App setup ---
-app = FastAPI(title="AI Video Downloader Backend")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Startup work that used to run at import time, then the shutdown of every worker."""
+    with startup.phase("directories"):
+        DEFAULT_DL_DIR.mkdir(parents=True, exist_ok=True)
+        TORRENT_DL_DIR.mkdir(parents=True, exist_ok=True)
+    with startup.phase("create_tables"):
+        # Ensure DB tables exist
+        await asyncio.get_running_loop().run_in_executor(None, create_tables)
+    with startup.phase("catalog"):
+        catalog.start()
+    loop_lag.start()
+    importer.start(launch_import_item, import_job_status)
+    startup.ready()
+    startup.schedule_warmup(asyncio.get_running_loop())
+    yield
+    await importer.stop()
+    catalog.stop()
+    loop_lag.stop()
+    profiler.stop()
+    formats_pool.shutdown(wait=False, cancel_futures=True)
+    thumbnail_pool.shutdown(wait=False, cancel_futures=True)
+    shutdown_postprocess_pool()
+    await async_reader.close()
+
+app = FastAPI(title="AI Video Downloader Backend", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -39,58 +86,43 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(TimingMiddleware, timings=request_timings)
 
 # --- Default directories ---
+# (created in lifespan)
 DEFAULT_DL_DIR = Path.home() / "Downloads"
-DEFAULT_DL_DIR.mkdir(parents=True, exist_ok=True)
-
 TORRENT_DL_DIR = Path.home() / "Downloads" / "Torrents"
-TORRENT_DL_DIR.mkdir(parents=True, exist_ok=True)
 
-# Ensure DB tables exist
-create_tables()
+catalog.add_root("downloads", DEFAULT_DL_DIR, recursive=False)
+catalog.add_root("torrents", TORRENT_DL_DIR, recursive=True)
 
-# --- WebSocket manager (simple) ---
-class WSManager:
-    def __init__(self):
-        self.connections: Dict[str, WebSocket] = {}
-        self._lock = threading.Lock()
+# Suffixes the download watchers treat as finished media
+MEDIA_SUFFIXES = [".mp4", ".mkv", ".webm", ".m4a", ".mp3", ".opus", ".ogg", ".flac"]
 
-    def add_connection(self, id: str, websocket: WebSocket):
-        with self._lock:
-            self.connections[id] = websocket
+# GET /admin/profile?wait=true gives up after this long
+PROFILE_WAIT_TIMEOUT = PROFILE_MAX_SECONDS + 5
 
-    def remove_connection(self, id: str):
-        with self._lock:
-            if id in self.connections:
-                try:
-                    del self.connections[id]
-                except Exception:
-                    pass
-
-    async def send(self, id: str, message: dict):
-        # Send JSON message to connection if present
-        ws = None
-        with self._lock:
-            ws = self.connections.get(id)
-        if ws:
-            try:
-                await ws.send_json(message)
-            except Exception as e:
-                # swallow errors (client may have disconnected)
-                print(f"[ws send error] {e}")
-
-ws_manager = WSManager()
+# Bounded pool for metadata extraction (/formats, /formats/batch)
+FORMATS_WORKERS = int(os.environ.get("FORMATS_WORKERS", "8"))
+formats_pool = ThreadPoolExecutor(max_workers=FORMATS_WORKERS, thread_name_prefix="formats")
+# Thumbnail lookups/fetches get their own small pool so they never queue ahead of /formats
+THUMBNAIL_WORKERS = int(os.environ.get("THUMBNAIL_WORKERS", "4"))
+thumbnail_pool = ThreadPoolExecutor(max_workers=THUMBNAIL_WORKERS, thread_name_prefix="thumbs")
 
 # --- Job manager for non-torrent downloads (threads) ---
 class JobManager:
     def __init__(self):
         self._jobs: Dict[str, Dict[str, Any]] = {}
+        # paused jobs: id -> {"params": launch_download kwargs, "cancel_event": JobControl}
+        self._paused: Dict[str, Dict[str, Any]] = {}
         self._lock = threading.Lock()
 
-    def register(self, id: str, thread: threading.Thread, cancel_event: threading.Event):
+    def register(self, id: str, thread: threading.Thread, cancel_event: threading.Event,
+                 params: Optional[Dict[str, Any]] = None, done: Optional[threading.Event] = None):
+        """`done` is set once the job has fully ended (unregistered, or parked when paused)."""
         with self._lock:
-            self._jobs[id] = {"thread": thread, "cancel_event": cancel_event}
+            self._jobs[id] = {"thread": thread, "cancel_event": cancel_event, "params": params, "done": done}
+            self._paused.pop(id, None)
 
     def get_cancel_event(self, id: str) -> Optional[threading.Event]:
         with self._lock:
@@ -109,11 +141,30 @@ class JobManager:
         with self._lock:
             return id in self._jobs
 
+    def get_done_event(self, id: str) -> Optional[threading.Event]:
+        with self._lock:
+            item = self._jobs.get(id)
+            return item["done"] if item else None
+
+    def park(self, id: str, params: Dict[str, Any], cancel_event: threading.Event):
+        """Keep a paused job's launch parameters so /resume can restart it."""
+        with self._lock:
+            self._paused[id] = {"params": params, "cancel_event": cancel_event}
+
+    def unpark(self, id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._paused.pop(id, None)
+
 job_manager = JobManager()
 
 # -------------------------
 # Helper utilities
 # -------------------------
+def emit(channel: str, msg: dict, loop: asyncio.AbstractEventLoop):
+    """Record a job message in the state table and queue it for websocket subscribers."""
+    job_states.update(channel, msg)
+    ws_manager.publish_threadsafe(channel, msg, loop)
+
 def safe_hash_id(s: str) -> str:
     # short deterministic id for clients
     return str(abs(hash(s)))[:12]
@@ -129,11 +180,123 @@ def format_filesize(bytes_val: int) -> str:
     except Exception:
         return ""
 
+def find_latest_media() -> Optional[str]:
+    # best-effort: newest media file in the download dir
+    try:
+        entries = sorted(DEFAULT_DL_DIR.iterdir(), key=lambda p: p.stat().st_mtime, reverse=True)
+        for p in entries:
+            if p.is_file() and p.suffix.lower() in MEDIA_SUFFIXES:
+                return p.name
+    except Exception:
+        pass
+    return None
+
+def launch_download(client_id: str, url: str, mode: str, format_id: str, loop: asyncio.AbstractEventLoop,
+                    target=None, audio_format: str = "mp3", parallel_transcode: bool = False,
+                    weight: float = 1.0, fragment_concurrency=None, checksum=None) -> threading.Thread:
+    """
+    Start one yt_dlp job: reset its channel, register it in the state table and job
+    manager, and run a watcher that records history once the download thread ends.
+    `target` (quality target or raw selector) is resolved by the format selection engine.
+    `checksum` (True / "blake3" / "sha256", None = DOWNLOAD_CHECKSUM) hashes the file while it is written.
+    A paused job is parked with its parameters instead of being written to history.
+    """
+    params = {"url": url, "mode": mode, "format_id": format_id, "target": target,
+              "audio_format": audio_format, "parallel_transcode": parallel_transcode,
+              "weight": weight, "fragment_concurrency": fragment_concurrency, "checksum": checksum}
+    cancel_event = JobControl()
+    ws_manager.reset_channel(client_id)
+    job_states.start(client_id, "ytdlp", url, mode)
+
+    # progress sender (from downloader thread); queues and returns immediately
+    def progress_sender(msg: dict):
+        # /cancel and /pause already reported the outcome; drop the thread's late messages
+        if cancel_event.is_set():
+            return
+        emit(client_id, msg, loop)
+
+    info = info_cache.pop(url)
+    format_opts = resolve_format_opts(target, mode, info) if target else None
+    thread = run_download_in_thread(url, str(DEFAULT_DL_DIR), mode, format_id, progress_sender, cancel_event,
+                                    info=info, format_opts=format_opts, audio_format=audio_format,
+                                    parallel_transcode=parallel_transcode, job_id=client_id, weight=weight,
+                                    fragment_concurrency=fragment_concurrency,
+                                    checksum=resolve_checksum(checksum))
+    done = threading.Event()
+    job_manager.register(client_id, thread, cancel_event, params, done)
+
+    # watcher to add history and cleanup
+    def watcher():
+        try:
+            record()
+        finally:
+            done.set()
+
+    def record():
+        thread.join()
+        if cancel_event.paused:
+            job_manager.unregister(client_id)
+            job_manager.park(client_id, params, cancel_event)
+            return
+        snapshot = job_states.get(client_id) or {}
+        status = snapshot.get("status")
+        final_path = snapshot.get("final_path")
+        final_name = Path(final_path).name if final_path else None
+        if status not in ("finished", "error", "cancelled"):
+            final_name = find_latest_media()
+
+        try:
+            add_history_entry({
+                "id": client_id,
+                "url": url,
+                "filename": final_name,
+                "mode": mode,
+                "status": "completed" if status not in ("error", "cancelled") else status,
+                "meta": {"checksum": snapshot["checksum"]} if snapshot.get("checksum") else {}
+            })
+        except Exception:
+            pass
+        if final_name and status not in ("error", "cancelled"):
+            try:
+                catalog.record(final_path if final_path and Path(final_path).is_absolute()
+                               else DEFAULT_DL_DIR / final_name, history_id=client_id)
+            except Exception as e:
+                print(f"[catalog] {e}")
+
+        job_manager.unregister(client_id)
+
+        # notify client via ws (so frontend shows toast / open-show actions) unless the
+        # downloader already reported how the job ended
+        if status not in ("finished", "error", "cancelled"):
+            emit(client_id, {"status": "finished", "result": {"final_path": final_name}}, loop)
+
+    threading.Thread(target=watcher, daemon=True).start()
+    return thread
+
+def launch_import_item(job_id: str, url: str, options: Dict[str, Any]):
+    """Start one bulk-import item (importer dispatcher); options are those of POST /download."""
+    if job_manager.is_running(job_id):
+        raise RuntimeError("job already running")
+    launch_download(job_id, url, options.get("mode", "video"), options.get("format_id", "best"),
+                    asyncio.get_event_loop(), target=options.get("target"),
+                    audio_format=options.get("audio_format", "mp3"),
+                    parallel_transcode=bool(options.get("parallel_transcode", False)),
+                    weight=float(options.get("weight", 1.0)),
+                    fragment_concurrency=options.get("fragment_concurrency"),
+                    checksum=options.get("checksum"))
+
+def import_job_status(job_id: str) -> Optional[str]:
+    """None while the job's thread (or its history watcher) runs, then its last status."""
+    if job_manager.is_running(job_id):
+        return None
+    snapshot = job_states.get(job_id)
+    return snapshot["status"] if snapshot else "finished"
+
 # -------------------------
 # VIDEO FORMATS ROUTE
 # -------------------------
 @app.get("/formats")
-async def get_formats(url: str = Query(...)):
+async def get_formats(url: str = Query(...), warm: bool = Query(False), target: Optional[str] = Query(None)):
     """
     Extract available video/audio formats using yt_dlp.
     Returns a JSON object:
@@ -142,137 +305,82 @@ async def get_formats(url: str = Query(...)):
       video_formats: [{format_id, quality, resolution, ext, filesize, height}, ...],
       audio_formats: [{format_id, quality, ext, filesize, abr}, ...]
     }
+    With warm=true the extracted metadata is kept for a following /download of the same url.
+    With target (e.g. "1080p av1 smallest", "audio-only m4a") the response also carries
+    `selected`: the format the selection engine picks for that target.
     """
     try:
-        ydl_opts = {
-            "quiet": True,
-            "no_warnings": True,
-            "nocheckcertificate": True,
-            "user_agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)",
-            "http_headers": {
-                "User-Agent": "Mozilla/5.0",
-                "Accept-Language": "en-US,en;q=0.9",
-            },
-            "extractor_retries": 3,
-            "socket_timeout": 30,
-        }
-
-        with YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            formats = info.get("formats", [])
-            title = info.get("title", "Unknown")
-            thumbnail = info.get("thumbnail", "")
-            duration = info.get("duration", 0)
-
-            def get_quality_label(height):
-                if not height:
-                    return "Auto"
-                if height >= 4320:
-                    return "8K"
-                if height >= 2160:
-                    return "4K"
-                if height >= 1440:
-                    return "2K"
-                if height >= 1080:
-                    return "1080p"
-                if height >= 720:
-                    return "720p"
-                if height >= 480:
-                    return "480p"
-                if height >= 360:
-                    return "360p"
-                if height >= 240:
-                    return "240p"
-                if height >= 144:
-                    return "144p"
-                return f"{height}p"
-
-            combined_formats = {}
-            video_only_formats = {}
-
-            for f in formats:
-                format_id = f.get("format_id")
-                ext = f.get("ext", "mp4")
-                height = f.get("height")
-                vcodec = f.get("vcodec", "none")
-                acodec = f.get("acodec", "none")
-                filesize = f.get("filesize") or f.get("filesize_approx") or 0
-
-                if not height or height == 0:
-                    continue
-
-                label = get_quality_label(height)
-
-                if vcodec != "none" and acodec != "none":
-                    if label not in combined_formats:
-                        combined_formats[label] = {
-                            "format_id": format_id,
-                            "quality": label,
-                            "resolution": f"{height}p",
-                            "ext": ext,
-                            "filesize": filesize,
-                            "height": height,
-                        }
-                elif vcodec != "none" and acodec == "none":
-                    if label not in video_only_formats:
-                        # prefer MP4 container for muxing
-                        video_only_formats[label] = {
-                            "format_id": f"{format_id}+bestaudio",
-                            "quality": label,
-                            "resolution": f"{height}p",
-                            "ext": "mp4",
-                            "filesize": filesize,
-                            "height": height,
-                        }
-
-            all_video_formats = {}
-            all_video_formats.update(video_only_formats)
-            for q, fmt in combined_formats.items():
-                if q not in all_video_formats:
-                    all_video_formats[q] = fmt
-
-            video_formats = sorted(all_video_formats.values(), key=lambda x: x.get("height", 0), reverse=True)
-
-            # audio formats (pick best)
-            audio_formats = []
-            best_audio = None
-            for f in formats:
-                format_id = f.get("format_id")
-                ext = (f.get("ext") or "").lower()
-                vcodec = f.get("vcodec", "none")
-                acodec = f.get("acodec", "none")
-                abr = f.get("abr") or 0
-                filesize = f.get("filesize") or f.get("filesize_approx") or 0
-                if acodec != "none" and vcodec == "none":
-                    if not best_audio or abr > best_audio.get("abr", 0):
-                        best_audio = {
-                            "format_id": format_id,
-                            "quality": "Best Quality",
-                            "ext": ext if ext in ["webm", "opus", "m4a"] else "webm",
-                            "filesize": filesize,
-                            "abr": abr,
-                        }
-            if best_audio:
-                audio_formats.append(best_audio)
-            else:
-                audio_formats = [{"format_id": "bestaudio", "quality": "Best Quality", "ext": "webm", "filesize": 0}]
-
-            if not video_formats:
-                video_formats = [{"format_id": "bestvideo+bestaudio/best", "quality": "Best Available", "resolution": "Auto", "ext": "mp4", "filesize": 0}]
-
-            return {
-                "title": title,
-                "thumbnail": thumbnail,
-                "duration": duration,
-                "video_formats": video_formats,
-                "audio_formats": audio_formats,
-            }
-
+        loop = asyncio.get_event_loop()
+        info = await loop.run_in_executor(formats_pool, lambda: extract_info(url, warm=warm))
+        result = summarize_formats(info)
+        if target:
+            result["selected"] = select_format(info, target)
+        return result
+    except CircuitOpen as e:
+        return JSONResponse({"error": "site_paused", "message": str(e), "site": e.site, "reason": e.reason},
+                            status_code=503, headers={"Retry-After": str(int(e.retry_after) + 1)})
     except Exception as e:
         msg = str(e)
         print(f"[formats error] {msg}")
         return JSONResponse({"error": "fetch_failed", "message": f"Failed to fetch video information: {msg}"}, status_code=500)
 
+@app.post("/formats/batch")
+async def get_formats_batch(payload: dict):
+    """
+    Extract formats for many urls in parallel (bounded by the formats pool).
+    At most FORMATS_WORKERS urls are in flight per request and the ones still
+    waiting are cancelled if the client disconnects.
+    Expects payload: {urls: [...], warm: bool (optional)}
+    Streams NDJSON, one line per url as soon as its extraction finishes:
+      {"index": i, "url": ..., "video_formats": [...], "audio_formats": [...], ...}
+      {"index": i, "url": ..., "error": "fetch_failed", "message": ...}
+    With warm=true each extracted info is cached so /download and /playlist/download
+    reuse it instead of extracting the video again.
+    """
+    urls = payload.get("urls") or []
+    if not urls:
+        return JSONResponse({"error": "urls required"}, status_code=400)
+    warm = bool(payload.get("warm", False))
+    loop = asyncio.get_event_loop()
+
+    def extract_one(index: int, url: str) -> dict:
+        try:
+            result = summarize_formats(extract_info(url, warm=warm))
+        except CircuitOpen as e:
+            result = {"error": "site_paused", "message": str(e), "site": e.site, "retry_after": int(e.retry_after)}
+        except Exception as e:
+            print(f"[formats batch error] {url}: {e}")
+            result = {"error": "fetch_failed", "message": f"Failed to fetch video information: {e}"}
+        result.update({"index": index, "url": url})
+        return result
+
+    async def stream():
+        # at most FORMATS_WORKERS extractions queued on the pool per request; the
+        # rest are submitted as these finish, so a big playlist does not flood it
+        todo = iter(enumerate(urls))
+        pending = set()
+
+        def refill():
+            for i, u in todo:
+                pending.add(loop.run_in_executor(formats_pool, extract_one, i, u))
+                if len(pending) >= FORMATS_WORKERS:
+                    break
+
+        refill()
+        try:
+            while pending:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for fut in done:
+                    pending.discard(fut)
+                    yield json.dumps(fut.result()) + "\n"
+                refill()
+        finally:
+            # client went away (the response is cancelled/closed): drop what has not started
+            for fut in pending:
+                fut.cancel()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
 # -------------------------
 # SINGLE VIDEO DOWNLOAD (yt_dlp)
 # -------------------------
@@ -280,7 +388,14 @@ async def get_formats(url: str = Query(...)):
 async def start_download(payload: dict):
     """
     Start a single video/audio download.
-    Expects payload: {url, id (optional), mode: video|audio, format_id}
+    Expects payload: {url, id (optional), mode: video|audio, format_id | target,
+                      audio_format (optional: mp3|m4a|opus|flac|best, default mp3),
+                      parallel_transcode (optional: segment-parallel encode for long media),
+                      weight (optional: bandwidth share relative to other jobs, default 1),
+                      fragment_concurrency (optional: HLS/DASH fragments in flight, int or "auto"),
+                      checksum (optional: true | "blake3" | "sha256", hash while downloading)}
+    `target` is a quality target ("1080p av1 smallest", "audio-only m4a") resolved
+    server-side by the selection engine instead of a format_id from /formats.
     Streams progress to websocket id (same id returned).
     """
     url = payload.get("url")
@@ -290,62 +405,17 @@ async def start_download(payload: dict):
     client_id = payload.get("id") or safe_hash_id(url)
     mode = payload.get("mode", "video")
     format_id = payload.get("format_id", "best")
+    target = payload.get("target")
 
     if job_manager.is_running(client_id):
         return JSONResponse({"error": "job already running"}, status_code=400)
 
-    cancel_event = threading.Event()
-    loop = asyncio.get_event_loop()
-
-    # progress sender (from downloader thread)
-    def progress_sender(msg: dict):
-        try:
-            asyncio.run_coroutine_threadsafe(ws_manager.send(client_id, msg), loop).result(timeout=1.0)
-        except Exception as e:
-            # ignore if client disconnected
-            # print(f"[progress_sender err] {e}")
-            pass
-
-    thread = run_download_in_thread(url, str(DEFAULT_DL_DIR), mode, format_id, progress_sender, cancel_event)
-    job_manager.register(client_id, thread, cancel_event)
-
-    # watcher to add history and cleanup
-    def watcher():
-        thread.join()
-        # best-effort: try to find final filename for history
-        final_name = None
-        try:
-            entries = sorted(DEFAULT_DL_DIR.iterdir(), key=lambda p: p.stat().st_mtime, reverse=True)
-            for p in entries:
-                if p.is_file() and p.suffix.lower() in [".mp4", ".mkv", ".webm", ".m4a", ".mp3"]:
-                    final_name = p.name
-                    break
-        except Exception:
-            final_name = None
-
-        try:
-            add_history_entry({
-                "id": client_id,
-                "url": url,
-                "filename": final_name,
-                "mode": mode,
-                "status": "completed"
-            })
-        except Exception:
-            pass
-
-        job_manager.unregister(client_id)
-
-        # notify client via ws (so frontend shows toast / open-show actions)
-        try:
-            asyncio.run_coroutine_threadsafe(
-                ws_manager.send(client_id, {"status": "finished", "result": {"final_path": final_name}}),
-                loop
-            ).result(timeout=2.0)
-        except Exception:
-            pass
-
-    threading.Thread(target=watcher, daemon=True).start()
+    launch_download(client_id, url, mode, format_id, asyncio.get_event_loop(),
+                    target=target, audio_format=payload.get("audio_format", "mp3"),
+                    parallel_transcode=bool(payload.get("parallel_transcode", False)),
+                    weight=float(payload.get("weight", 1.0)),
+                    fragment_concurrency=payload.get("fragment_concurrency"),
+                    checksum=payload.get("checksum"))
 
     return {"id": client_id, "status": "started"}
 
@@ -354,16 +424,85 @@ async def start_download(payload: dict):
 # -------------------------
 @app.post("/cancel")
 async def cancel_download(payload: dict):
+    """
+    Cancel a running or paused download.
+    Expects payload: {id, cleanup (optional: delete the job's partial files, default false)}
+    Aborts at any stage (extraction, transfer, ffmpeg) and reports "cancelled" right away;
+    the job's bandwidth share and disk reservation are released at once, even while a
+    running extraction is still finishing in its thread.
+    """
     id = payload.get("id")
     if not id:
         return JSONResponse({"error": "id required"}, status_code=400)
+    cleanup = bool(payload.get("cleanup", False))
+    loop = asyncio.get_event_loop()
 
     cancel_event = job_manager.get_cancel_event(id)
     if cancel_event:
-        cancel_event.set()
-        return {"id": id, "status": "cancelling"}
+        if isinstance(cancel_event, JobControl):
+            cancel_event.cancel("cancel", cleanup=cleanup)
+        else:
+            cancel_event.set()
+        emit(id, {"status": "cancelled"}, loop)
+        return {"id": id, "status": "cancelled"}
+
+    parked = job_manager.unpark(id)
+    if parked:
+        # paused: nothing is running, only the partial files are left
+        if cleanup:
+            await loop.run_in_executor(None, parked["cancel_event"].remove_partials)
+        emit(id, {"status": "cancelled"}, loop)
+        return {"id": id, "status": "cancelled"}
     return JSONResponse({"error": "not found"}, status_code=404)
 
+@app.post("/pause")
+async def pause_download(payload: dict):
+    """
+    Stop a running download but keep its partial files, freeing its slot.
+    Expects payload: {id}. POST /resume with the same id continues where it stopped.
+    """
+    id = payload.get("id")
+    if not id:
+        return JSONResponse({"error": "id required"}, status_code=400)
+
+    cancel_event = job_manager.get_cancel_event(id)
+    if not isinstance(cancel_event, JobControl):
+        return JSONResponse({"error": "not found"}, status_code=404)
+    cancel_event.cancel("pause")
+    emit(id, {"status": "paused"}, asyncio.get_event_loop())
+    return {"id": id, "status": "paused"}
+
+@app.post("/resume")
+async def resume_download(payload: dict):
+    """
+    Restart a paused download with its original parameters. yt-dlp continues its .part
+    files and direct downloads resume each byte range from the saved state.
+    A job that is still stopping after /pause is waited for, however long that takes.
+    Expects payload: {id}
+    """
+    id = payload.get("id")
+    if not id:
+        return JSONResponse({"error": "id required"}, status_code=400)
+
+    parked = job_manager.unpark(id)
+    if not parked:
+        # a job paused a moment ago may still be winding down (e.g. finishing an extraction);
+        # wait for its thread to actually end and park it
+        cancel_event = job_manager.get_cancel_event(id)
+        done = job_manager.get_done_event(id)
+        if isinstance(cancel_event, JobControl) and cancel_event.paused and done is not None:
+            await asyncio.get_event_loop().run_in_executor(None, done.wait)
+        parked = job_manager.unpark(id)  # also catches a park that landed between the two lookups
+    if not parked:
+        return JSONResponse({"error": "not paused"}, status_code=404)
+
+    params = parked["params"]
+    launch_download(id, params["url"], params["mode"], params["format_id"], asyncio.get_event_loop(),
+                    target=params["target"], audio_format=params["audio_format"],
+                    parallel_transcode=params["parallel_transcode"], weight=params["weight"],
+                    fragment_concurrency=params["fragment_concurrency"], checksum=params["checksum"])
+    return {"id": id, "status": "resumed"}
+
 # -------------------------
 # PLAYLIST INFO + DOWNLOAD
 # -------------------------
@@ -377,7 +516,7 @@ async def get_playlist_info(request: Request):
 
         ydl_opts = {"extract_flat": True, "quiet": True, "no_warnings": True}
 
-        with YoutubeDL(ydl_opts) as ydl:
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
             info = ydl.extract_info(url, download=False)
             if "entries" not in info:
                 return JSONResponse({"error": "Not a playlist URL"}, status_code=400)
@@ -404,82 +543,121 @@ async def download_playlist(request: Request):
     Start downloads for a list of video URLs (playlist).
     This will start individual yt_dlp downloads for each video and send finished messages to
     websocket channel 'playlist_{index}' where index is 0-based.
+    `quality` is either a raw yt_dlp selector or a target ("1080p", "720p av1 smallest",
+    "audio-only m4a") resolved server-side per item, so no /formats round trip is needed.
     """
     try:
         data = await request.json()
         video_ids = data.get("video_ids", [])
         mode = data.get("mode", "video")
         quality = data.get("quality", "best")
+        audio_format = data.get("audio_format", "mp3")
+        parallel_transcode = bool(data.get("parallel_transcode", False))
+        fragment_concurrency = data.get("fragment_concurrency")
+        checksum = data.get("checksum")
 
         if not video_ids:
             return JSONResponse({"error": "no videos"}, status_code=400)
 
         loop = asyncio.get_event_loop()
 
-        def start_single_download(video_url: str, index: int):
-            client_id = f"playlist_{index}"
-            cancel_event = threading.Event()
-
-            def progress_sender(msg: dict):
-                try:
-                    asyncio.run_coroutine_threadsafe(ws_manager.send(client_id, msg), loop).result(timeout=1.0)
-                except Exception:
-                    pass
-
-            thread = run_download_in_thread(video_url, str(DEFAULT_DL_DIR), mode, quality, progress_sender, cancel_event)
-
-            def watcher():
-                thread.join()
-                final_name = None
-                try:
-                    entries = sorted(DEFAULT_DL_DIR.iterdir(), key=lambda p: p.stat().st_mtime, reverse=True)
-                    for p in entries:
-                        if p.is_file() and p.suffix.lower() in [".mp4", ".mkv", ".webm", ".m4a", ".mp3"]:
-                            final_name = p.name
-                            break
-                except Exception:
-                    final_name = None
-
-                try:
-                    add_history_entry({
-                        "id": client_id,
-                        "url": video_url,
-                        "filename": final_name,
-                        "mode": mode,
-                        "status": "completed"
-                    })
-                except Exception:
-                    pass
-
-                # final ws notification to trigger frontend toast
-                try:
-                    asyncio.run_coroutine_threadsafe(ws_manager.send(client_id, {"status": "finished", "result": {"final_path": final_name}}), loop).result(timeout=2.0)
-                except Exception:
-                    pass
-
-            threading.Thread(target=watcher, daemon=True).start()
-
         for idx, vid in enumerate(video_ids):
             # vid may be a full URL or id; assume URL
-            start_single_download(vid, idx)
+            launch_download(f"playlist_{idx}", vid, mode, quality, loop, target=quality,
+                            audio_format=audio_format, parallel_transcode=parallel_transcode,
+                            fragment_concurrency=fragment_concurrency, checksum=checksum)
 
         return {"success": True, "message": f"Started {len(video_ids)} downloads"}
     except Exception as e:
         print(f"[playlist download] {e}")
         return JSONResponse({"error": str(e)}, status_code=500)
 
+# -------------------------
+# BULK IMPORT (streamed URL lists)
+# -------------------------
+@app.post("/import")
+async def bulk_import(request: Request, format: str = Query("auto")):
+    """
+    Queue every URL of a streamed upload (the body is read line by line, never as a whole).
+    Body: text lines "URL key=value ..." or NDJSON lines {"url": ..., options}; "#" comments.
+    Per-line options are those of POST /download (mode, format_id, target/quality,
+    audio_format, parallel_transcode, weight, fragment_concurrency, checksum, id) plus
+    force=true (skip the history / running-job dedupe). The same options as query
+    parameters are defaults for every line. format=auto|text|ndjson (auto: NDJSON when
+    the Content-Type says so, otherwise lines starting with "{" are JSON).
+    Returns the summary with the import id; GET /import/{id} tracks it.
+    """
+    if format not in ("auto", "text", "ndjson"):
+        return JSONResponse({"error": "format must be auto, text or ndjson"}, status_code=400)
+    try:
+        defaults = parse_options({k: v for k, v in request.query_params.items() if k != "format"})
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    defaults.pop("force", None)
+    defaults.pop("id", None)
+    content_type = request.headers.get("content-type", "")
+    ndjson = format == "ndjson" or (format == "auto" and ("ndjson" in content_type or "jsonl" in content_type))
+    try:
+        return await importer.ingest(request.stream(), defaults, ndjson=ndjson)
+    except Exception as e:
+        print(f"[import] {e}")
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+@app.get("/imports")
+async def list_imports(limit: int = Query(50, ge=1, le=1000)):
+    return {"imports": await asyncio.get_running_loop().run_in_executor(None, importer.recent, limit)}
+
+@app.get("/import/{import_id}")
+async def get_import(import_id: str):
+    """Summary of an import plus its items counted by status (queued, running, completed, error, ...)."""
+    progress = await asyncio.get_running_loop().run_in_executor(None, importer.progress, import_id)
+    if progress is None:
+        return JSONResponse({"error": "not found"}, status_code=404)
+    return progress
+
+@app.get("/import/{import_id}/items")
+async def get_import_items(import_id: str, status: Optional[str] = None,
+                           limit: int = Query(200, ge=1, le=5000), offset: int = Query(0, ge=0)):
+    items = await asyncio.get_running_loop().run_in_executor(
+        None, lambda: importer.items(import_id, status, limit, offset))
+    return {"id": import_id, "items": items}
+
+@app.delete("/import/{import_id}")
+async def cancel_import(import_id: str):
+    """Drop the import's queued items and cancel the ones already downloading."""
+    loop = asyncio.get_running_loop()
+    running = await loop.run_in_executor(None, importer.cancel, import_id)
+    if running is None:
+        return JSONResponse({"error": "not found"}, status_code=404)
+    for job_id in running:
+        cancel_event = job_manager.get_cancel_event(job_id)
+        if isinstance(cancel_event, JobControl):
+            cancel_event.cancel("cancel")
+            emit(job_id, {"status": "cancelled"}, loop)
+    importer.wake()
+    return {"id": import_id, "status": "cancelled", "cancelled_running": len(running)}
+
 # -------------------------
 # FILE OPERATIONS (open / show)
 # -------------------------
+def resolve_download_path(file_path: str) -> Path:
+    """Absolute path of a downloaded file; falls back to the catalog when it is not where expected (moved)."""
+    path = Path(file_path)
+    if not path.is_absolute():
+        path = DEFAULT_DL_DIR / path
+    if not path.exists():
+        known = catalog.find(path.name)
+        if known:
+            return Path(known)
+    return path
+
 @app.post("/open-file")
 async def open_file(payload: dict):
     file_path = payload.get("path")
     if not file_path:
         return JSONResponse({"error": "File path required"}, status_code=400)
 
-    file_path = Path(file_path)
-    if not file_path.is_absolute():
-        file_path = DEFAULT_DL_DIR / file_path
+    file_path = resolve_download_path(file_path)
 
     if not file_path.exists():
         return JSONResponse({"error": f"File not found: {file_path}"}, status_code=404)
@@ -503,9 +681,7 @@ async def show_in_folder(payload: dict):
     if not file_path:
         return JSONResponse({"error": "File path required"}, status_code=400)
 
-    file_path = Path(file_path)
-    if not file_path.is_absolute():
-        file_path = DEFAULT_DL_DIR / file_path
+    file_path = resolve_download_path(file_path)
 
     if not file_path.exists():
         file_path = file_path.parent
@@ -534,7 +710,8 @@ async def show_in_folder(payload: dict):
 async def add_torrent(payload: dict):
     """
     Add magnet link (or torrent) using torrent_downloader manager.
-    Expects payload: {magnet: <magnet_uri>, id: optional}
+    Expects payload: {magnet: <magnet_uri>, id: optional, weight: optional bandwidth weight,
+                      checksum: optional, true | "blake3" | "sha256": hash each file's content}
     Sends websocket progress updates to channel "torrent_{id}".
     """
     magnet_link = payload.get("magnet")
@@ -546,6 +723,8 @@ async def add_torrent(payload: dict):
 
     # loop for websocket calls
     loop = asyncio.get_event_loop()
+    ws_manager.reset_channel(f"torrent_{torrent_id}")
+    job_states.start(f"torrent_{torrent_id}", "torrent", magnet_link, "torrent")
 
     # callback used by torrent manager to stream progress/status
     def torrent_progress_callback(msg: dict):
@@ -554,13 +733,7 @@ async def add_torrent(payload: dict):
         We'll forward it to websocket channel "torrent_{torrent_id}".
         ALSO triggers toast popup when finished.
         """
-        try:
-            asyncio.run_coroutine_threadsafe(
-                ws_manager.send(f"torrent_{torrent_id}", msg),
-                loop
-            ).result(timeout=1.0)
-        except Exception:
-            pass
+        emit(f"torrent_{torrent_id}", msg, loop)
 
         # ---- TORRENT TOAST PATCH ----
         # When torrent finishes, send a popup-trigger message
@@ -575,10 +748,16 @@ async def add_torrent(payload: dict):
                         "url": magnet_link,
                         "filename": Path(save_path).name if save_path else "",
                         "mode": "torrent",
-                        "status": "completed"
+                        "status": "completed",
+                        "meta": {k: msg[k] for k in ("checksum", "checksums", "infohash") if msg.get(k)}
                     })
                 except:
                     pass
+                if save_path:
+                    try:
+                        catalog.record(save_path, history_id=torrent_id)
+                    except Exception as e:
+                        print(f"[catalog] {e}")
 
                 # 🔥 SEND FINAL TOAST CALL TO FRONTEND
                 toast_msg = {
@@ -588,19 +767,15 @@ async def add_torrent(payload: dict):
                     "save_path": save_path
                 }
 
-                try:
-                    asyncio.run_coroutine_threadsafe(
-                        ws_manager.send(f"torrent_{torrent_id}", toast_msg),
-                        loop
-                    ).result(timeout=1.0)
-                except:
-                    pass
+                emit(f"torrent_{torrent_id}", toast_msg, loop)
         except Exception:
             pass
 
     # Use new manager.add_torrent(torrent_id, magnet, callback)
     try:
-        manager.add_torrent(torrent_id, magnet_link, torrent_progress_callback)
+        manager.add_torrent(torrent_id, magnet_link, torrent_progress_callback,
+                            weight=float(payload.get("weight", 1.0)),
+                            checksum=resolve_checksum(payload.get("checksum")))
     except TypeError as te:
         # If developer's manager has different signature, try swapping params
         try:
@@ -617,6 +792,7 @@ async def add_torrent(payload: dict):
 
 @app.post("/torrent/cancel")
 async def cancel_torrent_download(payload: dict):
+    """Expects payload: {id, cleanup (optional: also delete the downloaded data)}"""
     torrent_id = payload.get("id")
     if not torrent_id:
         return JSONResponse({"error": "id required"}, status_code=400)
@@ -625,7 +801,7 @@ async def cancel_torrent_download(payload: dict):
     try:
         # manager.cancel_torrent is expected
         if hasattr(manager, "cancel_torrent"):
-            manager.cancel_torrent(torrent_id)
+            manager.cancel_torrent(torrent_id, delete_files=bool(payload.get("cleanup", False)))
         elif hasattr(manager, "cancel_download"):
             manager.cancel_download(torrent_id)
         else:
@@ -636,6 +812,26 @@ async def cancel_torrent_download(payload: dict):
 
     return {"id": torrent_id, "status": "cancelling"}
 
+@app.post("/torrent/pause")
+async def pause_torrent_download(payload: dict):
+    torrent_id = payload.get("id")
+    if not torrent_id:
+        return JSONResponse({"error": "id required"}, status_code=400)
+    result = get_torrent_manager(str(TORRENT_DL_DIR)).pause_torrent(torrent_id)
+    if "error" in result:
+        return JSONResponse(result, status_code=404)
+    return {"id": torrent_id, **result}
+
+@app.post("/torrent/resume")
+async def resume_torrent_download(payload: dict):
+    torrent_id = payload.get("id")
+    if not torrent_id:
+        return JSONResponse({"error": "id required"}, status_code=400)
+    result = get_torrent_manager(str(TORRENT_DL_DIR)).resume_torrent(torrent_id)
+    if "error" in result:
+        return JSONResponse(result, status_code=404)
+    return {"id": torrent_id, **result}
+
 @app.get("/torrent/status/{torrent_id}")
 async def get_torrent_status(torrent_id: str):
     manager = get_torrent_manager(str(TORRENT_DL_DIR))
@@ -650,6 +846,112 @@ async def get_torrent_status(torrent_id: str):
     except Exception as e:
         return JSONResponse({"error": str(e)}, status_code=500)
 
+# -------------------------
+# BANDWIDTH (global cap, schedule, per-job weights)
+# -------------------------
+@app.get("/bandwidth")
+async def get_bandwidth():
+    return bandwidth_manager.snapshot()
+
+@app.post("/bandwidth")
+async def set_bandwidth(payload: dict):
+    """
+    Update the scheduler. Expects payload (all optional):
+      {limit: "8M" | bytes/s | 0, schedule: "00:00-07:00=0;18:00-23:00=2M",
+       upload_limit: "1M", weights: {"<job id>": 2.0, "torrent_<id>": 0.5}}
+    """
+    try:
+        bandwidth_manager.configure(limit=payload.get("limit"), schedule=payload.get("schedule"),
+                                    upload_limit=payload.get("upload_limit"))
+        for job_id, weight in (payload.get("weights") or {}).items():
+            bandwidth_manager.set_weight(job_id, weight)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    return bandwidth_manager.snapshot()
+
+# -------------------------
+# FRAGMENT CONCURRENCY (HLS/DASH)
+# -------------------------
+@app.get("/fragments")
+async def get_fragments():
+    return fragment_tuner.snapshot()
+
+@app.post("/fragments")
+async def set_fragments(payload: dict):
+    """
+    Update the global fragment settings. Expects payload (all optional):
+      {concurrency: "auto" | n, max_concurrency: 16, http_chunk_size: "10M", buffer_size: "1M"}
+    """
+    try:
+        fragment_tuner.configure(concurrency=payload.get("concurrency"),
+                                 max_concurrency=payload.get("max_concurrency"),
+                                 http_chunk_size=payload.get("http_chunk_size"),
+                                 buffer_size=payload.get("buffer_size"))
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    return fragment_tuner.snapshot()
+
+# -------------------------
+# LIBRARY CATALOG
+# -------------------------
+@app.get("/library")
+async def get_library(root: Optional[str] = None, q: Optional[str] = None,
+                      limit: int = Query(200, ge=1, le=1000), offset: int = Query(0, ge=0)):
+    """Cataloged files (newest first) with their history entry; `root` is downloads|torrents."""
+    loop = asyncio.get_running_loop()
+    items = await loop.run_in_executor(None, catalog.query, root, q, limit, offset)
+    return {"items": items, "last_scan": catalog.last_scan}
+
+@app.post("/library/rescan")
+async def rescan_library():
+    try:
+        return await asyncio.get_running_loop().run_in_executor(None, catalog.scan)
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+# -------------------------
+# DISK ADMISSION
+# -------------------------
+@app.get("/disk")
+async def get_disk():
+    """Free space of the download dirs and the space reserved by running jobs."""
+    dirs = {"downloads": DEFAULT_DL_DIR, "torrents": TORRENT_DL_DIR}
+    return {
+        **admission.snapshot(),
+        "dirs": {name: {"path": str(path), "available": admission.available(str(path))}
+                 for name, path in dirs.items()},
+    }
+
+# -------------------------
+# SITE CIRCUIT BREAKERS (rate limiting)
+# -------------------------
+@app.get("/sites")
+async def get_sites():
+    """Per-site breaker state: {site: {state: closed|open|half_open, reason, retry_after, trips}}"""
+    return breakers.snapshot()
+
+# -------------------------
+# BULK JOB STATUS (cheap polling)
+# -------------------------
+@app.get("/jobs")
+async def list_jobs(request: Request, ids: Optional[str] = None, kind: Optional[str] = None,
+                    status: Optional[str] = None, active: Optional[bool] = None,
+                    since: Optional[float] = None, limit: int = 1000):
+    """
+    Compact snapshots of yt_dlp and torrent jobs from the in-memory state table.
+    Query: ids=a,b,torrent_c (batch) | kind=ytdlp|torrent | status=downloading,error
+           active=true|false | since=<unix ts, updated after> | limit
+    Responses carry an ETag; a matching If-None-Match returns 304 without a body.
+    """
+    id_list = [i for i in ids.split(",") if i] if ids else None
+    etag = job_states.etag(id_list, extra=str(request.url.query))
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+
+    statuses = set(status.split(",")) if status else None
+    jobs = job_states.query(id_list, kind=kind, statuses=statuses, active=active, since=since, limit=limit)
+    return JSONResponse({"version": job_states.version, "jobs": jobs}, headers={"ETag": etag})
+
 @app.websocket("/ws/torrent_{torrent_id}")
 async def torrent_websocket_endpoint(websocket: WebSocket, torrent_id: str):
     """
@@ -657,7 +959,7 @@ async def torrent_websocket_endpoint(websocket: WebSocket, torrent_id: str):
     Each client should connect to /ws/torrent_<id>
     """
     await websocket.accept()
-    ws_manager.add_connection(f"torrent_{torrent_id}", websocket)
+    conn = ws_manager.add_connection(f"torrent_{torrent_id}", websocket)
     print(f"[ws] Torrent WebSocket connected: {torrent_id}")
 
     try:
@@ -668,6 +970,8 @@ async def torrent_websocket_endpoint(websocket: WebSocket, torrent_id: str):
             except WebSocketDisconnect:
                 raise
             except Exception:
+                if conn.closed:
+                    break
                 # ignore non-text pings; small sleep prevents busy loop
                 await asyncio.sleep(0.1)
     except WebSocketDisconnect:
@@ -675,7 +979,56 @@ async def torrent_websocket_endpoint(websocket: WebSocket, torrent_id: str):
     except Exception as e:
         print(f"[ws] Torrent WebSocket error: {e}")
     finally:
-        ws_manager.remove_connection(f"torrent_{torrent_id}")
+        ws_manager.remove_connection(f"torrent_{torrent_id}", conn)
+
+# -------------------------
+# MULTIPLEXED websocket (many jobs, one connection)
+# -------------------------
+@app.websocket("/ws")
+async def mux_websocket_endpoint(websocket: WebSocket, format: str = "json", delta: bool = True):
+    """
+    One connection for many jobs. Query: ?format=json|msgpack&delta=true|false
+    Control frames (JSON text, or msgpack binary when format=msgpack):
+      {"op": "subscribe", "ids": ["<client_id>", "torrent_<id>", ...]}
+      {"op": "unsubscribe", "ids": [...]}
+    A frame that is not such an object is answered with {"op": "error", "message": ...}.
+    Job messages arrive as {"id": <job>, "t": "full"|"delta", ...} (see ws_manager).
+    """
+    await websocket.accept()
+    client = MuxClient(websocket, binary=(format == "msgpack"), delta=delta)
+    client.start()
+    client.enqueue_control({"op": "hello", "format": client.format, "delta": client.delta})
+
+    try:
+        while True:
+            message = await websocket.receive()
+            if message.get("type") == "websocket.disconnect":
+                break
+            # a malformed frame gets an error reply; it must not drop the connection's subscriptions
+            try:
+                control = client.decode(message)
+            except Exception:
+                client.enqueue_control({"op": "error", "message": "undecodable control frame"})
+                continue
+            if control is None:
+                continue
+            if not isinstance(control, dict) or not isinstance(control.get("ids", []), list):
+                client.enqueue_control({"op": "error", "message": "control frames are objects with an 'ids' list"})
+                continue
+            ids = [str(i) for i in control.get("ids", [])]
+            if control.get("op") == "subscribe":
+                ws_manager.subscribe(client, ids)
+                client.enqueue_control({"op": "subscribed", "ids": ids})
+            elif control.get("op") == "unsubscribe":
+                ws_manager.unsubscribe(client, ids)
+                client.enqueue_control({"op": "unsubscribed", "ids": ids})
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        print(f"[ws] Mux WebSocket error: {e}")
+    finally:
+        ws_manager.unsubscribe(client)
+        await client.close()
 
 # -------------------------
 # GENERAL websocket for downloads
@@ -683,7 +1036,7 @@ async def torrent_websocket_endpoint(websocket: WebSocket, torrent_id: str):
 @app.websocket("/ws/{client_id}")
 async def websocket_endpoint(websocket: WebSocket, client_id: str):
     await websocket.accept()
-    ws_manager.add_connection(client_id, websocket)
+    conn = ws_manager.add_connection(client_id, websocket)
     print(f"[ws] WebSocket connected: {client_id}")
 
     try:
@@ -693,41 +1046,138 @@ async def websocket_endpoint(websocket: WebSocket, client_id: str):
             except WebSocketDisconnect:
                 raise
             except Exception:
+                if conn.closed:
+                    break
                 await asyncio.sleep(0.1)
     except WebSocketDisconnect:
         print(f"[ws] WebSocket disconnected: {client_id}")
     except Exception as e:
         print(f"[ws] WebSocket error: {e}")
     finally:
-        ws_manager.remove_connection(client_id)
+        ws_manager.remove_connection(client_id, conn)
 
 # -------------------------
 # Thumbnail, History endpoints
 # -------------------------
+def resolve_thumbnail(url: str) -> Optional[str]:
+    """Remote thumbnail URL for a video page: cheap paths first, extraction last."""
+    cached = info_cache.get(url)
+    return youtube_thumbnail(url) or (cached or {}).get("thumbnail") or get_thumbnail_for_url(url)
+
 @app.get("/thumbnail")
 async def thumbnail(url: str = Query(...)):
+    """Returns {thumbnail: remote url, image: local cached/resized proxy path}."""
     try:
-        thumb = get_thumbnail_for_url(url)
-        return {"thumbnail": thumb}
+        loop = asyncio.get_event_loop()
+        thumb = await loop.run_in_executor(thumbnail_pool, resolve_thumbnail, url)
+        return {"thumbnail": thumb, "image": f"/thumbnail/image?url={quote(url, safe='')}"}
     except Exception as e:
         return JSONResponse({"error": str(e)}, status_code=500)
 
+@app.get("/thumbnail/image")
+async def thumbnail_image(request: Request, url: Optional[str] = None, src: Optional[str] = None,
+                          w: Optional[int] = None, format: str = "webp"):
+    """
+    Serve a thumbnail from the local cache, fetching it once on a miss.
+    Query: url=<video page url> or src=<image url>, w=<width> (rounded up to a cached
+    size), format=webp|jpeg. Responses carry a content ETag and are cacheable for a week.
+    Images are only fetched from public http(s) hosts (403 otherwise).
+    """
+    key = src or url
+    if not key:
+        return JSONResponse({"error": "url or src required"}, status_code=400)
+    resolve = None if src else (lambda: resolve_thumbnail(url))
+    loop = asyncio.get_event_loop()
+    try:
+        path, media_type, etag = await loop.run_in_executor(
+            thumbnail_pool, lambda: thumbnail_cache.get(key, w, format, resolve))
+    except PermissionError as e:
+        return JSONResponse({"error": "thumbnail_forbidden", "message": str(e)}, status_code=403)
+    except Exception as e:
+        return JSONResponse({"error": "thumbnail_failed", "message": str(e)}, status_code=404)
+
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=604800, immutable"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type=media_type, headers=headers)
+
 @app.get("/history/list")
-async def api_history_list(limit: int = 200):
+async def api_history_list(request: Request, limit: int = Query(200, ge=1, le=5000)):
+    """Served from the versioned response cache; ETag lets pollers skip unchanged lists entirely."""
     try:
-        items = list_history(limit=limit)
-        return {"history": items}
+        body, etag = await history_cache.list(limit)
     except Exception as e:
         return JSONResponse({"error": str(e)}, status_code=500)
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(body, media_type="application/json", headers={"ETag": etag, "Cache-Control": "no-cache"})
 
 @app.delete("/history/delete/{id}")
 async def api_history_delete(id: str):
     try:
-        ok = delete_history(id)
+        ok = await asyncio.get_running_loop().run_in_executor(None, delete_history, id)
         return {"ok": True} if ok else JSONResponse({"error": "not found"}, status_code=404)
     except Exception as e:
         return JSONResponse({"error": str(e)}, status_code=500)
 
+# -------------------------
+# ADMIN: profiling, loop lag, request timings, startup
+# -------------------------
+@app.post("/admin/profile")
+async def start_profile(payload: dict = None):
+    """
+    Start a sampling window over all threads. Payload: {seconds (default 10, capped by
+    PROFILE_MAX_SECONDS), interval_ms (default 10)}. Fetch the result with GET /admin/profile.
+    """
+    payload = payload or {}
+    try:
+        started = profiler.start(float(payload.get("seconds", 10)), float(payload.get("interval_ms", 10)))
+    except (TypeError, ValueError) as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    if not started:
+        return JSONResponse({"error": "profile already running", **profiler.status()}, status_code=409)
+    return profiler.status()
+
+@app.delete("/admin/profile")
+async def stop_profile():
+    await asyncio.get_running_loop().run_in_executor(None, profiler.stop)
+    return profiler.status()
+
+@app.get("/admin/profile")
+async def get_profile(format: str = Query("json"), idle: bool = Query(True), wait: bool = Query(False)):
+    """
+    Result of the current / last window. format=json (status + hottest frames) |
+    collapsed (flamegraph.pl / speedscope input) | svg (flamegraph). idle=false drops
+    samples of threads that were only waiting; wait=true blocks until the window ends.
+    """
+    if wait:
+        await asyncio.get_running_loop().run_in_executor(None, profiler.wait, PROFILE_WAIT_TIMEOUT)
+    if format == "collapsed":
+        return Response(profiler.collapsed_text(idle), media_type="text/plain")
+    if format == "svg":
+        return Response(profiler.flamegraph(idle), media_type="image/svg+xml")
+    return {**profiler.status(), "top": profiler.top(idle)}
+
+@app.get("/admin/loop-lag")
+async def get_loop_lag(window: float = Query(60, gt=0, le=300)):
+    """Event-loop lag percentiles over the last `window` seconds, plus recent stalls with the blocking stack."""
+    return loop_lag.snapshot(window)
+
+@app.get("/admin/timings")
+async def get_timings():
+    """Per-route request count, 5xx errors and latency (histogram upper bounds), slowest total first."""
+    return request_timings.snapshot()
+
+@app.delete("/admin/timings")
+async def reset_timings():
+    request_timings.reset()
+    return {"ok": True}
+
+@app.get("/admin/startup")
+async def get_startup_report():
+    """Import / startup phase timings and when each lazily imported module (yt_dlp, libtorrent) was loaded."""
+    return startup.report()
+
 # -------------------------
 # Health + root
 # -------------------------
@@ -750,4 +1200,6 @@ async def root():
         ]
     }
 
+startup.mark("import main")
+
 # --- End of file ---
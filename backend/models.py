@@ -1,5 +1,5 @@
 # backend/models.py
-from sqlalchemy import Column, Integer, String, Text, DateTime
+from sqlalchemy import Column, Integer, String, Text, DateTime, Float
 from sqlalchemy.orm import declarative_base
 import datetime
 
@@ -28,3 +28,89 @@ class History(Base):
             "finished_at": self.finished_at.isoformat() if self.finished_at else None,
             "meta": self.meta,
         }
+
+class CatalogEntry(Base):
+    """A file on disk under one of the download roots (kept current by catalog.py)."""
+    __tablename__ = "catalog"
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    path = Column(Text, nullable=False, unique=True, index=True)
+    name = Column(String, nullable=False, index=True)
+    root = Column(String, nullable=True)
+    size = Column(Integer, nullable=False, default=0)
+    mtime = Column(Float, nullable=False, default=0)
+    duration = Column(Float, nullable=True)
+    history_id = Column(String, nullable=True, index=True)
+    scanned_at = Column(DateTime, default=datetime.datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "path": self.path,
+            "name": self.name,
+            "root": self.root,
+            "size": self.size,
+            "mtime": self.mtime,
+            "duration": self.duration,
+            "history_id": self.history_id,
+            "scanned_at": self.scanned_at.isoformat() if self.scanned_at else None,
+        }
+
+class ImportBatch(Base):
+    """One bulk URL import (POST /import); its accepted lines are ImportItem rows (importer.py)."""
+    __tablename__ = "imports"
+    
+    id = Column(String, primary_key=True, index=True)
+    status = Column(String, nullable=False, default="receiving")
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+    lines = Column(Integer, nullable=False, default=0)
+    accepted = Column(Integer, nullable=False, default=0)
+    duplicates = Column(Integer, nullable=False, default=0)
+    invalid = Column(Integer, nullable=False, default=0)
+    options = Column(Text, nullable=True)   # JSON: defaults for every line
+    rejected = Column(Text, nullable=True)  # JSON: sample of skipped lines
+    
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "status": self.status,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+            "lines": self.lines,
+            "accepted": self.accepted,
+            "duplicates": self.duplicates,
+            "invalid": self.invalid,
+            "options": self.options,
+            "rejected": self.rejected,
+        }
+
+class ImportItem(Base):
+    """A queued URL of a bulk import; the dispatcher turns it into a download job."""
+    __tablename__ = "import_items"
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    import_id = Column(String, nullable=False, index=True)
+    line = Column(Integer, nullable=False)
+    url = Column(Text, nullable=False)
+    url_key = Column(String, nullable=False, index=True)  # digest of the normalized URL
+    options = Column(Text, nullable=True)  # JSON: per-line options
+    job_id = Column(String, nullable=True)
+    status = Column(String, nullable=False, default="queued", index=True)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+    
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "import_id": self.import_id,
+            "line": self.line,
+            "url": self.url,
+            "options": self.options,
+            "job_id": self.job_id,
+            "status": self.status,
+            "error": self.error,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+        }
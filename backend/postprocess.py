@@ -0,0 +1,309 @@
+# backend/postprocess.py
+"""
+Post-processing worker pool for finished downloads.
+
+CPU-bound ffmpeg work (audio extraction / conversion) runs in a bounded process
+pool sized to the core count, so a download thread only hands the file over and
+the next download is not stuck behind a transcode. When the source codec already
+matches the requested output the audio stream is copied (remux) instead of
+re-encoded.
+
+Long inputs can optionally be transcoded segment-parallel: the file is split at
+keyframes with a stream copy, the segments are encoded concurrently across the
+pool and the results are concatenated losslessly (concat demuxer, -c copy).
+
+Worker functions are plain top-level functions so they can be pickled into the
+pool; they only use the standard library and the ffmpeg/ffprobe binaries.
+Each ffmpeg run can record its pid in a pidfile so a cancelled job can kill it
+from the server process (see cancellation.py).
+"""
+
+import multiprocessing
+import os
+import shutil
+import subprocess
+import threading
+from concurrent.futures import ProcessPoolExecutor, Future, FIRST_COMPLETED, wait
+from concurrent.futures import TimeoutError as FutureTimeout
+from pathlib import Path
+from typing import Dict, Any, Optional, Callable, List
+
+from cancellation import pidfile_for
+
+POSTPROCESS_WORKERS = int(os.environ.get("POSTPROCESS_WORKERS", "0")) or (os.cpu_count() or 2)
+
+# segment-parallel transcoding only pays off for long inputs
+PARALLEL_MIN_DURATION = float(os.environ.get("PARALLEL_TRANSCODE_MIN_SECONDS", "600"))
+
+# requested output -> (container ext, ffmpeg encoder, source codecs that can be stream-copied)
+AUDIO_OUTPUTS = {
+    "mp3": ("mp3", "libmp3lame", {"mp3"}),
+    "m4a": ("m4a", "aac", {"aac", "alac"}),
+    "aac": ("m4a", "aac", {"aac"}),
+    "opus": ("opus", "libopus", {"opus"}),
+    "vorbis": ("ogg", "libvorbis", {"vorbis"}),
+    "flac": ("flac", "flac", {"flac"}),
+}
+
+# source codec -> natural container when the caller asks for "best" (always a copy)
+NATIVE_CONTAINERS = {"aac": "m4a", "alac": "m4a", "opus": "opus", "mp3": "mp3", "vorbis": "ogg", "flac": "flac"}
+
+
+def probe_audio_codec(path: str) -> Optional[str]:
+    """Return the codec name of the first audio stream (ffprobe), or None."""
+    try:
+        out = subprocess.run(
+            ["ffprobe", "-v", "error", "-select_streams", "a:0",
+             "-show_entries", "stream=codec_name", "-of", "default=nw=1:nk=1", path],
+            capture_output=True, text=True, timeout=60,
+        )
+        codec = out.stdout.strip().splitlines()
+        return codec[0].lower() if codec else None
+    except Exception:
+        return None
+
+
+def probe_duration(path: str) -> float:
+    """Return the container duration in seconds (ffprobe), or 0 if unknown."""
+    try:
+        out = subprocess.run(
+            ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "default=nw=1:nk=1", path],
+            capture_output=True, text=True, timeout=60,
+        )
+        return float(out.stdout.strip() or 0)
+    except Exception:
+        return 0.0
+
+
+def _run_ffmpeg(cmd: List[str], pidfile: Optional[str] = None) -> subprocess.CompletedProcess:
+    """subprocess.run() for ffmpeg that keeps the child's pid in `pidfile` while it runs."""
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if pidfile:
+        Path(pidfile).write_text(str(proc.pid))
+    try:
+        out, err = proc.communicate()
+    finally:
+        if pidfile:
+            try:
+                os.unlink(pidfile)
+            except OSError:
+                pass
+    return subprocess.CompletedProcess(cmd, proc.returncode, out, err)
+
+
+def _check_cancelled(cancel_event):
+    if cancel_event is not None and cancel_event.is_set():
+        raise Exception("Download cancelled")
+
+
+def plan_audio_conversion(source_codec: Optional[str], codec: str):
+    """
+    Decide how to produce `codec` from a source stream.
+    Returns (ext, ffmpeg codec args, method) where method is "copy" or "transcode".
+    """
+    if codec == "best":
+        if source_codec in NATIVE_CONTAINERS:
+            return NATIVE_CONTAINERS[source_codec], ["-c:a", "copy"], "copy"
+        codec = "mp3"
+    ext, encoder, copyable = AUDIO_OUTPUTS.get(codec, AUDIO_OUTPUTS["mp3"])
+    if source_codec in copyable:
+        return ext, ["-c:a", "copy"], "copy"
+    return ext, ["-c:a", encoder], "transcode"
+
+
+def _audio_codec_args(source_codec: Optional[str], codec: str, quality: str):
+    ext, codec_args, method = plan_audio_conversion(source_codec, codec)
+    if method == "transcode" and quality and codec_args[1] not in ("flac",):
+        codec_args = codec_args + ["-b:a", f"{quality}k"]
+    return ext, codec_args, method
+
+
+def convert_audio(src: str, codec: str = "mp3", quality: str = "192", pidfile: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Worker entry point: turn the downloaded file `src` into audio `codec`
+    (stream copy when possible). The source file is removed on success.
+    Returns {"path", "method", "source_codec"}.
+    """
+    src_path = Path(src)
+    source_codec = probe_audio_codec(src)
+    ext, codec_args, method = _audio_codec_args(source_codec, codec, quality)
+
+    dst_path = src_path.with_suffix(f".{ext}")
+    tmp_path = dst_path.with_name(f"{dst_path.stem}.pp-tmp.{ext}")
+    cmd = ["ffmpeg", "-y", "-loglevel", "error", "-i", str(src_path), "-vn", "-map", "0:a:0"] + codec_args + [str(tmp_path)]
+    proc = _run_ffmpeg(cmd, pidfile)
+    if proc.returncode != 0:
+        try:
+            tmp_path.unlink()
+        except OSError:
+            pass
+        raise RuntimeError(f"ffmpeg failed ({method}): {proc.stderr.strip()[-500:]}")
+
+    os.replace(tmp_path, dst_path)
+    if src_path != dst_path:
+        try:
+            src_path.unlink()
+        except OSError:
+            pass
+    return {"path": str(dst_path), "method": method, "source_codec": source_codec}
+
+
+def transcode_segment(seg: str, out: str, codec_args: List[str], pidfile: Optional[str] = None) -> str:
+    """Worker entry point: encode one segment with `codec_args`."""
+    cmd = ["ffmpeg", "-y", "-loglevel", "error", "-i", seg] + codec_args + [out]
+    proc = _run_ffmpeg(cmd, pidfile)
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg segment failed: {proc.stderr.strip()[-500:]}")
+    return out
+
+
+# -------------------------
+# Segment-parallel transcoding
+# -------------------------
+def split_at_keyframes(src: str, workdir: Path, segment_seconds: float, pidfile: Optional[str] = None) -> List[str]:
+    """Stream-copy `src` into ~segment_seconds pieces; the segment muxer only cuts on keyframes."""
+    pattern = workdir / f"seg_%05d{Path(src).suffix}"
+    cmd = ["ffmpeg", "-y", "-loglevel", "error", "-i", src, "-map", "0", "-c", "copy",
+           "-f", "segment", "-segment_time", f"{segment_seconds:.3f}", "-reset_timestamps", "1", str(pattern)]
+    proc = _run_ffmpeg(cmd, pidfile)
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg split failed: {proc.stderr.strip()[-500:]}")
+    return sorted(str(p) for p in workdir.glob(f"seg_*{Path(src).suffix}"))
+
+
+def concat_segments(parts: List[str], dst: str, workdir: Path, pidfile: Optional[str] = None):
+    """Join encoded segments without re-encoding (concat demuxer)."""
+    listing = workdir / "concat.txt"
+    with open(listing, "w", encoding="utf-8") as fh:
+        for part in parts:
+            escaped = part.replace("'", "'\\''")
+            fh.write(f"file '{escaped}'\n")
+    cmd = ["ffmpeg", "-y", "-loglevel", "error", "-f", "concat", "-safe", "0", "-i", str(listing),
+           "-c", "copy", dst]
+    proc = _run_ffmpeg(cmd, pidfile)
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg concat failed: {proc.stderr.strip()[-500:]}")
+
+
+def parallel_transcode(src: str, dst: str, codec_args: List[str],
+                       progress_callback: Optional[Callable[[dict], None]] = None,
+                       segments: Optional[int] = None, duration: Optional[float] = None,
+                       cancel_event=None) -> str:
+    """
+    Split `src` at keyframes, encode the segments concurrently in the pool and
+    concatenate them into `dst`. Runs in the calling (download) thread, which only
+    waits on the pool. Emits per-segment progress through `progress_callback`.
+    With a cancellation.JobControl as `cancel_event` every ffmpeg run is killable.
+    """
+    token = getattr(cancel_event, "token", None)
+    duration = duration or probe_duration(src)
+    segments = segments or POSTPROCESS_WORKERS * 2
+    segment_seconds = max(duration / segments, 10.0) if duration else 60.0
+    dst_path = Path(dst)
+    workdir = dst_path.parent / f".{dst_path.stem}.segments"
+    shutil.rmtree(workdir, ignore_errors=True)
+    workdir.mkdir(parents=True)
+
+    try:
+        parts = split_at_keyframes(src, workdir, segment_seconds, pidfile_for(token))
+        _check_cancelled(cancel_event)
+        if not parts:
+            raise RuntimeError("ffmpeg split produced no segments")
+        outputs = [str(workdir / f"enc_{i:05d}{dst_path.suffix}") for i in range(len(parts))]
+
+        pool = get_postprocess_pool()
+        futures = {pool.submit(transcode_segment, seg, out, codec_args, pidfile_for(token)): i
+                   for i, (seg, out) in enumerate(zip(parts, outputs))}
+        done = 0
+        pending = set(futures)
+        while pending:
+            finished, pending = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+            if cancel_event is not None and cancel_event.is_set():
+                for fut in pending:
+                    fut.cancel()
+                _check_cancelled(cancel_event)
+            for fut in finished:
+                fut.result()
+                done += 1
+                if progress_callback:
+                    progress_callback({
+                        "status": "processing",
+                        "stage": "transcode",
+                        "segment": futures[fut],
+                        "segments_done": done,
+                        "segments_total": len(parts),
+                        "progress": round(done * 100 / len(parts), 2),
+                    })
+
+        tmp = dst_path.with_name(f"{dst_path.stem}.pp-tmp{dst_path.suffix}")
+        concat_segments(outputs, str(tmp), workdir, pidfile_for(token))
+        _check_cancelled(cancel_event)
+        os.replace(tmp, dst_path)
+        return str(dst_path)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def transcode_audio(src: str, codec: str = "mp3", quality: str = "192",
+                    progress_callback: Optional[Callable[[dict], None]] = None,
+                    parallel: bool = False, cancel_event=None) -> Dict[str, Any]:
+    """
+    Convert a downloaded file to audio `codec`, choosing the cheapest path:
+    stream copy when the codec already matches, segment-parallel encode for long
+    inputs when `parallel` is set, otherwise a single ffmpeg run in the pool.
+    Blocks the caller until the result is ready (or `cancel_event` is set, which kills
+    the ffmpeg runs); returns {"path", "method", "source_codec"}.
+    """
+    source_codec = probe_audio_codec(src)
+    ext, codec_args, method = _audio_codec_args(source_codec, codec, quality)
+    duration = probe_duration(src) if parallel and method == "transcode" else 0
+    if duration < PARALLEL_MIN_DURATION:
+        future = submit_audio_conversion(src, codec, quality, pidfile_for(getattr(cancel_event, "token", None)))
+        while True:
+            try:
+                return future.result(timeout=0.5)
+            except FutureTimeout:
+                if cancel_event is not None and cancel_event.is_set():
+                    future.cancel()
+                    _check_cancelled(cancel_event)
+
+    src_path = Path(src)
+    dst_path = src_path.with_suffix(f".{ext}")
+    parallel_transcode(src, str(dst_path), ["-vn", "-map", "0:a:0"] + codec_args,
+                       progress_callback=progress_callback, duration=duration, cancel_event=cancel_event)
+    if src_path != dst_path:
+        try:
+            src_path.unlink()
+        except OSError:
+            pass
+    return {"path": str(dst_path), "method": "parallel_transcode", "source_codec": source_codec}
+
+
+# -------------------------
+# Pool (created on first use)
+# -------------------------
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def get_postprocess_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: the server process is multi-threaded, forking it is not safe
+            ctx = multiprocessing.get_context("spawn")
+            _pool = ProcessPoolExecutor(max_workers=POSTPROCESS_WORKERS, mp_context=ctx)
+        return _pool
+
+
+def submit_audio_conversion(src: str, codec: str = "mp3", quality: str = "192",
+                            pidfile: Optional[str] = None) -> Future:
+    return get_postprocess_pool().submit(convert_audio, src, codec, quality, pidfile)
+
+
+def shutdown_postprocess_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
@@ -0,0 +1,364 @@
+# backend/profiling.py
+"""
+Production-safe instrumentation, exposed through the /admin endpoints.
+
+* SamplingProfiler: for a bounded window (at most PROFILE_MAX_SECONDS), a daemon
+  thread reads sys._current_frames() every interval and counts the stack of every
+  thread (download threads, watchers, torrent _monitor loops, the event loop).
+  Nothing is hooked into the profiled code, so the cost is one stack walk per
+  thread per sample (about 1% at the default 100 Hz). Results come out as
+  collapsed stacks ("thread;frame;frame count", readable by flamegraph.pl and
+  speedscope), as JSON or as a self-contained SVG flamegraph.
+* LoopLagMonitor: always on. A 100 ms ticker on the event loop records how late it
+  wakes up; a watchdog thread notices a loop that has not ticked for
+  LOOP_LAG_STALL_MS and records the loop thread's stack at that moment, which
+  names the blocking call.
+* TimingMiddleware: per-route request count, errors and latency histogram
+  (fixed log-scale buckets, O(1) per request), keyed by route template.
+
+    PROFILE_MAX_SECONDS=60  LOOP_LAG_INTERVAL_MS=100  LOOP_LAG_STALL_MS=250
+"""
+
+import asyncio
+import bisect
+import html
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter, deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+PROFILE_MAX_SECONDS = float(os.environ.get("PROFILE_MAX_SECONDS", "60"))
+LOOP_LAG_INTERVAL = float(os.environ.get("LOOP_LAG_INTERVAL_MS", "100")) / 1000
+LOOP_LAG_STALL = float(os.environ.get("LOOP_LAG_STALL_MS", "250")) / 1000
+
+# leaf frames of a thread that is only waiting; dropped with idle=False
+IDLE_LEAVES = {
+    ("threading.py", "wait"), ("threading.py", "_wait_for_tstate_lock"), ("queue.py", "get"),
+    ("selectors.py", "select"), ("socket.py", "readinto"), ("socket.py", "accept"),
+    ("ssl.py", "read"), ("connection.py", "wait"), ("thread.py", "_worker"), ("base_events.py", "_run_once"),
+}
+
+
+def _thread_name(thread: Optional[threading.Thread], ident: int) -> str:
+    name = thread.name if thread else f"thread-{ident}"
+    # "Thread-12 (download_task)" -> "Thread (download_task)" so equal workers aggregate
+    return re.sub(r"-\d+", "", name).replace(";", ",")
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    def __init__(self):
+        self.counts: Counter = Counter()
+        self.samples = 0
+        self.interval = 0.01
+        self.started_at: Optional[float] = None
+        self.stopped_at: Optional[float] = None
+        self.overhead = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds: float = 10, interval_ms: float = 10) -> bool:
+        """Start a window of at most PROFILE_MAX_SECONDS; False when one is already running."""
+        with self._lock:
+            if self.running:
+                return False
+            self.counts = Counter()
+            self.samples = 0
+            self.overhead = 0.0
+            self.interval = max(1.0, float(interval_ms)) / 1000
+            self.started_at, self.stopped_at = time.time(), None
+            self._stop.clear()
+            seconds = min(max(0.1, float(seconds)), PROFILE_MAX_SECONDS)
+            self._thread = threading.Thread(target=self._run, args=(seconds,), daemon=True, name="profiler")
+            self._thread.start()
+            return True
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+
+    def wait(self, timeout: Optional[float] = None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self, seconds: float):
+        me = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        while not self._stop.is_set() and time.monotonic() < deadline:
+            began = time.perf_counter()
+            threads = {t.ident: t for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                leaf = (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name)
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack.append(_thread_name(threads.get(ident), ident))
+                self.counts[(tuple(reversed(stack)), leaf in IDLE_LEAVES)] += 1
+            self.samples += 1
+            spent = time.perf_counter() - began
+            self.overhead += spent
+            self._stop.wait(max(0.0, self.interval - spent))
+        self.stopped_at = time.time()
+
+    # --- output ---
+    def collapsed(self, idle: bool = True) -> Dict[str, int]:
+        out: Counter = Counter()
+        for (stack, is_idle), count in list(self.counts.items()):
+            if idle or not is_idle:
+                out[";".join(stack)] += count
+        return dict(out)
+
+    def collapsed_text(self, idle: bool = True) -> str:
+        stacks = self.collapsed(idle)
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(stacks.items(), key=lambda i: -i[1]))
+
+    def status(self) -> dict:
+        end = self.stopped_at or time.time()
+        return {
+            "running": self.running,
+            "started_at": self.started_at,
+            "seconds": round(end - self.started_at, 2) if self.started_at else 0,
+            "interval_ms": self.interval * 1000,
+            "samples": self.samples,
+            "overhead_pct": round(100 * self.overhead / (end - self.started_at), 2)
+            if self.started_at and end > self.started_at else 0,
+        }
+
+    def top(self, idle: bool = False, limit: int = 30) -> List[dict]:
+        """Functions by inclusive sample count (summed over threads)."""
+        inclusive: Counter = Counter()
+        for stack, count in self.collapsed(idle).items():
+            for frame in set(stack.split(";")[1:]):
+                inclusive[frame] += count
+        return [{"frame": f, "samples": c} for f, c in inclusive.most_common(limit)]
+
+    def flamegraph(self, idle: bool = True, width: int = 1200) -> str:
+        return render_flamegraph(self.collapsed(idle), width=width,
+                                 title=f"{self.samples} samples @ {self.interval * 1000:.0f} ms")
+
+
+def render_flamegraph(stacks: Dict[str, int], width: int = 1200, title: str = "") -> str:
+    """Self-contained SVG flamegraph (root at the bottom, hover for counts) of collapsed stacks."""
+    tree: dict = {"n": 0, "c": {}}
+    for stack, count in stacks.items():
+        node = tree
+        node["n"] += count
+        for frame in stack.split(";"):
+            node = node["c"].setdefault(frame, {"n": 0, "c": {}})
+            node["n"] += count
+    total = tree["n"] or 1
+
+    def depth(node) -> int:
+        return 1 + max((depth(c) for c in node["c"].values()), default=0)
+
+    row = 16
+    levels = depth(tree) - 1
+    height = (levels + 2) * row
+    rects = []
+
+    def draw(node, x: float, level: int):
+        for name, child in sorted(node["c"].items()):
+            w = child["n"] / total * width
+            if w >= 0.5:
+                y = height - (level + 1) * row
+                hue = 10 + (hash(name.split(" (")[0]) % 40)
+                label = html.escape(name)
+                text = html.escape(name[:int(w / 7)]) if w > 30 else ""
+                rects.append(
+                    f'<g><title>{label} ({child["n"]} samples, {100 * child["n"] / total:.1f}%)</title>'
+                    f'<rect x="{x:.1f}" y="{y}" width="{w:.1f}" height="{row - 1}" '
+                    f'fill="hsl({hue},85%,60%)"/>'
+                    f'<text x="{x + 3:.1f}" y="{y + row - 4}">{text}</text></g>')
+                draw(child, x, level + 1)
+            x += w
+
+    draw(tree, 0.0, 0)
+    return (f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+            f'font-family="monospace" font-size="11">'
+            f'<text x="4" y="12">{html.escape(title)}</text>{"".join(rects)}</svg>')
+
+
+class LoopLagMonitor:
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL, stall: float = LOOP_LAG_STALL):
+        self.interval = interval
+        self.stall = stall
+        self.samples: Deque[Tuple[float, float]] = deque(maxlen=int(300 / interval))  # (ts, lag) ~5 min
+        self.stalls: Deque[dict] = deque(maxlen=20)
+        self.max_lag = 0.0
+        self._heartbeat = time.monotonic()
+        self._loop_thread: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def start(self):
+        """Start on the running event loop (call from a startup handler)."""
+        self._loop_thread = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.ensure_future(self._tick())
+        self._watchdog = threading.Thread(target=self._watch, daemon=True, name="loop-watchdog")
+        self._watchdog.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _tick(self):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                expected = loop.time() + self.interval
+                await asyncio.sleep(self.interval)
+                lag = max(0.0, loop.time() - expected)
+                self._heartbeat = time.monotonic()
+                self.samples.append((time.time(), lag))
+                self.max_lag = max(self.max_lag, lag)
+        except asyncio.CancelledError:
+            pass
+
+    def _watch(self):
+        reported = None
+        while not self._stop.wait(self.interval):
+            beat = self._heartbeat
+            blocked = time.monotonic() - beat - self.interval
+            if blocked < self.stall or reported == beat:
+                continue
+            # one stack per stall: the loop has not ticked since `beat`
+            reported = beat
+            frame = sys._current_frames().get(self._loop_thread)
+            stack = []
+            while frame is not None and len(stack) < 40:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            self.stalls.append({"at": time.time(), "blocked_ms": round(blocked * 1000, 1), "stack": stack})
+
+    def snapshot(self, window: float = 60) -> dict:
+        since = time.time() - window
+        lags = sorted(lag for ts, lag in list(self.samples) if ts >= since)
+
+        def pct(p):
+            return round(lags[min(len(lags) - 1, int(len(lags) * p))] * 1000, 2) if lags else None
+
+        return {
+            "interval_ms": self.interval * 1000,
+            "window_s": window,
+            "samples": len(lags),
+            "last_ms": round(self.samples[-1][1] * 1000, 2) if self.samples else None,
+            "p50_ms": pct(0.5),
+            "p99_ms": pct(0.99),
+            "max_ms": round(lags[-1] * 1000, 2) if lags else None,
+            "max_since_start_ms": round(self.max_lag * 1000, 2),
+            "stalls": list(self.stalls),
+        }
+
+
+# latency histogram buckets, in seconds (1 ms .. ~65 s, x2 steps)
+BUCKETS = [0.001 * 2 ** i for i in range(17)]
+
+
+class _RouteStats:
+    __slots__ = ("count", "errors", "total", "max", "hist")
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.hist = [0] * (len(BUCKETS) + 1)
+
+    def percentile(self, p: float) -> Optional[float]:
+        if not self.count:
+            return None
+        rank = p * self.count
+        seen = 0
+        for i, n in enumerate(self.hist):
+            seen += n
+            if seen >= rank:
+                return BUCKETS[i] if i < len(BUCKETS) else self.max
+        return self.max
+
+
+class RequestTimings:
+    def __init__(self):
+        self.routes: Dict[str, _RouteStats] = {}
+        self.since = time.time()
+        self._lock = threading.Lock()
+
+    def record(self, key: str, seconds: float, status: int):
+        with self._lock:
+            stats = self.routes.get(key)
+            if stats is None:
+                stats = self.routes[key] = _RouteStats()
+            stats.count += 1
+            stats.total += seconds
+            stats.max = max(stats.max, seconds)
+            stats.hist[bisect.bisect_left(BUCKETS, seconds)] += 1
+            if status >= 500:
+                stats.errors += 1
+
+    def reset(self):
+        with self._lock:
+            self.routes = {}
+            self.since = time.time()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            routes = {key: {
+                "count": s.count, "errors": s.errors,
+                "mean_ms": round(s.total / s.count * 1000, 2) if s.count else None,
+                "p50_ms_le": round(s.percentile(0.5) * 1000, 1) if s.count else None,
+                "p99_ms_le": round(s.percentile(0.99) * 1000, 1) if s.count else None,
+                "max_ms": round(s.max * 1000, 2),
+                "total_s": round(s.total, 3),
+            } for key, s in self.routes.items()}
+        ordered = dict(sorted(routes.items(), key=lambda item: -item[1]["total_s"]))
+        return {"since": self.since, "routes": ordered}
+
+
+class TimingMiddleware:
+    """Pure ASGI middleware (no BaseHTTPMiddleware, so streaming responses are not buffered)."""
+
+    def __init__(self, app, timings: "RequestTimings"):
+        self.app = app
+        self.timings = timings
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            key = f'{scope["method"]} {getattr(route, "path", None) or "<unmatched>"}'
+            self.timings.record(key, time.perf_counter() - started, status[0])
+
+
+profiler = SamplingProfiler()
+loop_lag = LoopLagMonitor()
+request_timings = RequestTimings()
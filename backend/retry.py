@@ -0,0 +1,258 @@
+# backend/retry.py
+"""
+Error-classified retries with a per-site circuit breaker.
+
+classify() sorts a yt_dlp failure into:
+  * "permanent"    private / removed / geo-blocked / unsupported: never retried
+  * "rate_limited" 429, "too many requests", bot checks: trips the site's breaker
+  * "transient"    timeouts, resets, 5xx and anything unrecognised: retried
+
+call_with_retry() retries transient and rate-limited failures with full-jitter
+exponential backoff. A rate-limited failure opens the breaker of the site
+(the yt-dlp extractor_key, e.g. "Youtube"; the host for generic URLs): every job for that site, queued or retrying, waits until the
+cooldown ends, then a single probe job goes through (half-open) and closes the
+breaker on success or reopens it with a doubled cooldown. Waiting jobs report the
+pause reason through their progress callback.
+
+    RETRY_MAX_ATTEMPTS=4  RETRY_BASE_SECONDS=2  RETRY_MAX_SECONDS=60
+    BREAKER_COOLDOWN_SECONDS=60  BREAKER_MAX_COOLDOWN_SECONDS=900
+"""
+
+import functools
+import math
+import os
+import random
+import re
+import sys
+import threading
+import time
+from typing import Callable, Dict, Optional
+from urllib.parse import urlparse
+
+RETRY_MAX_ATTEMPTS = int(os.environ.get("RETRY_MAX_ATTEMPTS", "4"))
+RETRY_BASE = float(os.environ.get("RETRY_BASE_SECONDS", "2"))
+RETRY_MAX = float(os.environ.get("RETRY_MAX_SECONDS", "60"))
+BREAKER_COOLDOWN = float(os.environ.get("BREAKER_COOLDOWN_SECONDS", "60"))
+BREAKER_MAX_COOLDOWN = float(os.environ.get("BREAKER_MAX_COOLDOWN_SECONDS", "900"))
+
+PERMANENT = "permanent"
+TRANSIENT = "transient"
+RATE_LIMITED = "rate_limited"
+
+PERMANENT_PATTERNS = re.compile(
+    r"private video|video unavailable|has been removed|no longer available|account .* terminated"
+    r"|not available in your country|geo.?restrict|unsupported url|is not a valid url"
+    r"|http error (400|401|403|404|410)\b|members[- ]only|join this channel|sign in to confirm your age"
+    r"|copyright|requested format is not available|download cancelled",
+    re.I,
+)
+RATE_LIMIT_PATTERNS = re.compile(
+    r"http error 429|too many requests|rate.?limit|confirm you.re not a bot|try again later",
+    re.I,
+)
+
+
+def classify(error: BaseException) -> str:
+    message = str(error)
+    if "yt_dlp.utils" in sys.modules:  # a yt_dlp error implies yt_dlp is loaded; never import it here
+        from yt_dlp.utils import GeoRestrictedError, UnsupportedError
+        cause = getattr(error, "exc_info", None)
+        inner = cause[1] if cause else error
+        if isinstance(inner, (GeoRestrictedError, UnsupportedError)):
+            return PERMANENT
+    if RATE_LIMIT_PATTERNS.search(message):
+        return RATE_LIMITED
+    if PERMANENT_PATTERNS.search(message):
+        return PERMANENT
+    return TRANSIENT
+
+
+def backoff(attempt: int, base: float = RETRY_BASE, cap: float = RETRY_MAX) -> float:
+    """Full-jitter exponential backoff: uniform(0, min(cap, base * 2^attempt))."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def _extractor_key(url: str) -> Optional[str]:
+    # checked outside the cache: a miss before yt_dlp is loaded must not stick for the process
+    if "yt_dlp.extractor" not in sys.modules:  # only ever called from jobs that already loaded yt_dlp
+        return None
+    return _matching_extractor(url)
+
+
+@functools.lru_cache(maxsize=4096)
+def _matching_extractor(url: str) -> Optional[str]:
+    from yt_dlp.extractor import gen_extractor_classes
+    for ie in gen_extractor_classes():
+        if ie.suitable(url):
+            return ie.ie_key()
+    return None
+
+
+def site_of(url: str) -> str:
+    """
+    Breaker key: the extractor_key yt-dlp reports for `url` ("Youtube", "BBC", ...), so sites
+    sharing a public suffix (bbc.co.uk, itv.co.uk) never share a breaker. Generic URLs are
+    keyed by their full host name.
+    """
+    key = _extractor_key(url)
+    if key and key != "Generic":
+        return key
+    host = (urlparse(url).hostname or "").lower()
+    return host[4:] if host.startswith("www.") else host or "unknown"
+
+
+class CircuitOpen(Exception):
+    def __init__(self, site: str, reason: str, retry_after: float):
+        super().__init__(f"{site} is paused ({reason}); retry in {int(retry_after)}s")
+        self.site = site
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class _Breaker:
+    def __init__(self):
+        self.state = "closed"
+        self.reason = ""
+        self.opened_at = 0.0
+        self.cooldown = BREAKER_COOLDOWN
+        self.trips = 0
+        self.probing = False
+
+
+class CircuitBreakers:
+    def __init__(self):
+        self._sites: Dict[str, _Breaker] = {}
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+
+    def _get(self, site: str) -> _Breaker:
+        breaker = self._sites.get(site)
+        if breaker is None:
+            breaker = self._sites[site] = _Breaker()
+        return breaker
+
+    def _retry_after(self, breaker: _Breaker) -> float:
+        return max(0.0, breaker.opened_at + breaker.cooldown - time.monotonic())
+
+    def acquire(self, site: str, cancel_event: Optional[threading.Event] = None,
+                on_wait: Optional[Callable[[dict], None]] = None, block: bool = True):
+        """
+        Wait until jobs for `site` may run. While the breaker is open this blocks (or
+        raises CircuitOpen with block=False); after the cooldown one caller becomes the
+        half-open probe and the others keep waiting for its outcome.
+        """
+        notified = False
+        with self._lock:
+            while True:
+                breaker = self._get(site)
+                if breaker.state == "closed":
+                    return
+                remaining = self._retry_after(breaker)
+                if remaining <= 0 and not breaker.probing:
+                    breaker.state = "half_open"
+                    breaker.probing = True
+                    return
+                if not block:
+                    raise CircuitOpen(site, breaker.reason, remaining)
+                if cancel_event is not None and cancel_event.is_set():
+                    raise Exception("Download cancelled")
+                if on_wait and not notified:
+                    notified = True
+                    on_wait({"site": site, "reason": breaker.reason, "retry_after": math.ceil(remaining)})
+                self._changed.wait(timeout=min(max(remaining, 0.5), 1.0))
+
+    def success(self, site: str):
+        with self._lock:
+            breaker = self._get(site)
+            if breaker.state != "closed":
+                breaker.state = "closed"
+                breaker.cooldown = BREAKER_COOLDOWN
+                self._changed.notify_all()
+            breaker.probing = False
+
+    def trip(self, site: str, reason: str):
+        """Open the breaker (a rate-limited failure); a failed probe doubles the cooldown."""
+        with self._lock:
+            breaker = self._get(site)
+            if breaker.state == "half_open":
+                breaker.cooldown = min(breaker.cooldown * 2, BREAKER_MAX_COOLDOWN)
+            elif breaker.state == "open":
+                return
+            breaker.state = "open"
+            breaker.reason = reason
+            breaker.opened_at = time.monotonic()
+            breaker.trips += 1
+            breaker.probing = False
+            print(f"[retry] {site} paused for {int(breaker.cooldown)}s: {reason}")
+
+    def release(self, site: str):
+        """
+        Give up a half-open probe slot without a verdict (a transient or permanent error).
+        The breaker stays open with its cooldown already served, so the next waiter becomes
+        the probe; only success() closes it.
+        """
+        with self._lock:
+            breaker = self._get(site)
+            if breaker.state == "half_open":
+                breaker.state = "open"
+                breaker.probing = False
+                self._changed.notify_all()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {site: {"state": b.state, "reason": b.reason, "trips": b.trips,
+                           "cooldown": int(b.cooldown),
+                           "retry_after": int(self._retry_after(b)) if b.state == "open" else 0}
+                    for site, b in self._sites.items()}
+
+
+breakers = CircuitBreakers()
+
+
+def call_with_retry(fn: Callable, url: str, cancel_event: Optional[threading.Event] = None,
+                    progress_callback: Optional[Callable[[dict], None]] = None,
+                    max_attempts: int = RETRY_MAX_ATTEMPTS, block: bool = True, site: Optional[str] = None):
+    """
+    Run `fn()` for a job on `url`, retrying by error class. `site` is the breaker key when
+    already known (an extracted info dict's extractor_key). Breaker waits and retry notices
+    go to `progress_callback` as {'status': 'waiting' | 'retrying', ...}. The last error is
+    re-raised with its class in `error.error_class`.
+    """
+    if not site or site == "Generic":
+        site = site_of(url)
+
+    def on_wait(info: dict):
+        if progress_callback:
+            progress_callback({"status": "waiting",
+                               "message": f"{info['site']} is rate limiting; waiting {info['retry_after']}s",
+                               "site_paused": info})
+
+    attempt = 0
+    while True:
+        breakers.acquire(site, cancel_event, on_wait, block=block)
+        try:
+            result = fn()
+        except Exception as e:
+            kind = classify(e)
+            e.error_class = kind
+            if kind == RATE_LIMITED:
+                breakers.trip(site, str(e).splitlines()[0][:200])
+            else:
+                breakers.release(site)
+            attempt += 1
+            if kind == PERMANENT or attempt >= max_attempts or (cancel_event is not None and cancel_event.is_set()):
+                raise
+            if kind == TRANSIENT:
+                delay = backoff(attempt)
+                if progress_callback:
+                    progress_callback({"status": "retrying", "attempt": attempt, "delay": round(delay, 1),
+                                       "error": str(e), "error_class": kind})
+                if cancel_event is not None:
+                    if cancel_event.wait(delay):
+                        raise
+                else:
+                    time.sleep(delay)
+            # rate limited: the next acquire() waits out the breaker cooldown
+            continue
+        breakers.success(site)
+        return result
@@ -0,0 +1,158 @@
+# backend/startup.py
+"""
+Startup timing and lazily imported heavy dependencies.
+
+yt_dlp (hundreds of extractor modules) and libtorrent are the bulk of the
+server's import time and memory. Modules that need them bind a LazyModule
+instead of importing at module level:
+
+    yt_dlp = lazy_module("yt_dlp")      # imported on first attribute access
+    ydl = yt_dlp.YoutubeDL(opts)
+
+so a server (or worker) that never extracts or never touches torrents never
+pays for them. With STARTUP_WARMUP set, a background thread imports them right
+after the server starts accepting requests, so the first real request does not
+wait either:
+
+    STARTUP_WARMUP=""            off (default) | all | yt_dlp,libtorrent
+    STARTUP_WARMUP_DELAY=1       seconds after startup before warming up
+
+report() (GET /admin/startup) lists how long importing main took, each
+startup phase in the app lifespan, when and by which thread every lazy module
+was imported and how long that took.
+"""
+
+import importlib
+import os
+import sys
+import threading
+import time
+import types
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+# taken when main.py starts importing (this module is its first import)
+IMPORT_STARTED = time.perf_counter()
+
+STARTUP_WARMUP = os.environ.get("STARTUP_WARMUP", "")
+STARTUP_WARMUP_DELAY = float(os.environ.get("STARTUP_WARMUP_DELAY", "1"))
+
+_phases: List[dict] = []
+_imports: Dict[str, dict] = {}
+_import_lock = threading.Lock()
+_ready_at: Optional[float] = None
+_warmers: Dict[str, callable] = {}
+
+
+def _since_start(t: float) -> float:
+    return round((t - IMPORT_STARTED) * 1000, 1)
+
+
+def mark(name: str, started: float = IMPORT_STARTED):
+    """Record a phase that began at `started` (perf_counter) and ends now."""
+    now = time.perf_counter()
+    _phases.append({"phase": name, "ms": round((now - started) * 1000, 1), "at_ms": _since_start(now)})
+
+
+@contextmanager
+def phase(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        mark(name, started)
+
+
+def ready():
+    """The app finished its startup phases and is about to accept requests."""
+    global _ready_at
+    _ready_at = time.perf_counter()
+
+
+def load(name: str):
+    """Import `name` once, recording how long it took and which thread asked for it."""
+    module = sys.modules.get(name)
+    if module is not None and name in _imports:
+        return module
+    with _import_lock:
+        if name not in _imports:
+            started = time.perf_counter()
+            before = len(sys.modules)
+            module = importlib.import_module(name)
+            _imports[name] = {
+                "ms": round((time.perf_counter() - started) * 1000, 1),
+                "at_ms": _since_start(started),
+                "thread": threading.current_thread().name,
+                "modules": len(sys.modules) - before,
+            }
+        return sys.modules[name]
+
+
+class LazyModule(types.ModuleType):
+    """Stand-in for a module that is imported on first attribute access."""
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self._lazy_name = name
+
+    def __getattr__(self, attr: str):
+        value = getattr(load(self._lazy_name), attr)
+        setattr(self, attr, value)  # later lookups skip __getattr__
+        return value
+
+    @property
+    def loaded(self) -> bool:
+        return self._lazy_name in _imports
+
+
+def lazy_module(name: str) -> LazyModule:
+    return LazyModule(name)
+
+
+def register_warmup(name: str, fn):
+    """`fn` runs on the warm-up thread when STARTUP_WARMUP selects `name`."""
+    _warmers[name] = fn
+
+
+def _selected_warmups() -> List[str]:
+    wanted = {w.strip() for w in STARTUP_WARMUP.split(",") if w.strip()}
+    if wanted & {"all", "1", "true"}:
+        return list(_warmers)
+    return [name for name in _warmers if name in wanted]
+
+
+def warm_up():
+    for name in _selected_warmups():
+        started = time.perf_counter()
+        try:
+            _warmers[name]()
+            mark(f"warmup:{name}", started)
+        except Exception as e:
+            print(f"[startup] warm-up of {name} failed: {e}")
+
+
+def schedule_warmup(loop):
+    """Start warm-up on a background thread once the server has been accepting requests for a moment."""
+    if not _selected_warmups():
+        return
+    loop.call_later(STARTUP_WARMUP_DELAY,
+                    lambda: threading.Thread(target=warm_up, daemon=True, name="warmup").start())
+
+
+def _rss_mb() -> Optional[float]:
+    try:
+        with open("/proc/self/statm") as fh:
+            return round(int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20, 1)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def report() -> dict:
+    return {
+        "ready_ms": _since_start(_ready_at) if _ready_at else None,
+        "phases": list(_phases),
+        "lazy_imports": {name: _imports.get(name) for name in sorted(set(_warmers) | set(_imports))},
+        "warmup": _selected_warmups(),
+        "modules_loaded": len(sys.modules),
+        "rss_mb": _rss_mb(),
+    }
@@ -0,0 +1,271 @@
+# backend/thumbnails.py
+"""
+Thumbnail proxy with an on-disk, content-addressed cache.
+
+Each upstream image is fetched once. Its bytes are stored under their blake2b
+hash, and resized variants (width x format) are derived from that original and
+stored next to it, so the same picture reached through different URLs (video
+page, CDN link with other query params) is kept once. A small ref file maps
+each requested URL (image URL or video page URL) to the content hash, so repeat
+requests never go upstream nor run extraction again.
+
+The cache is bounded: when it grows past THUMB_CACHE_MAX bytes, the least
+recently used files (mtime is bumped on every hit) are evicted.
+
+Only public http(s) hosts are fetched: every URL (and every redirect hop) whose
+host resolves to a loopback, private, link-local or otherwise reserved address is
+refused, so the proxy cannot be pointed at the machine or its network.
+
+Resizing and WebP/JPEG encoding use Pillow (in requirements.txt); without it the
+original image is served unchanged.
+
+    THUMB_CACHE_DIR=<backend>/thumb_cache   THUMB_CACHE_MAX=200M
+"""
+
+import hashlib
+import io
+import ipaddress
+import os
+import re
+import socket
+import threading
+from pathlib import Path
+from typing import Callable, Optional, Tuple
+from urllib.parse import urljoin, urlparse, parse_qs
+
+from bandwidth import parse_rate
+from direct_downloader import get_session
+
+try:
+    from PIL import Image
+except ImportError:  # optional: serve originals without resizing
+    Image = None
+
+THUMB_CACHE_DIR = Path(os.environ.get("THUMB_CACHE_DIR", Path(__file__).parent / "thumb_cache"))
+THUMB_CACHE_MAX = parse_rate(os.environ.get("THUMB_CACHE_MAX", "200M"))
+MAX_SOURCE_BYTES = 10 * 1024 * 1024
+ALLOWED_WIDTHS = (120, 160, 240, 320, 480, 640, 1280)
+FORMATS = {"webp": ("WEBP", "image/webp"), "jpeg": ("JPEG", "image/jpeg")}
+CONTENT_TYPES = {b"\xff\xd8": "image/jpeg", b"\x89P": "image/png", b"RI": "image/webp", b"GI": "image/gif"}
+MAX_REDIRECTS = 5
+
+
+def _digest(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def check_public_url(url: str):
+    """Raise PermissionError unless `url` is http(s) on a host with only public addresses."""
+    parsed = urlparse(url)
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        raise PermissionError(f"not an http(s) url: {url[:100]}")
+    try:
+        infos = socket.getaddrinfo(parsed.hostname, parsed.port or 443, proto=socket.IPPROTO_TCP)
+    except (socket.gaierror, UnicodeError) as e:
+        raise LookupError(f"cannot resolve {parsed.hostname}: {e}")
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0].split("%")[0])
+        if not address.is_global or address.is_multicast:
+            raise PermissionError(f"{parsed.hostname} resolves to a non-public address")
+
+
+def youtube_thumbnail(url: str) -> Optional[str]:
+    """Thumbnail URL for a YouTube video page without running extraction."""
+    parsed = urlparse(url)
+    host = (parsed.hostname or "").lower()
+    video_id = None
+    if host == "youtu.be":
+        video_id = parsed.path.lstrip("/").split("/")[0]
+    elif host.endswith("youtube.com"):
+        if parsed.path == "/watch":
+            video_id = (parse_qs(parsed.query).get("v") or [None])[0]
+        else:
+            m = re.match(r"/(?:shorts|embed|live)/([\w-]+)", parsed.path)
+            video_id = m.group(1) if m else None
+    return f"https://i.ytimg.com/vi/{video_id}/hqdefault.jpg" if video_id else None
+
+
+def snap_width(width: Optional[int]) -> Optional[int]:
+    """Round a requested width up to one of the cached sizes (bounds the variant count)."""
+    if not width:
+        return None
+    for allowed in ALLOWED_WIDTHS:
+        if width <= allowed:
+            return allowed
+    return ALLOWED_WIDTHS[-1]
+
+
+class ThumbnailCache:
+    def __init__(self, root: Path = THUMB_CACHE_DIR, max_bytes: int = THUMB_CACHE_MAX):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self._size: Optional[int] = None
+        self._lock = threading.Lock()
+        self._fetch_locks: dict = {}
+
+    # --- layout ---
+    def _ref_path(self, src: str) -> Path:
+        key = _digest(src.encode())
+        return self.root / "refs" / key[:2] / key
+
+    def _blob_path(self, digest: str, variant: str = "orig") -> Path:
+        return self.root / "blobs" / digest[:2] / f"{digest}.{variant}"
+
+    # --- public ---
+    def get(self, key: str, width: Optional[int] = None, fmt: str = "webp",
+            resolve: Optional[Callable[[], Optional[str]]] = None) -> Tuple[Path, str, str]:
+        """
+        Return (path, content type, etag) of the image for `key` at `width` in `fmt`,
+        fetching and resizing on a miss. `key` is the image URL itself, or a page URL
+        with `resolve` returning its image URL (only called on a miss).
+        Blocking; call from a worker thread.
+        """
+        width = snap_width(width)
+        fmt = fmt if fmt in FORMATS else "webp"
+        digest = self._original(key, resolve)
+        if Image is None or not width:
+            path = self._blob_path(digest)
+            return self._touch(path), self._sniff(path), f'"{digest}"'
+
+        variant = f"w{width}.{fmt}"
+        path = self._blob_path(digest, variant)
+        if not path.exists():
+            try:
+                data = self._resize(self._blob_path(digest).read_bytes(), width, fmt)
+            except OSError:
+                # not decodable (cached before content types were checked): refetch next time
+                for stale in (self._ref_path(key), self._blob_path(digest)):
+                    try:
+                        stale.unlink()
+                    except OSError:
+                        pass
+                raise
+            self._write(path, data)
+        return self._touch(path), FORMATS[fmt][1], f'"{digest}-{variant}"'
+
+    def _original(self, key: str, resolve=None) -> str:
+        ref = self._ref_path(key)
+        try:
+            digest = ref.read_text().strip()
+            if self._blob_path(digest).exists():
+                return digest
+        except OSError:
+            pass
+        # one upstream fetch per url, however many cards ask at once
+        with self._lock:
+            lock = self._fetch_locks.setdefault(key, threading.Lock())
+        try:
+            with lock:
+                return self._fetch(key, ref, resolve)
+        finally:
+            with self._lock:
+                self._fetch_locks.pop(key, None)
+
+    def _fetch(self, key: str, ref: Path, resolve) -> str:
+        try:
+            digest = ref.read_text().strip()
+            if self._blob_path(digest).exists():
+                return digest
+        except OSError:
+            pass
+        src = resolve() if resolve else key
+        if not src:
+            raise LookupError("no thumbnail")
+        with self._open(src) as resp:
+            resp.raise_for_status()
+            # an HTML error page cached as an image would fail in Image.open on every request
+            content_type = resp.headers.get("Content-Type", "").split(";")[0].strip().lower()
+            if not content_type.startswith("image/"):
+                raise LookupError(f"not an image: {content_type or 'no content type'}")
+            if int(resp.headers.get("Content-Length") or 0) > MAX_SOURCE_BYTES:
+                raise ValueError("thumbnail too large")
+            data = bytearray()
+            for chunk in resp.iter_content(64 * 1024):
+                data += chunk
+                if len(data) > MAX_SOURCE_BYTES:
+                    raise ValueError("thumbnail too large")
+        data = bytes(data)
+        digest = _digest(data)
+        blob = self._blob_path(digest)
+        if not blob.exists():
+            self._write(blob, data)
+        self._write(ref, digest.encode())
+        return digest
+
+    def _open(self, src: str):
+        """GET `src` following redirects by hand so each hop is checked before it is requested."""
+        for _ in range(MAX_REDIRECTS + 1):
+            check_public_url(src)
+            resp = get_session().get(src, timeout=15, stream=True, allow_redirects=False)
+            if not resp.is_redirect:
+                return resp
+            resp.close()
+            src = urljoin(src, resp.headers["Location"])
+        raise LookupError("too many redirects")
+
+    def _resize(self, data: bytes, width: int, fmt: str) -> bytes:
+        image = Image.open(io.BytesIO(data))
+        if image.width > width:
+            height = max(1, round(image.height * width / image.width))
+            image = image.resize((width, height), Image.LANCZOS)
+        if image.mode not in ("RGB", "RGBA") or fmt == "jpeg":
+            image = image.convert("RGB")
+        out = io.BytesIO()
+        if fmt == "webp":
+            image.save(out, "WEBP", quality=80, method=4)
+        else:
+            image.save(out, "JPEG", quality=82, optimize=True, progressive=True)
+        return out.getvalue()
+
+    def _sniff(self, path: Path) -> str:
+        with open(path, "rb") as fh:
+            return CONTENT_TYPES.get(fh.read(2), "application/octet-stream")
+
+    # --- storage / LRU ---
+    def _write(self, path: Path, data: bytes):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + f".{threading.get_ident()}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+        with self._lock:
+            if self._size is not None:
+                self._size += len(data)
+        self._maybe_evict()
+
+    def _touch(self, path: Path) -> Path:
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return path
+
+    def _files(self):
+        for path in self.root.rglob("*"):
+            if path.is_file() and not path.name.endswith(".tmp"):
+                yield path, path.stat()
+
+    def _maybe_evict(self):
+        with self._lock:
+            if self._size is None:
+                self._size = sum(st.st_size for _, st in self._files())
+            if self._size <= self.max_bytes:
+                return
+            # evict down to 90% so every write near the limit does not rescan
+            files = sorted(self._files(), key=lambda item: item[1].st_mtime)
+            target = self.max_bytes * 0.9
+            for path, st in files:
+                if self._size <= target:
+                    break
+                try:
+                    path.unlink()
+                    self._size -= st.st_size
+                except OSError:
+                    pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = self._size
+        return {"dir": str(self.root), "max_bytes": self.max_bytes, "size": size, "resize": Image is not None}
+
+
+thumbnail_cache = ThumbnailCache()
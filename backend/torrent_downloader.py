@@ -1,8 +1,16 @@
-import libtorrent as lt
 import time
 import threading
 from pathlib import Path
-from typing import Callable
+from typing import Callable, Dict, List, Optional
+
+from bandwidth import bandwidth_manager
+from admission import admission, DiskFull, format_bytes
+from checksum import TailHasher
+from startup import lazy_module, register_warmup
+
+# imported on first use: servers that never add a torrent never load libtorrent
+lt = lazy_module("libtorrent")
+register_warmup("libtorrent", lambda: lt.version)
 
 # Extended list of high-stability public trackers
 BEST_TRACKERS = [
@@ -57,8 +65,8 @@ class TorrentDownloader:
             'max_queued_disk_bytes': 100 * 1024 * 1024,
             'send_buffer_low_watermark': 20 * 1024,
             'send_buffer_watermark': 1024 * 1024,
-            'download_rate_limit': 0,
-            'upload_rate_limit': 1024 * 1024,
+            'download_rate_limit': 0,  # per-handle limits come from the bandwidth manager
+            'upload_rate_limit': bandwidth_manager.upload_limit,
             'tick_interval': 100,
             'inactivity_timeout': 120,
             'unchoke_slots_limit': 100,
@@ -68,6 +76,9 @@ class TorrentDownloader:
         }
         
         self.session.apply_settings(settings)
+        bandwidth_manager.on_upload_limit(
+            lambda limit: self.session.apply_settings({'upload_rate_limit': limit})
+        )
         self.session.listen_on(40000, 60000)
         
         dht_routers = [
@@ -83,8 +94,14 @@ class TorrentDownloader:
         self.session.start_dht()
         self.handles = {}
         self.cancel_events = {}
+        self.delete_files = set()
+        self.paused = set()
+        self.checksums: Dict[str, str] = {}         # torrent id -> content hash algorithm
+        self.hashers: Dict[str, List[tuple]] = {}   # torrent id -> [(relative path, TailHasher)]
 
-    def add_torrent(self, torrent_id: str, magnet: str, callback: Callable):
+    def add_torrent(self, torrent_id: str, magnet: str, callback: Callable, weight: float = 1.0,
+                    checksum: Optional[str] = None):
+        """`checksum` (checksum.resolve_algorithm) hashes every file's content as its pieces complete."""
         # ✅ FIXED: Use add_torrent_params object (compatible with all libtorrent versions)
         params = lt.add_torrent_params()
         params.save_path = str(self.download_dir)
@@ -93,6 +110,8 @@ class TorrentDownloader:
         try:
             params = lt.parse_magnet_uri(magnet)
             params.save_path = str(self.download_dir)
+            # allocate the files up front: less fragmentation, no ENOSPC halfway through
+            params.storage_mode = lt.storage_mode_t.storage_mode_allocate
         except Exception as e:
             print(f"[Torrent Error] Failed to parse magnet: {e}")
             raise e
@@ -116,9 +135,11 @@ class TorrentDownloader:
         handle.force_reannounce()
         handle.force_dht_announce()
         
-        # Set per-torrent speed limits (unlimited download, 1MB/s upload)
-        handle.set_download_limit(0)
-        handle.set_upload_limit(1024 * 1024)
+        # Per-torrent speed limits driven by the global bandwidth manager
+        handle.set_upload_limit(bandwidth_manager.upload_limit)
+        handle.set_download_limit(
+            bandwidth_manager.register(f"torrent_{torrent_id}", "torrent", handle.set_download_limit, weight)
+        )
         
         # Set max connections per torrent
         handle.set_max_connections(1000)
@@ -126,6 +147,8 @@ class TorrentDownloader:
         
         self.handles[torrent_id] = handle
         self.cancel_events[torrent_id] = threading.Event()
+        if checksum:
+            self.checksums[torrent_id] = checksum
         
         threading.Thread(
             target=self._monitor,
@@ -140,8 +163,12 @@ class TorrentDownloader:
         attempts = 0
         while not handle.has_metadata():
             if self.cancel_events[torrent_id].is_set():
+                self._remove(torrent_id, handle)
                 callback({"status": "cancelled"})
                 return
+            if torrent_id in self.paused:
+                time.sleep(0.3)
+                continue
             
             attempts += 1
             if attempts % 10 == 0:
@@ -159,16 +186,57 @@ class TorrentDownloader:
             "num_files": info.num_files()
         })
         
+        # Admission: the size is only known now; hold the torrent until it fits on disk
+        def on_disk_wait(state):
+            handle.pause()
+            callback({
+                "status": "waiting",
+                "message": f"Waiting for disk space: {format_bytes(state['needed'])} needed, "
+                           f"{format_bytes(state['available'])} available",
+                "disk_wait": state,
+            })
+        try:
+            admission.acquire(f"torrent_{torrent_id}", str(self.download_dir), info.total_size(),
+                              self.cancel_events[torrent_id], on_disk_wait)
+        except DiskFull as e:
+            self._remove(torrent_id, handle)
+            callback({"status": "error", "error": str(e), "error_class": "permanent"})
+            return
+        except Exception:
+            self._remove(torrent_id, handle)
+            callback({"status": "cancelled"})
+            return
+        if torrent_id not in self.paused:
+            handle.resume()
+        
+        algorithm = self.checksums.get(torrent_id)
+        contiguous: Dict[int, int] = {}
+        if algorithm:
+            self._start_hashers(torrent_id, info, algorithm, contiguous)
+        
         # Download Phase
+        reported_pause = False
         while not handle.is_seed():
             if self.cancel_events[torrent_id].is_set():
-                self.session.remove_torrent(handle)
-                if torrent_id in self.handles:
-                    del self.handles[torrent_id]
+                self._remove(torrent_id, handle)
                 callback({"status": "cancelled"})
                 return
             
-            s = handle.status()
+            if torrent_id in self.paused:
+                # data stays on disk; libtorrent picks up from its pieces on resume
+                if not reported_pause:
+                    bandwidth_manager.report(f"torrent_{torrent_id}", 0)
+                    callback({"status": "paused"})
+                    reported_pause = True
+                time.sleep(0.5)
+                continue
+            reported_pause = False
+            
+            s = handle.status(lt.status_flags_t.query_pieces) if algorithm else handle.status()
+            if algorithm:
+                contiguous.update(self._contiguous_bytes(info, s.pieces))
+            bandwidth_manager.report(f"torrent_{torrent_id}", s.download_rate)
+            admission.update(f"torrent_{torrent_id}", s.total_wanted_done)
             
             eta = 0
             if s.download_rate > 0:
@@ -189,15 +257,26 @@ class TorrentDownloader:
             time.sleep(0.5)
         
         # Finished
+        bandwidth_manager.unregister(f"torrent_{torrent_id}")
+        admission.release(f"torrent_{torrent_id}")
         final_name = info.name()
         save_path = self.download_dir / final_name
 
-        # Normal finished callback
-        callback({
+        # Normal finished callback. The infohash identifies the torrent; with the checksum
+        # option the content hashes (streamed as pieces completed) match those of other jobs
+        finished = {
             "status": "finished",
             "save_path": str(save_path),
-            "name": final_name
-        })
+            "name": final_name,
+            "infohash": str(handle.info_hash()),
+        }
+        if algorithm:
+            checksums = {path: hasher.finish(str(self.download_dir / path))
+                         for path, hasher in self.hashers.pop(torrent_id, [])}
+            finished["checksums"] = checksums
+            if len(checksums) == 1:
+                finished["checksum"] = next(iter(checksums.values()))
+        callback(finished)
 
         # 🔥 EXTRA EVENT → triggers toast popup in frontend
         callback({
@@ -209,11 +288,79 @@ class TorrentDownloader:
         print(f"[✔] Torrent finished: {torrent_id}")
 
 
-    def cancel_torrent(self, torrent_id: str):
+    def _start_hashers(self, torrent_id: str, info, algorithm: str, contiguous: Dict[int, int]):
+        """One TailHasher per file, reading up to the file's contiguous run of completed pieces."""
+        files = info.files()
+        pad_flag = getattr(getattr(lt, "file_storage", None), "flag_pad_file", 0)
+        hashers = []
+        for i in range(files.num_files()):
+            if pad_flag and files.file_flags(i) & pad_flag:
+                continue
+            path = files.file_path(i)
+            contiguous[i] = 0
+            hashers.append((path, TailHasher(str(self.download_dir / path), algorithm,
+                                             available=lambda i=i: contiguous.get(i, 0)).start()))
+        self.hashers[torrent_id] = hashers
+
+    @staticmethod
+    def _contiguous_bytes(info, pieces) -> Dict[int, int]:
+        """Per file: bytes from its start that lie in completed (hash-checked) pieces."""
+        files = info.files()
+        piece_length = info.piece_length()
+        total = info.total_size()
+        out = {}
+        for i in range(files.num_files()):
+            offset, size = files.file_offset(i), files.file_size(i)
+            piece = offset // piece_length
+            while piece < len(pieces) and pieces[piece] and piece * piece_length < offset + size:
+                piece += 1
+            covered = min(piece * piece_length, total)
+            out[i] = max(0, min(size, covered - offset))
+        return out
+
+    def _remove(self, torrent_id: str, handle):
+        """Drop a cancelled torrent from the session (with its files when cleanup was asked for)."""
+        for _, hasher in self.hashers.pop(torrent_id, []):
+            hasher.close()
+        self.checksums.pop(torrent_id, None)
+        if torrent_id in self.delete_files:
+            self.session.remove_torrent(handle, lt.options_t.delete_files)
+            self.delete_files.discard(torrent_id)
+        else:
+            self.session.remove_torrent(handle)
+        self.handles.pop(torrent_id, None)
+        self.paused.discard(torrent_id)
+        bandwidth_manager.unregister(f"torrent_{torrent_id}")
+        admission.release(f"torrent_{torrent_id}")
+
+    def cancel_torrent(self, torrent_id: str, delete_files: bool = False):
         if torrent_id in self.cancel_events:
+            if delete_files:
+                self.delete_files.add(torrent_id)
             self.cancel_events[torrent_id].set()
         return {"status": "cancelling"}
 
+    def pause_torrent(self, torrent_id: str):
+        handle = self.handles.get(torrent_id)
+        if handle is None:
+            return {"error": "not found"}
+        try:
+            # a managed torrent would be resumed by the session queue
+            handle.unset_flags(lt.torrent_flags.auto_managed)
+        except AttributeError:
+            handle.auto_managed(False)
+        handle.pause()
+        self.paused.add(torrent_id)
+        return {"status": "paused"}
+
+    def resume_torrent(self, torrent_id: str):
+        handle = self.handles.get(torrent_id)
+        if handle is None:
+            return {"error": "not found"}
+        self.paused.discard(torrent_id)
+        handle.resume()
+        return {"status": "resumed"}
+
     def get_status(self, torrent_id: str):
         if torrent_id not in self.handles:
             return {"error": "not found"}
@@ -0,0 +1,320 @@
+# backend/ws_manager.py
+"""
+WebSocket fan-out for job progress.
+
+Two kinds of clients are served:
+  * legacy per-id sockets (/ws/{client_id}, /ws/torrent_{id}) that receive every
+    message for one job as plain JSON;
+  * multiplexed sockets (/ws) that subscribe to many job ids over one connection.
+    Frames carry the job id, can be msgpack-encoded (binary) instead of JSON and,
+    with delta encoding, only contain the fields that changed since the previous
+    frame for that job.
+
+Multiplexed frame shapes:
+    {"id": <job>, "t": "full", ...all fields}
+    {"id": <job>, "t": "delta", ...changed fields, "unset": [removed keys]}
+A full frame is sent for the first message of a job and whenever its status changes.
+
+Each job id is a channel with any number of subscribers and a small replay buffer
+(recent state changes + latest progress) that is sent to every new subscriber.
+
+Every connection owns a bounded outbound queue drained by its own writer task, so
+publishing never waits on a socket. Progress messages for a job that has not been
+sent yet are replaced by the newer one (same queue position); state changes
+(metadata, finished, error, ...) are never merged or dropped. A client whose queue
+stays over the limit for longer than the grace period, or whose socket stalls a
+send, is disconnected.
+"""
+
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Optional, Set
+
+from fastapi import WebSocket
+
+try:
+    import msgpack
+except ImportError:  # in requirements.txt; without it binary framing falls back to JSON
+    msgpack = None
+
+WS_MAX_PENDING = int(os.environ.get("WS_MAX_PENDING", "256"))
+WS_SLOW_GRACE = float(os.environ.get("WS_SLOW_GRACE_SECONDS", "10"))
+WS_SEND_TIMEOUT = float(os.environ.get("WS_SEND_TIMEOUT_SECONDS", "10"))
+WS_REPLAY_STATES = int(os.environ.get("WS_REPLAY_STATES", "16"))
+WS_REPLAY_CHANNELS = int(os.environ.get("WS_REPLAY_CHANNELS", "5000"))
+
+# statuses whose messages are superseded by the next one of the same job
+PROGRESS_STATUSES = {"downloading", "fetching_metadata", "processing"}
+
+
+def is_progress(message: dict) -> bool:
+    return message.get("status") in PROGRESS_STATUSES and "event" not in message
+
+
+class Connection:
+    """A websocket plus its outbound queue and writer task."""
+
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.closed = False
+        self.subscriptions: Set[str] = set()
+        self._pending: "OrderedDict[tuple, dict]" = OrderedDict()
+        self._epochs: Dict[str, int] = {}
+        self._seq = 0
+        self._wakeup = asyncio.Event()
+        self._over_since: Optional[float] = None
+        self._writer: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._writer = asyncio.ensure_future(self._run())
+
+    @property
+    def backlog(self) -> int:
+        return len(self._pending)
+
+    def enqueue(self, id: Optional[str], message: dict):
+        """Queue a message (event-loop thread only)."""
+        if self.closed:
+            return
+        if id is not None and is_progress(message):
+            # progress for the same job since its last state change collapses into one slot
+            key = ("progress", id, self._epochs.get(id, 0))
+        else:
+            if id is not None:
+                self._epochs[id] = self._epochs.get(id, 0) + 1
+            self._seq += 1
+            key = ("state", id, self._seq)
+        self._pending[key] = message
+        self._check_backlog()
+        self._wakeup.set()
+
+    def enqueue_control(self, frame: dict):
+        self.enqueue(None, frame)
+
+    def _check_backlog(self):
+        if len(self._pending) <= WS_MAX_PENDING:
+            self._over_since = None
+            return
+        now = time.monotonic()
+        if self._over_since is None:
+            self._over_since = now
+        elif now - self._over_since > WS_SLOW_GRACE:
+            self.abort("slow consumer")
+
+    def abort(self, reason: str):
+        if self.closed:
+            return
+        self.closed = True
+        print(f"[ws] closing connection: {reason} (backlog {len(self._pending)})")
+        self._pending.clear()
+        if self._writer and self._writer is not asyncio.current_task():
+            self._writer.cancel()
+        asyncio.ensure_future(self._close_socket())
+
+    async def _close_socket(self):
+        try:
+            await self.websocket.close(code=1013)
+        except Exception:
+            pass
+
+    async def close(self):
+        self.closed = True
+        self._wakeup.set()
+        if self._writer:
+            self._writer.cancel()
+
+    async def _run(self):
+        try:
+            while not self.closed:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                while self._pending and not self.closed:
+                    (kind, id, _), message = self._pending.popitem(last=False)
+                    try:
+                        await asyncio.wait_for(self.deliver(id, message), WS_SEND_TIMEOUT)
+                    except asyncio.TimeoutError:
+                        self.abort("send stalled")
+                        return
+                    except Exception as e:
+                        # swallow errors (client may have disconnected)
+                        print(f"[ws send error] {e}")
+                    if len(self._pending) <= WS_MAX_PENDING:
+                        self._over_since = None
+        except asyncio.CancelledError:
+            pass
+
+    def forget(self, id: str):
+        pass
+
+    async def deliver(self, id: Optional[str], message: dict):
+        await self.websocket.send_json(message)
+
+
+class MuxClient(Connection):
+    """One multiplexed connection: its subscriptions, framing and delta state."""
+
+    def __init__(self, websocket: WebSocket, binary: bool = False, delta: bool = True):
+        super().__init__(websocket)
+        self.binary = bool(binary and msgpack is not None)
+        self.delta = delta
+        self._last: Dict[str, dict] = {}
+
+    @property
+    def format(self) -> str:
+        return "msgpack" if self.binary else "json"
+
+    def decode(self, message: dict) -> Optional[dict]:
+        """Decode an inbound control frame from a receive() message."""
+        if message.get("bytes") is not None:
+            if msgpack is None:
+                return None
+            return msgpack.unpackb(message["bytes"], raw=False)
+        if message.get("text") is not None:
+            return json.loads(message["text"])
+        return None
+
+    def frame(self, id: str, message: dict) -> dict:
+        """Build the outbound frame for `message`, delta-encoded against the last one sent for `id`."""
+        previous = self._last.get(id)
+        self._last[id] = dict(message)
+        if not self.delta or previous is None or previous.get("status") != message.get("status"):
+            return {"id": id, "t": "full", **message}
+        changed = {k: v for k, v in message.items() if previous.get(k) != v}
+        unset = [k for k in previous if k not in message]
+        frame = {"id": id, "t": "delta", **changed}
+        if unset:
+            frame["unset"] = unset
+        return frame
+
+    def forget(self, id: str):
+        self._last.pop(id, None)
+
+    async def deliver(self, id: Optional[str], message: dict):
+        # deltas are computed at send time, against what this client actually received
+        await self.send_frame(message if id is None else self.frame(id, message))
+
+    async def send_frame(self, frame: dict):
+        if self.binary:
+            await self.websocket.send_bytes(msgpack.packb(frame, use_bin_type=True))
+        else:
+            await self.websocket.send_text(json.dumps(frame, separators=(",", ":")))
+
+
+class ChannelState:
+    """Replay buffer for one job: recent state changes plus its latest progress message."""
+
+    def __init__(self):
+        self.states: Deque[tuple] = deque(maxlen=WS_REPLAY_STATES)
+        self.progress: Optional[tuple] = None
+        self.seq = 0
+        self.updated = time.monotonic()
+
+    def record(self, message: dict):
+        self.seq += 1
+        self.updated = time.monotonic()
+        if is_progress(message):
+            self.progress = (self.seq, message)
+        else:
+            self.states.append((self.seq, message))
+
+    def replay(self) -> List[dict]:
+        items = list(self.states)
+        if self.progress and (not items or self.progress[0] > items[-1][0]):
+            items.append(self.progress)
+        return [m for _, m in sorted(items, key=lambda item: item[0])]
+
+
+class WSManager:
+    """
+    Channels keyed by job id. Each channel has any number of subscribers (per-id
+    sockets, multiplexed clients, several tabs) and a replay buffer, so a client that
+    subscribes late still receives the job's state changes and latest progress,
+    including a final finished/error event sent before it connected.
+    """
+
+    def __init__(self):
+        self.channels: Dict[str, Set[Connection]] = {}
+        self.history: "OrderedDict[str, ChannelState]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add_connection(self, id: str, websocket: WebSocket) -> Connection:
+        conn = Connection(websocket)
+        conn.start()
+        self.subscribe(conn, [id])
+        return conn
+
+    def remove_connection(self, id: str, conn: Connection):
+        self.unsubscribe(conn)
+        asyncio.ensure_future(conn.close())
+
+    def subscribe(self, conn: Connection, ids):
+        """Add `conn` to each channel and replay what the channel already carried."""
+        with self._lock:
+            replays = []
+            for id in ids:
+                conn.subscriptions.add(id)
+                self.channels.setdefault(id, set()).add(conn)
+                state = self.history.get(id)
+                if state:
+                    replays.append((id, state.replay()))
+        for id, messages in replays:
+            for message in messages:
+                conn.enqueue(id, message)
+
+    def unsubscribe(self, conn: Connection, ids=None):
+        with self._lock:
+            for id in list(ids if ids is not None else conn.subscriptions):
+                conn.subscriptions.discard(id)
+                conn.forget(id)
+                subs = self.channels.get(id)
+                if subs:
+                    subs.discard(conn)
+                    if not subs:
+                        del self.channels[id]
+
+    def _record(self, id: str, message: dict):
+        state = self.history.get(id)
+        if state is None:
+            state = self.history[id] = ChannelState()
+        state.record(message)
+        self.history.move_to_end(id)
+        # bound memory: drop the least recently updated channels
+        while len(self.history) > WS_REPLAY_CHANNELS:
+            self.history.popitem(last=False)
+
+    def reset_channel(self, id: str):
+        """Forget the replay buffer of `id` (a new job is starting under a reused id)."""
+        with self._lock:
+            self.history.pop(id, None)
+
+    def last_state(self, id: str) -> Optional[List[dict]]:
+        with self._lock:
+            state = self.history.get(id)
+            return state.replay() if state else None
+
+    # --- publishing ---
+    def publish(self, id: str, message: dict):
+        """Record and queue `message` for every subscriber of job `id` (event-loop thread; never blocks)."""
+        with self._lock:
+            self._record(id, message)
+            subscribers = list(self.channels.get(id, ()))
+        for conn in subscribers:
+            conn.enqueue(id, message)
+
+    def publish_threadsafe(self, id: str, message: dict, loop: asyncio.AbstractEventLoop):
+        """Publish from a worker thread without waiting on the event loop."""
+        try:
+            loop.call_soon_threadsafe(self.publish, id, message)
+        except RuntimeError:
+            # loop closed (shutdown)
+            pass
+
+    async def send(self, id: str, message: dict):
+        self.publish(id, message)
+
+
+ws_manager = WSManager()
@@ -1,6 +1,6 @@
 import React, { useState } from "react";
 import { useDownload } from "../context/DownloadContext";
-import { cancelDownload, getFormats, postStartDownload, wsUrl } from "../utils/api";
+import { cancelDownload, getFormats, postStartDownload, subscribeJob, thumbnailUrl } from "../utils/api";
 import "./DownloadPanel.css";
 import ToastContainer from "./ToastContainer";
 
@@ -116,10 +116,10 @@ export default function DownloadPanel() {
 
     try {
       await postStartDownload(url, item.id, selectedMode, selectedQuality);
-      const ws = new WebSocket(wsUrl(item.id));
+      const ws = subscribeJob(item.id);
 
       ws.onmessage = (event) => {
-        const data = JSON.parse(event.data);
+        const data = event.data;
         console.log("WebSocket message:", data);
 
         if (data.status === "downloading") {
@@ -378,7 +378,7 @@ export default function DownloadPanel() {
 
             {/* VIDEO CARD */}
             <div className="video-card-advanced">
-              <img src={videoInfo.thumbnail} alt="Thumbnail" className="video-thumbnail-advanced" />
+              <img src={thumbnailUrl({ src: videoInfo.thumbnail, width: 640 })} alt="Thumbnail" className="video-thumbnail-advanced" />
               <div className="video-info-advanced">
                 <h3 className="video-title-advanced">{videoInfo.title}</h3>
                 <div className="video-meta-advanced">
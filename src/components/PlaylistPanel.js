@@ -2,6 +2,7 @@ import React, { useState } from "react";
 import { useTheme } from "../context/ThemeContext";
 import "./PlaylistPanel.css";
 import ToastContainer from "./ToastContainer";
+import { getFormatsBatch, postStartTargetDownload, subscribeJob, thumbnailUrl } from "../utils/api";
 
 export default function PlaylistPanel() {
     const { theme } = useTheme(); // Changed from ThemeContext to useTheme
@@ -89,53 +90,23 @@ export default function PlaylistPanel() {
             try {
                 const downloadId = Date.now().toString() + Math.random().toString(36).substr(2, 9);
 
-                setDownloadProgress(prev => ({
-                    ...prev,
-                    [video.id]: { status: 'fetching', progress: 0, title: video.title }
-                }));
-
-                // Get formats
-                const formatsResponse = await fetch(
-                    `http://localhost:8000/formats?url=${encodeURIComponent(video.url)}`
-                );
-                const formatsData = await formatsResponse.json();
-
-                if (formatsData.error) {
-                    throw new Error(formatsData.message || "Failed to fetch formats");
-                }
-
-                // Find requested quality or best available
-                const selectedFormat = formatsData.video_formats.find(f => f.quality === quality)
-                    || formatsData.video_formats[0];
-
                 setDownloadProgress(prev => ({
                     ...prev,
                     [video.id]: { status: 'starting', progress: 5, title: video.title }
                 }));
 
-                // Start download
-                const downloadResponse = await fetch("http://localhost:8000/download", {
-                    method: "POST",
-                    headers: { "Content-Type": "application/json" },
-                    body: JSON.stringify({
-                        id: downloadId,
-                        url: video.url,
-                        mode: "video",
-                        format_id: selectedFormat.format_id,
-                    }),
-                });
-
-                const downloadData = await downloadResponse.json();
+                // The quality target is resolved server-side against the info warmed by /formats/batch
+                const downloadData = await postStartTargetDownload(video.url, downloadId, "video", quality);
 
                 if (downloadData.error) {
                     throw new Error(downloadData.error);
                 }
 
                 // Connect WebSocket for progress
-                const ws = new WebSocket(`ws://localhost:8000/ws/${downloadId}`);
+                const ws = subscribeJob(downloadId);
 
                 ws.onmessage = (event) => {
-                    const data = JSON.parse(event.data);
+                    const data = event.data;
 
                     if (data.status === "downloading") {
                         const progress = data.total_bytes
@@ -160,7 +131,12 @@ export default function PlaylistPanel() {
                         ws.close();
                         resolve();
                     } else if (data.status === "error") {
-                        throw new Error(data.error || "Download failed");
+                        setDownloadProgress(prev => ({
+                            ...prev,
+                            [video.id]: { status: 'error', progress: 0, error: data.error || "Download failed", title: video.title }
+                        }));
+                        ws.close();
+                        reject(new Error(data.error || "Download failed"));
                     }
                 };
 
@@ -194,7 +170,37 @@ export default function PlaylistPanel() {
         let completed = 0;
         let failed = 0;
 
+        // One /formats/batch request for every selected video instead of a /formats call each
+        setDownloadProgress(prev => {
+            const next = { ...prev };
+            videosToDownload.forEach(v => { next[v.id] = { status: 'fetching', progress: 0, title: v.title }; });
+            return next;
+        });
+        const formatErrors = {};
+        try {
+            await getFormatsBatch(videosToDownload.map(v => v.url), {
+                warm: true,
+                onResult: (result) => {
+                    const video = videosToDownload[result.index];
+                    if (!video || !result.error) return;
+                    formatErrors[video.id] = result.message || "Failed to fetch formats";
+                    setDownloadProgress(prev => ({
+                        ...prev,
+                        [video.id]: { status: 'error', progress: 0, error: formatErrors[video.id], title: video.title }
+                    }));
+                },
+            });
+        } catch (error) {
+            // downloads still extract on their own
+            console.error(error);
+        }
+
         for (const video of videosToDownload) {
+            if (formatErrors[video.id]) {
+                failed++;
+                showToast(`✗ Failed: ${video.title.substring(0, 30)}... - ${formatErrors[video.id]}`, "error", 4000);
+                continue;
+            }
             try {
                 await downloadSingleVideo(video);
                 completed++;
@@ -324,7 +330,7 @@ export default function PlaylistPanel() {
                                     />
                                     {video.thumbnail && (
                                         <img
-                                            src={video.thumbnail}
+                                            src={thumbnailUrl({ src: video.thumbnail, width: 160 })}
                                             alt={video.title}
                                             className="video-thumb"
                                             onError={(e) => e.target.style.display = 'none'}
@@ -1,6 +1,7 @@
 import React, { useState } from "react";
 import { useDownload } from "../context/DownloadContext";
 import ToastContainer from "./ToastContainer";
+import { subscribeJob } from "../utils/api";
 import "./TorrentPanel.css";
 
 export default function TorrentPanel() {
@@ -58,10 +59,10 @@ export default function TorrentPanel() {
             const data = await response.json();
 
             // Connect WebSocket
-            const ws = new WebSocket(`ws://localhost:8000/ws/torrent_${torrentId}`);
+            const ws = subscribeJob(`torrent_${torrentId}`);
 
             ws.onmessage = (event) => {
-                const data = JSON.parse(event.data);
+                const data = event.data;
                 console.log("Torrent progress:", data);
 
                 if (data.status === "metadata") {
@@ -7,6 +7,48 @@ export async function getFormats(url) {
   return await res.json();
 }
 
+// Formats for many urls in one request. The server streams NDJSON, one line per url
+// as soon as its extraction finishes; onResult gets each {index, url, ...} object.
+// With warm=true the server keeps the extracted info for the following /download.
+export async function getFormatsBatch(urls, { warm = false, onResult } = {}) {
+  const res = await fetch(`${BASE_URL}/formats/batch`, {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({ urls, warm }),
+  });
+  if (!res.ok) throw new Error("Failed to fetch formats");
+  const results = [];
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  const flush = (line) => {
+    if (!line.trim()) return;
+    const result = JSON.parse(line);
+    results.push(result);
+    if (onResult) onResult(result);
+  };
+  for (;;) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    const lines = buffer.split("\n");
+    buffer = lines.pop();
+    lines.forEach(flush);
+  }
+  flush(buffer + decoder.decode());
+  return results;
+}
+
+// Start a download with a quality target ("1080p", "720p av1 smallest") resolved server-side.
+export async function postStartTargetDownload(url, id, mode, target) {
+  const res = await fetch(`${BASE_URL}/download`, {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({ url, id, mode, target }),
+  });
+  return await res.json();
+}
+
 export async function postStartDownload(url, id, mode, format_id) {
   const res = await fetch(`${BASE_URL}/download`, {
     method: "POST",
@@ -25,6 +67,78 @@ export async function cancelDownload(id) {
   }).then(r => r.json());
 }
 
+// Thumbnail served from the backend's resized disk cache.
+// Pass the remote image url as `src`, or a video page url as `url`.
+export function thumbnailUrl({ src, url, width = 320, format = "webp" }) {
+  const key = src ? `src=${encodeURIComponent(src)}` : `url=${encodeURIComponent(url)}`;
+  return `${BASE_URL}/thumbnail/image?${key}&w=${width}&format=${format}`;
+}
+
 export function wsUrl(id) {
   return `${WS_URL}/ws/${id}`;
-}
\ No newline at end of file
+}
+// -------------------------
+// Multiplexed websocket: one shared connection for every job
+// -------------------------
+let muxSocket = null;
+const muxChannels = new Map(); // job id -> { state, listeners: Set }
+
+function muxSend(payload) {
+  if (muxSocket && muxSocket.readyState === WebSocket.OPEN) {
+    muxSocket.send(JSON.stringify(payload));
+  }
+}
+
+function ensureMuxSocket() {
+  if (muxSocket && muxSocket.readyState <= WebSocket.OPEN) return muxSocket;
+
+  muxSocket = new WebSocket(`${WS_URL}/ws?format=json&delta=true`);
+  muxSocket.onopen = () => {
+    const ids = Array.from(muxChannels.keys());
+    if (ids.length) muxSend({ op: "subscribe", ids });
+  };
+  muxSocket.onmessage = (event) => {
+    const frame = JSON.parse(event.data);
+    if (frame.op) return; // hello / subscribed acks
+    const channel = muxChannels.get(frame.id);
+    if (!channel) return;
+
+    const { id, t, unset, ...fields } = frame;
+    channel.state = t === "full" ? fields : { ...channel.state, ...fields };
+    (unset || []).forEach((key) => delete channel.state[key]);
+    channel.listeners.forEach((l) => l.onmessage && l.onmessage({ data: channel.state }));
+  };
+  muxSocket.onerror = (error) => {
+    muxChannels.forEach((channel) => channel.listeners.forEach((l) => l.onerror && l.onerror(error)));
+  };
+  muxSocket.onclose = () => {
+    muxSocket = null;
+    if (muxChannels.size) setTimeout(ensureMuxSocket, 1000);
+  };
+  return muxSocket;
+}
+
+// Subscribe to a job over the shared socket. Returns a WebSocket-like handle:
+// set onmessage/onerror; event.data is the job's current (delta-merged) state object.
+export function subscribeJob(id) {
+  const handle = { onmessage: null, onerror: null, close: () => unsubscribeJob(id, handle) };
+  let channel = muxChannels.get(id);
+  if (!channel) {
+    channel = { state: {}, listeners: new Set() };
+    muxChannels.set(id, channel);
+    ensureMuxSocket();
+    muxSend({ op: "subscribe", ids: [id] });
+  }
+  channel.listeners.add(handle);
+  return handle;
+}
+
+function unsubscribeJob(id, handle) {
+  const channel = muxChannels.get(id);
+  if (!channel) return;
+  channel.listeners.delete(handle);
+  if (channel.listeners.size === 0) {
+    muxChannels.delete(id);
+    muxSend({ op: "unsubscribe", ids: [id] });
+  }
+}